@@ -0,0 +1,71 @@
+"""Concurrent request load generator for a running Movie API instance.
+
+Usage:
+    uvicorn movie_app.main:app --port 8000
+    python -m benchmarks.load --url http://127.0.0.1:8000/movies/ --concurrency 50 --requests 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, url: str, queue: asyncio.Queue, latencies: list, errors: list):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        try:
+            response = await client.get(url)
+            if response.status_code >= 500:
+                errors.append(response.status_code)
+        except httpx.HTTPError as exc:
+            errors.append(type(exc).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(url: str, concurrency: int, requests: int, headers: dict | None = None,
+              transport: httpx.AsyncBaseTransport | None = None):
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, headers=headers, timeout=30, transport=transport) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, url, queue, latencies, errors) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", action="append", required=True)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--token", help="Bearer token for authenticated endpoints")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else None
+    for url in args.url:
+        print(asyncio.run(run(url, args.concurrency, args.requests, headers)))
+
+
+if __name__ == "__main__":
+    main()
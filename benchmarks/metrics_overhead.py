@@ -0,0 +1,88 @@
+"""Cost of the /metrics instrumentation per request and per query.
+
+Times Metrics.observe_request and observe_query directly, MetricsMiddleware
+around a bare ASGI app, and SELECT 1 on an in-memory SQLite engine with and
+without the engine events, then Metrics.render with `--routes` series.
+
+Usage:
+    python -m benchmarks.metrics_overhead
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import create_engine, text
+
+from movie_app.metrics import Metrics, metrics
+from movie_app.middleware import MetricsMiddleware
+
+
+def per_call_us(func, calls: int):
+    start = time.perf_counter_ns()
+    for i in range(calls):
+        func(i)
+    return round((time.perf_counter_ns() - start) / calls / 1000, 3)
+
+
+async def asgi_us(app, calls: int):
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        await app(scope, receive, send)
+    return round((time.perf_counter_ns() - start) / calls / 1000, 3)
+
+
+def query_us(instrumented: bool, calls: int):
+    # A sync engine, aiosqlite's thread hop varies by more than the events cost
+    engine = create_engine("sqlite://")
+    if instrumented:
+        Metrics().instrument(engine)
+    with engine.connect() as conn:
+        statement = text("SELECT 1")
+        conn.execute(statement)
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            conn.execute(statement)
+        elapsed = time.perf_counter_ns() - start
+    engine.dispose()
+    return round(elapsed / calls / 1000, 3)
+
+
+async def main(calls: int, routes: int):
+    bench = Metrics()
+    print({"observe_request_us": per_call_us(
+        lambda i: bench.observe_request("GET", f"/route/{i % routes}", 200, 0.003), calls)})
+    print({"observe_query_us": per_call_us(lambda i: bench.observe_query("SELECT", 0.0004), calls)})
+
+    async def bare(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    plain = await asgi_us(bare, calls)
+    wrapped = await asgi_us(MetricsMiddleware(bare), calls)
+    print({"asgi_bare_us": plain, "asgi_with_metrics_us": wrapped, "middleware_us": round(wrapped - plain, 3)})
+    metrics.__init__()
+
+    plain = query_us(False, calls)
+    instrumented = query_us(True, calls)
+    print({"select_1_us": plain, "select_1_instrumented_us": instrumented,
+           "events_us": round(instrumented - plain, 3)})
+
+    start = time.perf_counter_ns()
+    body = bench.render()
+    print({"render_ms": round((time.perf_counter_ns() - start) / 1e6, 2), "series_lines": body.count("\n")})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--routes", type=int, default=40)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.routes))
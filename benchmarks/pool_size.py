@@ -0,0 +1,104 @@
+"""Throughput per connection pool size, for each number of uvicorn workers.
+
+For every `--workers` count and `--pool-sizes` value, starts
+`uvicorn movie_app.main:app --workers W` with DB_POOL_SIZE set and
+DB_MAX_OVERFLOW=0, so the pool size is the whole per-worker limit, warms it
+up, then drives `--path` with benchmarks.load. Each row also has the mean
+pool checkout wait read from /metrics, which reports whichever worker
+answered. Combinations needing more than `--max-connections` server
+connections are skipped.
+
+The recommended pool size for a worker count is the smallest one within 5%
+of the best throughput measured for it, larger pools only hold more idle
+connections on the server.
+
+Usage:
+    DATABASE_URL=postgresql://app@localhost/movies python -m benchmarks.pool_size --workers 1 2 4 --pool-sizes 2 5 10 20
+"""
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.load import run
+
+
+def wait_until_up(base_url: str, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with {server.returncode}")
+        try:
+            if httpx.get(base_url + "/").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"uvicorn did not answer within {timeout} seconds")
+
+
+def checkout_wait_ms(base_url: str):
+    body = httpx.get(base_url + "/metrics").text
+    total = re.search(r"^db_pool_checkout_wait_seconds_sum (\S+)$", body, re.MULTILINE)
+    count = re.search(r"^db_pool_checkout_wait_seconds_count (\S+)$", body, re.MULTILINE)
+    if not total or not count or float(count.group(1)) == 0:
+        return None
+    return round(float(total.group(1)) / float(count.group(1)) * 1000, 3)
+
+
+def measure(workers: int, pool_size: int, port: int, path: str, concurrency: int, requests: int):
+    env = {**os.environ, "DB_POOL_SIZE": str(pool_size), "DB_MAX_OVERFLOW": "0"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "movie_app.main:app", "--port", str(port), "--workers", str(workers),
+         "--no-access-log", "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_up(base_url, server)
+        asyncio.run(run(base_url + path, concurrency, min(requests, 500)))
+        result = asyncio.run(run(base_url + path, concurrency, requests))
+        return {"workers": workers, "pool_size": pool_size, **result, "checkout_wait_ms": checkout_wait_ms(base_url)}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--max-connections", type=int, default=100,
+                        help="The database server's max_connections, minus what other clients use")
+    parser.add_argument("--path", default="/movies/")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        results = []
+        for pool_size in args.pool_sizes:
+            if workers * pool_size > args.max_connections:
+                print({"workers": workers, "pool_size": pool_size, "skipped": "over --max-connections"})
+                continue
+            result = measure(workers, pool_size, args.port, args.path, args.concurrency, args.requests)
+            print(result)
+            if not result["errors"]:
+                results.append(result)
+
+        if results:
+            best_rps = max(result["rps"] for result in results)
+            best = min((result for result in results if result["rps"] >= best_rps * 0.95),
+                       key=lambda result: result["pool_size"])
+            print({"workers": workers, "recommended_pool_size": best["pool_size"], "rps": best["rps"],
+                   "p99_ms": best["p99_ms"]})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Request latency while the log sinks are slow.
+
+Serves `/` in process through httpx.ASGITransport with LogMiddleware, logging
+to a stdout-like stream that takes `--write-ms` per record and to a Logtail
+handler uploading to a local stub collector that takes `--upload-ms` per
+batch. Runs once with the sinks attached to the root logger directly, the
+way movie_app.logger used to, and once behind its queue and listener.
+
+Usage:
+    python -m benchmarks.slow_log_sink --requests 3000 --write-ms 2 --upload-ms 500
+"""
+import argparse
+import asyncio
+import io
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from fastapi import FastAPI
+from logtail import LogtailHandler
+
+from benchmarks.load import run
+from movie_app.logger import BatchingQueueListener, DroppingQueueHandler, logger
+from movie_app.middleware import LogMiddleware
+
+
+class SlowStream(io.StringIO):
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return len(text)
+
+
+def stub_collector(delay: float):
+    class Collector(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(delay)
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Collector)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def app():
+    bench_app = FastAPI()
+    bench_app.add_middleware(LogMiddleware)
+
+    @bench_app.get("/")
+    async def index():
+        return {"message": "Welcome to Movie API"}
+
+    return bench_app
+
+
+async def main(requests: int, concurrency: int, write_ms: float, upload_ms: float, queue_size: int):
+    collector = stub_collector(upload_ms / 1000)
+    transport = httpx.ASGITransport(app=app())
+
+    def sinks():
+        return [
+            logging.StreamHandler(SlowStream(write_ms / 1000)),
+            LogtailHandler(source_token="bench", host=f"http://127.0.0.1:{collector.server_port}"),
+        ]
+
+    logger.handlers = sinks()
+    direct = await run("http://bench/", concurrency, requests, transport=transport)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    listener = BatchingQueueListener(log_queue, *sinks())
+    listener.start()
+    logger.handlers = [handler]
+    queued = await run("http://bench/", concurrency, requests, transport=transport)
+    logger.handlers = []
+    listener.stop()
+
+    for name, result in (("direct", direct), ("queued", queued)):
+        print({"logging": name, "rps": result["rps"], "p50_ms": result["p50_ms"], "p99_ms": result["p99_ms"]})
+    print({"enqueued": handler.enqueued, "dropped": handler.dropped, "processed": listener.processed,
+           "batches": listener.batches})
+    collector.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--write-ms", type=float, default=2)
+    parser.add_argument("--upload-ms", type=float, default=500)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.write_ms, args.upload_ms, args.queue_size))
@@ -0,0 +1,72 @@
+"""Build time and lookup latency of the in-process title suggestion index.
+
+Seeds `--movies` movies the same way as benchmarks.search, builds the index
+like the app does on startup, then times TitleSuggestions.suggest for random
+1-6 character prefixes of catalogue title words, and add/remove as called by
+the movie write endpoints.
+
+Usage:
+    python -m benchmarks.suggest --movies 1000000 --url sqlite+aiosqlite:////tmp/movie_search_bench.db
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from benchmarks.search import seed
+from movie_app.crud import movie_crud_service
+from movie_app.migrations import migrate
+from movie_app.suggest import title_suggestions
+
+
+def percentiles(timings):
+    cuts = statistics.quantiles(timings, n=100)
+    return {"p50_us": round(cuts[49], 1), "p99_us": round(cuts[98], 1)}
+
+
+async def main(movies: int, lookups: int, url: str):
+    engine = create_async_engine(url)
+    await migrate(engine)
+    await seed(engine, movies)
+
+    SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
+    start = time.perf_counter()
+    async with SessionLocal() as db:
+        await movie_crud_service.load_title_suggestions(db)
+    print({"titles": len(title_suggestions), "build_seconds": round(time.perf_counter() - start, 1)})
+    await engine.dispose()
+
+    rng = random.Random(3)
+    titles = list(title_suggestions._titles.values())
+    prefixes = []
+    for _ in range(lookups):
+        word = rng.choice(rng.choice(titles).split())
+        prefixes.append(word[:rng.randint(1, 6)])
+
+    timings = []
+    for prefix in prefixes:
+        start = time.perf_counter_ns()
+        title_suggestions.suggest(prefix)
+        timings.append((time.perf_counter_ns() - start) / 1000)
+    print({"operation": "suggest", **percentiles(timings)})
+
+    timings = []
+    for i in range(1000):
+        start = time.perf_counter_ns()
+        title_suggestions.add(-i - 1, rng.choice(titles))
+        timings.append((time.perf_counter_ns() - start) / 1000)
+    for i in range(1000):
+        title_suggestions.remove(-i - 1)
+    print({"operation": "add", **percentiles(timings)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--url", default="sqlite+aiosqlite:////tmp/movie_search_bench.db")
+    args = parser.parse_args()
+    asyncio.run(main(args.movies, args.lookups, args.url))
@@ -0,0 +1,79 @@
+"""Round trips and latency of the email-or-username user lookup.
+
+Compares the old two-step lookup (email, then username on a miss) with the
+single OR query in UserCRUDService.get_user_by_email_or_username.
+
+Usage:
+    python -m benchmarks.user_lookup --users 10000 --lookups 2000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import movie_app.models as models
+from movie_app.crud import user_crud_service
+from movie_app.database import Base
+
+
+async def two_step_lookup(db, credentials):
+    user = await user_crud_service.get_user_by_email(db, credentials)
+    if not user:
+        user = await user_crud_service.get_user_by_username(db, credentials)
+    return user
+
+
+async def single_query_lookup(db, credentials):
+    return await user_crud_service.get_user_by_email_or_username(db, credentials)
+
+
+async def main(users: int, lookups: int, url: str):
+    engine = create_async_engine(url)
+    statements = 0
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(models.User), [
+            {"email": f"user{i}@example.com", "username": f"user{i}", "full_name": f"User {i}", "hashed_password": "x"}
+            for i in range(users)
+        ])
+
+    SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
+    cases = {
+        "email": lambda i: f"user{i % users}@example.com",
+        "username": lambda i: f"user{i % users}",
+        "miss": lambda i: f"nobody{i}",
+    }
+    for name, lookup in (("two_step", two_step_lookup), ("single_query", single_query_lookup)):
+        for case, credentials in cases.items():
+            async with SessionLocal() as db:
+                statements = 0
+                start = time.perf_counter()
+                for i in range(lookups):
+                    await lookup(db, credentials(i))
+                elapsed = time.perf_counter() - start
+            print({
+                "lookup": name,
+                "case": case,
+                "round_trips_per_lookup": statements / lookups,
+                "us_per_lookup": round(elapsed / lookups * 1e6, 1),
+            })
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--url", default="sqlite+aiosqlite://")
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.lookups, args.url))
@@ -2,14 +2,14 @@ import os
 
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 
 from movie_app.crud import user_crud_service
-from movie_app.database import SessionLocal, get_db
+from movie_app.database import get_db
+from movie_app.hashing import hashing_pool
 
 load_dotenv()
 
@@ -17,23 +17,22 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRES_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRES_MINUTES"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await hashing_pool.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await hashing_pool.hash(password)
 
 
-def authenticate_user(db: Session, credentials: str, password: str):
-    user = user_crud_service.get_user_by_email_or_username(db, credentials)
+async def authenticate_user(db: AsyncSession, credentials: str, password: str):
+    user = await user_crud_service.get_user_by_email_or_username(db, credentials)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -49,7 +48,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-async def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
@@ -62,7 +61,9 @@ async def get_current_user(db: Session = Depends(get_db), token: str = Depends(o
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = user_crud_service.get_user_by_email_or_username(db, username)
-    if user is None:
+
+    # Repeat requests from the same principal skip the user lookup
+    principal = await user_crud_service.get_principal(db, username)
+    if principal is None:
         raise credentials_exception
-    return user
+    return principal
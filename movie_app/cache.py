@@ -0,0 +1,245 @@
+import asyncio
+import functools
+import inspect
+import os
+import time
+from collections import OrderedDict
+import orjson
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "memory" is per process, writes only invalidate the worker that handled
+# them. Run "redis" when serving with more than one worker
+READ_CACHE_BACKEND = os.getenv("READ_CACHE_BACKEND", "memory")
+# With the "memory" backend, other workers keep accepting a deleted account's
+# token, and serve a renamed one's old details, for up to this long
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", 1024))
+PRINCIPAL_CACHE_BACKEND = os.getenv("PRINCIPAL_CACHE_BACKEND", READ_CACHE_BACKEND)
+READ_CACHE_MAX_SIZE = int(os.getenv("READ_CACHE_MAX_SIZE", 10000))
+READ_CACHE_TTL_SECONDS = float(os.getenv("READ_CACHE_TTL_SECONDS", 300))
+# Rating totals change with every rating, keep them for less
+RATING_STATS_CACHE_TTL_SECONDS = float(os.getenv("RATING_STATS_CACHE_TTL_SECONDS", 30))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+# What backends return for absent keys, a cached None is a result like any other
+MISSING = object()
+
+
+class MemoryBackend:
+    """Per-process LRU store for ReadThroughCache, each key with its own TTL.
+
+    Not shared between workers: after a write, the other workers keep their
+    entries until the TTL runs out. Versioned reads still reload, reads
+    without a version may be stale for that long.
+    """
+
+    def __init__(self, maxsize: int = READ_CACHE_MAX_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: float):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def delete_prefix(self, prefix: str):
+        for key in [key for key in self._data if key.startswith(prefix)]:
+            del self._data[key]
+
+    def size(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    """ReadThroughCache store shared by every worker, on a redis.asyncio client.
+
+    Values are stored as JSON under `prefix`, expiry is left to Redis.
+    """
+
+    def __init__(self, client, prefix: str = "movie_app:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            return MISSING
+        return orjson.loads(raw)
+
+    async def set(self, key: str, value, ttl: float):
+        await self.client.set(self.prefix + key, orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS),
+                              px=max(int(ttl * 1000), 1))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def delete_prefix(self, prefix: str):
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + prefix + "*")]
+        if keys:
+            await self.client.delete(*keys)
+
+    def size(self):
+        return None
+
+
+class ReadThroughCache:
+    """Caches what the decorated CRUD reads return, keyed on their arguments.
+
+    Results go through a response schema and are stored as JSON compatible
+    data, so hits never touch the database session. Concurrent misses of one
+    key share a single load. Writers call invalidate() after committing, a
+    load that was running at the time is not stored.
+
+    Callers that send an ETag pass the `version` it was computed from. Each
+    entry keeps the version it was loaded under and is reloaded when that
+    differs, so a body is never older than the version it is served with,
+    whether or not this process saw the write.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._inflight = {}
+        self._stats = {}
+
+    def _count(self, namespace: str, outcome: str):
+        counts = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0})
+        counts[outcome] += 1
+
+    def cached(self, namespace: str, ttl: float = READ_CACHE_TTL_SECONDS, schema=None):
+        """Cache an async CRUD read for `ttl` seconds under `namespace`.
+
+        The `db` argument is left out of the key. `schema` converts ORM
+        results, without one the result must already be JSON compatible.
+        The wrapper takes an extra keyword-only `version`, a cached entry
+        loaded under another version is not returned. The undecorated
+        function stays reachable as `.uncached`.
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            def dump(result):
+                if result is None or schema is None:
+                    return result
+                return schema.model_validate(result, from_attributes=True).model_dump(mode="json")
+
+            def load(data):
+                if data is None or schema is None:
+                    return data
+                return schema.model_validate(data)
+
+            @functools.wraps(func)
+            async def wrapper(*args, version=None, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = ":".join([namespace, *(str(value) for name, value in bound.arguments.items() if name != "db")])
+                # Rows of updated_at values, compared as strings so they survive JSON backends
+                version = None if version is None else str(tuple(version))
+                return load(await self._get_or_load(namespace, key, ttl, lambda: func(*args, **kwargs), dump, version))
+
+            wrapper.uncached = func
+            return wrapper
+        return decorator
+
+    async def _get_or_load(self, namespace: str, key: str, ttl: float, loader, dump, version: str = None):
+        # A load started under another version may have read the rows before
+        # this caller's version was looked up, only share loads of the same one
+        inflight_key = key if version is None else f"{key}@{version}"
+        while True:
+            entry = await self.backend.get(key)
+            if entry is not MISSING:
+                loaded_version, data = entry
+                if version is None or loaded_version == version:
+                    self._count(namespace, "hits")
+                    return data
+                self._count(namespace, "stale")
+
+            future = self._inflight.get(inflight_key)
+            if future is None:
+                break
+            self._count(namespace, "coalesced")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The loading request went away, try again unless this one did too
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        self._count(namespace, "misses")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[inflight_key] = future
+        try:
+            data = dump(await loader())
+            # Invalidated while loading, the result may predate the write
+            if self._inflight.get(inflight_key) is future:
+                # Loaded after the version was read, so at least that recent
+                await self.backend.set(key, [version, data], ttl)
+            future.set_result(data)
+            return data
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            if self._inflight.get(inflight_key) is future:
+                del self._inflight[inflight_key]
+
+    async def invalidate(self, namespace: str, *args):
+        key = ":".join([namespace, *(str(arg) for arg in args)])
+        for inflight_key in [inflight_key for inflight_key in self._inflight
+                             if inflight_key == key or inflight_key.startswith(f"{key}@")]:
+            del self._inflight[inflight_key]
+        await self.backend.delete(key)
+
+    async def clear(self, namespace: str = ""):
+        prefix = f"{namespace}:" if namespace else ""
+        for key in [key for key in self._inflight if key.startswith(prefix)]:
+            del self._inflight[key]
+        await self.backend.delete_prefix(prefix)
+
+    def reset_stats(self):
+        self._stats = {}
+
+    def stats(self):
+        namespaces = {}
+        for namespace, counts in self._stats.items():
+            lookups = counts["hits"] + counts["misses"] + counts["coalesced"]
+            namespaces[namespace] = {
+                **counts,
+                "hit_ratio": (counts["hits"] + counts["coalesced"]) / lookups if lookups else 0.0,
+            }
+        return {"backend": type(self.backend).__name__, "size": self.backend.size(), "namespaces": namespaces}
+
+
+def create_backend(kind: str = READ_CACHE_BACKEND, maxsize: int = READ_CACHE_MAX_SIZE):
+    if kind == "redis":
+        import redis.asyncio as redis
+        return RedisBackend(redis.from_url(REDIS_URL))
+    return MemoryBackend(maxsize)
+
+
+# Movies, rating stats and comments by id, see the CRUD services
+read_cache = ReadThroughCache(create_backend())
+# Authenticated principals keyed by token subject, see auth.get_current_user
+principal_cache = ReadThroughCache(create_backend(PRINCIPAL_CACHE_BACKEND, PRINCIPAL_CACHE_MAX_SIZE))
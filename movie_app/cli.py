@@ -0,0 +1,104 @@
+"""Maintenance commands for the Movie API database.
+
+Usage:
+    python -m movie_app.cli migrate                 # apply pending schema migrations
+    python -m movie_app.cli rating-stats            # report drift
+    python -m movie_app.cli rating-stats --rebuild  # report and repair drift
+    python -m movie_app.cli reply-counts [--rebuild]  # same for comments.reply_count
+    python -m movie_app.cli user-duplicates [--unique-indexes]  # accounts differing only in case
+"""
+import argparse
+import asyncio
+import sys
+
+from movie_app.crud import comment_crud_service, rating_crud_service, user_crud_service
+from movie_app.database import SessionLocal, engine
+from movie_app.migrations import migrate as apply_migrations
+from movie_app.migrations import v0008_unique_lower_user_indexes
+
+
+async def migrate(args):
+    applied = await apply_migrations(engine)
+    for version, name in applied:
+        print(f"applied {version:04d} {name}")
+    print(f"{len(applied)} migration(s) applied, schema is up to date")
+    return 0
+
+
+async def rating_stats(args):
+    async with SessionLocal() as db:
+        drift = await rating_crud_service.check_rating_stats(db, rebuild=args.rebuild)
+
+    for item in drift:
+        print(f"movie {item['movie_id']}: stored {item['stored']} expected {item['expected']}")
+    print(f"{len(drift)} movie(s) out of sync" + (", rebuilt" if args.rebuild and drift else ""))
+
+    # A plain verify run fails when drift is found so it can gate deploys
+    return 1 if drift and not args.rebuild else 0
+
+
+async def reply_counts(args):
+    async with SessionLocal() as db:
+        drift = await comment_crud_service.check_reply_counts(db, rebuild=args.rebuild)
+
+    for item in drift:
+        print(f"comment {item['comment_id']}: stored {item['stored']} expected {item['expected']}")
+    print(f"{len(drift)} comment(s) out of sync" + (", rebuilt" if args.rebuild and drift else ""))
+
+    return 1 if drift and not args.rebuild else 0
+
+
+async def user_duplicates(args):
+    async with SessionLocal() as db:
+        duplicates = await user_crud_service.get_case_insensitive_duplicates(db)
+
+    for item in duplicates:
+        print(f"{item['column']} {item['value']!r}: {item['count']} accounts")
+    print(f"{len(duplicates)} email(s)/username(s) shared by accounts differing only in case")
+    if duplicates:
+        return 1
+
+    # Migration 0008 leaves the indexes non-unique while duplicates exist
+    if args.unique_indexes:
+        async with engine.begin() as conn:
+            await conn.run_sync(v0008_unique_lower_user_indexes.make_unique)
+        print("ix_users_lower_email and ix_users_lower_username are unique")
+    return 0
+
+
+async def run(args):
+    try:
+        return await args.command(args)
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Apply pending schema migrations")
+    migrate_parser.set_defaults(command=migrate)
+
+    stats_parser = subparsers.add_parser(
+        "rating-stats", help="Verify movie_rating_stats against the ratings table")
+    stats_parser.add_argument("--rebuild", action="store_true", help="Recompute drifted rows")
+    stats_parser.set_defaults(command=rating_stats)
+
+    replies_parser = subparsers.add_parser(
+        "reply-counts", help="Verify comments.reply_count against the stored replies")
+    replies_parser.add_argument("--rebuild", action="store_true", help="Recompute drifted rows")
+    replies_parser.set_defaults(command=reply_counts)
+
+    duplicates_parser = subparsers.add_parser(
+        "user-duplicates", help="List emails and usernames shared by accounts differing only in case")
+    duplicates_parser.add_argument("--unique-indexes", action="store_true",
+                                   help="Make the lower() indexes unique when there are none")
+    duplicates_parser.set_defaults(command=user_duplicates)
+
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
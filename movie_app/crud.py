@@ -1,9 +1,38 @@
+import os
+import re
 from math import floor
-import statistics
-from sqlalchemy import func, select
-from sqlalchemy.orm import Session
+from sqlalchemy import Integer, and_, column, delete, func, literal_column, or_, select, table, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload, selectinload
+from movie_app.cache import PRINCIPAL_CACHE_TTL_SECONDS, RATING_STATS_CACHE_TTL_SECONDS, principal_cache, read_cache
+from movie_app.leaderboard import leaderboards
+from movie_app.logger import logger
 import movie_app.models as models
 import movie_app.schemas as schemas
+from movie_app.pagination import paginate
+from movie_app.suggest import title_suggestions
+from movie_app.trigram import title_index
+
+USER_LOOKUP_CASE_INSENSITIVE = os.getenv("USER_LOOKUP_CASE_INSENSITIVE", "false").lower() == "true"
+
+# Users nested in the response schemas are joined into the same statement,
+# so serializing a page never lazy loads one owner/user/author per row
+MOVIE_LOAD_OPTIONS = (joinedload(models.Movie.owner),)
+RATING_LOAD_OPTIONS = (joinedload(models.Rating.user),)
+COMMENT_LOAD_OPTIONS = (joinedload(models.Comment.author),)
+
+
+def search_terms(text: str):
+    # Plain words only, so user input can't inject tsquery/FTS5 syntax
+    return re.findall(r"\w+", text.lower())
+
+
+def get_insert(db: AsyncSession):
+    # ON CONFLICT support lives in the dialect specific insert constructs
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
 
 # User CRUD Operations
 
@@ -11,7 +40,7 @@ import movie_app.schemas as schemas
 class UserCRUDService:
 
     @staticmethod
-    def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    async def create_user(db: AsyncSession, user: schemas.UserCreate, hashed_password: str):
         db_user = models.User(
             email=user.email,
             username=user.username,
@@ -20,58 +49,153 @@ class UserCRUDService:
         )
 
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        # Subjects nobody had are cached too
+        await user_crud_service.invalidate_principal(db_user.username, db_user.email)
         return db_user
 
     @staticmethod
-    def get_users(db: Session, offset: int = 0, limit: int = 10):
-        return db.query(models.User).offset(offset).limit(limit).all()
+    async def get_users(db: AsyncSession, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.User)
+        result = await db.execute(paginate(query, models.User, offset, limit, cursor))
+        return result.scalars().all()
 
     @staticmethod
-    def get_user_by_id(db: Session, user_id: int):
-        return db.query(models.User).filter(models.User.id == user_id).first()
+    async def get_user_by_id(db: AsyncSession, user_id: int):
+        result = await db.execute(select(models.User).where(models.User.id == user_id))
+        return result.scalars().first()
 
     @staticmethod
-    def get_user_by_username(db: Session, username: str):
-        return db.query(models.User).filter(models.User.username == username).first()
+    async def get_user_by_username(db: AsyncSession, username: str):
+        result = await db.execute(select(models.User).where(models.User.username == username))
+        return result.scalars().first()
 
     @staticmethod
-    def get_user_by_email(db: Session, email: str):
-        return db.query(models.User).filter(models.User.email == email).first()
+    async def get_user_by_email(db: AsyncSession, email: str):
+        result = await db.execute(select(models.User).where(models.User.email == email))
+        return result.scalars().first()
 
     @staticmethod
-    def get_user_by_email_or_username(db: Session, credentials: str):
-        user = user_crud_service.get_user_by_email(db, credentials)
-        if not user:
-            user = user_crud_service.get_user_by_username(db, credentials)
-        if not user:
+    async def get_user_by_email_or_username(db: AsyncSession, credentials: str, case_insensitive: bool = None):
+        # One round trip, served by the email and username indexes
+        if case_insensitive is None:
+            case_insensitive = USER_LOOKUP_CASE_INSENSITIVE
+        if case_insensitive:
+            credentials = credentials.lower()
+            query = select(models.User).where(or_(
+                func.lower(models.User.email) == credentials,
+                func.lower(models.User.username) == credentials
+            ))
+        else:
+            query = select(models.User).where(or_(
+                models.User.email == credentials,
+                models.User.username == credentials
+            ))
+        result = await db.execute(query.order_by(models.User.id))
+        users = result.scalars().all()
+
+        # Both columns are unique, ignoring case too since migration 0008, so
+        # there are at most two matches. An email match wins
+        for user in users:
+            email = user.email.lower() if case_insensitive else user.email
+            if email == credentials:
+                return user
+        return users[0] if users else None
+
+    @staticmethod
+    @principal_cache.cached("principal", ttl=PRINCIPAL_CACHE_TTL_SECONDS, schema=schemas.User)
+    async def get_principal(db: AsyncSession, subject: str):
+        # The user a token's subject resolves to, see auth.get_current_user
+        return await user_crud_service.get_user_by_email_or_username(db, subject)
+
+    @staticmethod
+    async def get_conflicting_user(db: AsyncSession, email: str = None, username: str = None, exclude_id: int = None):
+        # An account whose email or username is taken by either value, ignoring
+        # case like ix_users_lower_email/ix_users_lower_username do
+        values = [value.lower() for value in (email, username) if value is not None]
+        if not values:
             return None
-        return user
+        query = select(models.User).where(or_(
+            func.lower(models.User.email).in_(values),
+            func.lower(models.User.username).in_(values)
+        ))
+        if exclude_id is not None:
+            query = query.where(models.User.id != exclude_id)
+        result = await db.execute(query.order_by(models.User.id).limit(1))
+        return result.scalars().first()
+
+    @staticmethod
+    async def get_case_insensitive_duplicates(db: AsyncSession):
+        # Accounts created before migration 0008 may differ only in case
+        duplicates = []
+        for column in (models.User.email, models.User.username):
+            result = await db.execute(
+                select(func.lower(column), func.count())
+                .group_by(func.lower(column))
+                .having(func.count() > 1)
+                .order_by(func.lower(column))
+            )
+            duplicates.extend({"column": column.key, "value": value, "count": count} for value, count in result.all())
+        return duplicates
+
+    @staticmethod
+    async def check_case_insensitive_lookup(db: AsyncSession):
+        """Turn USER_LOOKUP_CASE_INSENSITIVE off while accounts differ only in case.
+
+        Either of them could match a login, so one of them could never log in.
+        """
+        global USER_LOOKUP_CASE_INSENSITIVE
+        if not USER_LOOKUP_CASE_INSENSITIVE:
+            return []
+        duplicates = await user_crud_service.get_case_insensitive_duplicates(db)
+        if duplicates:
+            USER_LOOKUP_CASE_INSENSITIVE = False
+            logger.error(f"USER_LOOKUP_CASE_INSENSITIVE is ignored, {len(duplicates)} email(s)/username(s) are shared "
+                         "by accounts differing only in case, see python -m movie_app.cli user-duplicates")
+        return duplicates
 
     @staticmethod
-    def update_user(db: Session, user_id: int, user_payload: schemas.UserUpdate):
-        user = user_crud_service.get_user_by_id(db, user_id)
+    async def invalidate_principal(*keys: str):
+        # Tokens carry the username as subject, but email logins resolve too
+        for key in keys:
+            await principal_cache.invalidate("principal", key)
+
+    @staticmethod
+    async def invalidate_nested_user():
+        # Cached movies and comments embed their owner/author, user writes are rare
+        await read_cache.clear("movie")
+        await read_cache.clear("comment")
+
+    @staticmethod
+    async def update_user(db: AsyncSession, user_id: int, user_payload: schemas.UserUpdate):
+        user = await user_crud_service.get_user_by_id(db, user_id)
         if not user:
             return None
 
+        principal_keys = (user.username, user.email)
         user_payload_dict = user_payload.model_dump(exclude_unset=True)
 
         for key, value in user_payload_dict.items():
             setattr(user, key, value)
 
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
+        await user_crud_service.invalidate_principal(*principal_keys)
+        await user_crud_service.invalidate_nested_user()
 
         return user
 
     @staticmethod
-    def delete_user(db: Session, user_id: int):
-        user = user_crud_service.get_user_by_id(db, user_id)
+    async def delete_user(db: AsyncSession, user_id: int):
+        user = await user_crud_service.get_user_by_id(db, user_id)
+        principal_keys = (user.username, user.email)
 
-        db.delete(user)
-        db.commit()
+        await db.delete(user)
+        await db.commit()
+        await user_crud_service.invalidate_principal(*principal_keys)
+        await user_crud_service.invalidate_nested_user()
 
         return None
 
@@ -81,35 +205,173 @@ class UserCRUDService:
 class MovieCRUDService:
 
     @staticmethod
-    def create_movie(db: Session, movie: schemas.MovieCreate, user_id: int):
+    async def create_movie(db: AsyncSession, movie: schemas.MovieCreate, user_id: int):
         db_movie = models.Movie(
             **movie.model_dump(),
             user_id=user_id
         )
         db.add(db_movie)
-        db.commit()
-        db.refresh(db_movie)
-        return db_movie
+        await db.commit()
+        await read_cache.invalidate("movie", db_movie.id)
+        title_suggestions.add(db_movie.id, db_movie.title)
+        if title_index.loaded:
+            title_index.add(db_movie.id, db_movie.title)
+        return await db.get(models.Movie, db_movie.id, options=MOVIE_LOAD_OPTIONS, populate_existing=True)
+
+    @staticmethod
+    async def get_movies(db: AsyncSession, offset: int = 0, limit: int = 10, cursor: str = None,
+                         filters: schemas.MovieListFilters = None, sort: str = None):
+        # One statement for every filter combination, filters.plan_movie_list
+        # decides which combinations are allowed
+        query = select(models.Movie).options(*MOVIE_LOAD_OPTIONS)
+        filters = filters or schemas.MovieListFilters()
+
+        if len(filters.genre) == 1:
+            query = query.where(models.Movie.genre == filters.genre[0])
+        elif filters.genre:
+            query = query.where(models.Movie.genre.in_(filters.genre))
+        if filters.owner_id is not None:
+            query = query.where(models.Movie.user_id == filters.owner_id)
+        if filters.year_from is not None:
+            query = query.where(models.Movie.release_year >= filters.year_from)
+        if filters.year_to is not None:
+            query = query.where(models.Movie.release_year <= filters.year_to)
+
+        # Averages come from the running totals, never from the ratings table
+        stats = models.MovieRatingStats
+        average = stats.rating_sum * 1.0 / func.nullif(stats.rating_count, 0)
+        if filters.min_rating is not None:
+            query = query.join(stats, stats.movie_id == models.Movie.id).where(average >= filters.min_rating)
+        elif sort == "rating":
+            query = query.outerjoin(stats, stats.movie_id == models.Movie.id)
+
+        if sort is None:
+            query = paginate(query, models.Movie, offset, limit, cursor)
+        else:
+            order = {
+                "newest": (models.Movie.created_at.desc(), models.Movie.id.desc()),
+                "title": (models.Movie.title, models.Movie.id),
+                "rating": (average.desc().nulls_last(), models.Movie.id),
+            }[sort]
+            query = query.order_by(*order).offset(offset).limit(limit)
+
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    @staticmethod
+    @read_cache.cached("movie", schema=schemas.Movie)
+    async def get_movie_by_id(db: AsyncSession, movie_id: int):
+        result = await db.execute(select(models.Movie).options(*MOVIE_LOAD_OPTIONS).where(models.Movie.id == movie_id))
+        return result.scalars().first()
+
+    @staticmethod
+    async def get_movie_version(db: AsyncSession, movie_id: int):
+        # Everything GET /movies/{movie_id} returns, for its ETag
+        result = await db.execute(
+            select(models.Movie.updated_at, models.User.updated_at)
+            .outerjoin(models.User, models.User.id == models.Movie.user_id)
+            .where(models.Movie.id == movie_id)
+        )
+        return result.first()
 
     @staticmethod
-    def get_movies(db: Session, offset: int = 0, limit: int = 10):
-        return db.query(models.Movie).offset(offset).limit(limit).all()
+    async def get_movie_by_title(db: AsyncSession, title: str, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.Movie).options(*MOVIE_LOAD_OPTIONS).where(models.Movie.title == title)
+        result = await db.execute(paginate(query, models.Movie, offset, limit, cursor))
+        return result.scalars().all()
 
     @staticmethod
-    def get_movie_by_id(db: Session, movie_id: int):
-        return db.query(models.Movie).filter(models.Movie.id == movie_id).first()
+    async def load_title_suggestions(db: AsyncSession):
+        result = await db.execute(select(models.Movie.id, models.Movie.title))
+        title_suggestions.build(result.all())
+        return len(title_suggestions)
 
     @staticmethod
-    def get_movie_by_title(db: Session, title: str, offset: int = 0, limit: int = 10):
-        return db.query(models.Movie).filter(models.Movie.title == title).offset(offset).limit(limit).all()
+    async def get_similar_titles(db: AsyncSession, title: str, limit: int = 10):
+        # Typo tolerant title lookup, best (Movie, score) pairs first. Scores
+        # are pg_trgm similarity() and below its 0.3 threshold nothing matches
+        if db.get_bind().dialect.name == "postgresql":
+            score = func.similarity(models.Movie.title, title)
+            query = (
+                select(models.Movie, score.label("score"))
+                .options(*MOVIE_LOAD_OPTIONS)
+                .where(models.Movie.title.op("%")(title))
+                .order_by(score.desc(), models.Movie.id)
+                .limit(limit)
+            )
+            result = await db.execute(query)
+            return result.all()
+
+        if not title_index.loaded:
+            result = await db.execute(select(models.Movie.id, models.Movie.title))
+            title_index.build(result.all())
+        matches = title_index.search(title, limit)
+        if not matches:
+            return []
+
+        result = await db.execute(
+            select(models.Movie).options(*MOVIE_LOAD_OPTIONS)
+            .where(models.Movie.id.in_([movie_id for movie_id, _ in matches]))
+        )
+        movies = {movie.id: movie for movie in result.scalars()}
+        return [(movies[movie_id], score) for movie_id, score in matches if movie_id in movies]
+
+    @staticmethod
+    async def search_movies(db: AsyncSession, text: str, prefix: bool = True, offset: int = 0, limit: int = 10):
+        # Ranked full-text search over title and description, see migration 0004.
+        # Every term must match, as a word prefix when `prefix` is set
+        terms = search_terms(text)
+        if not terms:
+            return []
+
+        if db.get_bind().dialect.name == "postgresql":
+            search_vector = literal_column("movies.search_vector")
+            tsquery = func.to_tsquery(
+                "english", " & ".join(term + (":*" if prefix else "") for term in terms))
+            score = func.ts_rank_cd(search_vector, tsquery)
+            match = search_vector.op("@@")(tsquery)
+            query = select(models.Movie, score.label("score")).where(match)
+        else:
+            movies_fts = table("movies_fts", column("rowid"))
+            match = " AND ".join(f'"{term}"' + ("*" if prefix else "") for term in terms)
+            # bm25 is lower for better matches, titles count ten times descriptions.
+            # Rank and page inside the FTS table so only one page is joined to movies
+            score = -func.bm25(literal_column("movies_fts"), 10.0, 1.0)
+            ranked = (
+                select(movies_fts.c.rowid, score.label("score"))
+                .where(literal_column("movies_fts").op("MATCH")(match))
+                .order_by(score.desc(), movies_fts.c.rowid)
+                .offset(offset)
+                .limit(limit)
+                .subquery()
+            )
+            query = (
+                select(models.Movie, ranked.c.score)
+                .join(ranked, ranked.c.rowid == models.Movie.id)
+                .options(*MOVIE_LOAD_OPTIONS)
+                .order_by(ranked.c.score.desc(), models.Movie.id)
+            )
+            result = await db.execute(query)
+            return result.all()
+
+        query = (
+            query.options(*MOVIE_LOAD_OPTIONS)
+            .order_by(score.desc(), models.Movie.id)
+            .offset(offset)
+            .limit(limit)
+        )
+        result = await db.execute(query)
+        return result.all()
 
     @staticmethod
-    def get_movie_by_genre(db: Session, genre: str, offset: int = 0, limit: int = 10):
-        return db.query(models.Movie).filter(models.Movie.genre == genre).offset(offset).limit(limit).all()
+    async def get_movie_by_genre(db: AsyncSession, genre: str, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.Movie).options(*MOVIE_LOAD_OPTIONS).where(models.Movie.genre == genre)
+        result = await db.execute(paginate(query, models.Movie, offset, limit, cursor))
+        return result.scalars().all()
 
     @staticmethod
-    def update_movie(db: Session, movie_payload: schemas.MovieUpdate, movie_id: int):
-        movie = movie_crud_service.get_movie_by_id(db, movie_id)
+    async def update_movie(db: AsyncSession, movie_payload: schemas.MovieUpdate, movie_id: int):
+        movie = await movie_crud_service.get_movie_by_id.uncached(db, movie_id)
         if not movie:
             return None
 
@@ -119,16 +381,28 @@ class MovieCRUDService:
             setattr(movie, k, v)
 
         db.add(movie)
-        db.commit()
-        db.refresh(movie)
-        return movie
-
-    @staticmethod
-    def delete_movie(db: Session, movie_id: int = None):
-        movie = movie_crud_service.get_movie_by_id(db, movie_id)
-
-        db.delete(movie)
-        db.commit()
+        await db.commit()
+        await read_cache.invalidate("movie", movie.id)
+        title_suggestions.add(movie.id, movie.title)
+        leaderboards.mark_dirty()
+        if title_index.loaded:
+            title_index.add(movie.id, movie.title)
+        return await db.get(models.Movie, movie.id, options=MOVIE_LOAD_OPTIONS, populate_existing=True)
+
+    @staticmethod
+    async def delete_movie(db: AsyncSession, movie_id: int = None):
+        movie = await movie_crud_service.get_movie_by_id.uncached(db, movie_id)
+
+        await db.execute(delete(models.MovieRatingStats).where(models.MovieRatingStats.movie_id == movie_id))
+        await db.delete(movie)
+        await db.commit()
+        await read_cache.invalidate("movie", movie_id)
+        await read_cache.invalidate("rating_stats", movie_id)
+        # Its comments were detached from the movie
+        await read_cache.clear("comment")
+        title_suggestions.remove(movie_id)
+        leaderboards.mark_dirty()
+        title_index.remove(movie_id)
 
         return None
 
@@ -137,81 +411,241 @@ class MovieCRUDService:
 class RatingCRUDService:
 
     @staticmethod
-    def rate_movie_by_id(db: Session, rating: schemas.RatingCreate, user_id: int, movie_id: int):
-        db_rating = models.Rating(
+    async def insert_rating(db: AsyncSession, rating: schemas.RatingCreate, user_id: int, movie_id: int, overwrite: bool = False):
+        # One ON CONFLICT statement against uq_ratings_user_id_movie_id, so
+        # concurrent requests can never store two ratings for the same pair.
+        # Returns None when the rating exists and overwrite is off
+        insert = get_insert(db)
+        query = insert(models.Rating).values(
             **rating.model_dump(),
             user_id=user_id,
             movie_id=movie_id
         )
+        conflict_target = [models.Rating.user_id, models.Rating.movie_id]
+        if overwrite:
+            query = query.on_conflict_do_update(
+                index_elements=conflict_target,
+                # ON CONFLICT DO UPDATE skips Column.onupdate
+                set_={"rating_value": query.excluded.rating_value, "updated_at": models.utcnow()}
+            )
+        else:
+            query = query.on_conflict_do_nothing(index_elements=conflict_target)
+
+        if not db.get_bind().dialect.insert_returning:
+            # SQLite before 3.35 has ON CONFLICT but no RETURNING
+            result = await db.execute(query)
+            if not result.rowcount:
+                return None
+            return await rating_crud_service.get_rating(db, user_id=user_id, movie_id=movie_id)
+
+        # RATING_LOAD_OPTIONS can't join onto a RETURNING row, the user is selected in
+        result = await db.scalars(
+            query.returning(models.Rating).options(selectinload(models.Rating.user)),
+            execution_options={"populate_existing": True}
+        )
+        return result.first()
+
+    @staticmethod
+    async def rate_movie_by_id(db: AsyncSession, rating: schemas.RatingCreate, user_id: int, movie_id: int):
+        db_rating = await rating_crud_service.insert_rating(db, rating, user_id=user_id, movie_id=movie_id)
+        if db_rating is None:
+            return None
 
-        db.add(db_rating)
-        db.commit()
-        db.refresh(db_rating)
+        await rating_crud_service.update_rating_stats(db, movie_id, added=db_rating.rating_value)
+        await db.commit()
+        await read_cache.invalidate("rating_stats", movie_id)
+        leaderboards.mark_dirty()
         return db_rating
 
     @staticmethod
-    def get_ratings(db: Session, offset: int = 0, limit: int = 10):
-        return db.query(models.Rating).offset(offset).limit(limit).all()
+    async def upsert_rating(db: AsyncSession, rating: schemas.RatingCreate, user_id: int, movie_id: int):
+        while True:
+            # The stats need the value being replaced. Lock it so it can't
+            # change between here and the upsert
+            result = await db.execute(
+                select(models.Rating.id, models.Rating.rating_value)
+                .where(models.Rating.user_id == user_id, models.Rating.movie_id == movie_id)
+                .with_for_update()
+            )
+            existing = result.first()
+            db_rating = await rating_crud_service.insert_rating(
+                db, rating, user_id=user_id, movie_id=movie_id, overwrite=existing is not None)
+            if db_rating is not None:
+                break
+            # Another request inserted the first rating in between, go again as an update
+
+        previous = existing.rating_value if existing else None
+        if previous != db_rating.rating_value:
+            await rating_crud_service.update_rating_stats(db, movie_id, added=db_rating.rating_value, removed=previous)
+        await db.commit()
+        await read_cache.invalidate("rating_stats", movie_id)
+        leaderboards.mark_dirty()
+        return db_rating
 
     @staticmethod
-    def get_rating(db: Session, user_id: int, movie_id: int):
-        return db.query(models.Rating).filter(models.Rating.user_id == user_id, models.Rating.movie_id == movie_id).first()
+    async def get_ratings(db: AsyncSession, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.Rating).options(*RATING_LOAD_OPTIONS)
+        result = await db.execute(paginate(query, models.Rating, offset, limit, cursor))
+        return result.scalars().all()
 
     @staticmethod
-    def get_rating_by_id(db: Session, rating_id: int):
-        return db.query(models.Rating).filter(models.Rating.id == rating_id).first()
+    async def get_rating(db: AsyncSession, user_id: int, movie_id: int):
+        result = await db.execute(select(models.Rating).options(*RATING_LOAD_OPTIONS).where(models.Rating.user_id == user_id, models.Rating.movie_id == movie_id))
+        return result.scalars().first()
 
     @staticmethod
-    def get_ratings_by_movie_id(db: Session, movie_id: int, offset: int = 0, limit: int = 10):
-        return db.query(models.Rating).filter(models.Rating.movie_id == movie_id).offset(offset).limit(limit).all()
+    async def get_rating_by_id(db: AsyncSession, rating_id: int):
+        result = await db.execute(select(models.Rating).options(*RATING_LOAD_OPTIONS).where(models.Rating.id == rating_id))
+        return result.scalars().first()
+
+    @staticmethod
+    async def get_ratings_by_movie_id(db: AsyncSession, movie_id: int, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.Rating).options(*RATING_LOAD_OPTIONS).where(models.Rating.movie_id == movie_id)
+        result = await db.execute(paginate(query, models.Rating, offset, limit, cursor))
+        return result.scalars().all()
     
     @staticmethod
-    def get_all_ratings_for_a_movie(db: Session, movie_id: int):
-        return db.query(models.Rating).filter(models.Rating.movie_id == movie_id).all()
+    async def get_all_ratings_for_a_movie(db: AsyncSession, movie_id: int):
+        result = await db.execute(select(models.Rating).options(*RATING_LOAD_OPTIONS).where(models.Rating.movie_id == movie_id))
+        return result.scalars().all()
     
     @staticmethod
-    def aggregate_rating(db: Session, movie_id: int):
-         # Fetch all ratings for the specified movie
-        ratings = rating_crud_service.get_all_ratings_for_a_movie(db, movie_id)
-        
-        # Check if there are any ratings
-        if not ratings:
-            return 0.0
-        
-        # Extract the ratings from the objects
-        rating_values = [rating.rating_value for rating in ratings]
-        
-        # Calculate the mean rating using statistics.mean
-        mean_rating = statistics.mean(rating_values)
-        
-        avg_rating = round(mean_rating, 2)
-        
-        return avg_rating
-
-
-
-    @staticmethod
-    def update_rating(db: Session, rating_payload: schemas.RatingUpdate, rating_id: int):
-        rating = rating_crud_service.get_rating_by_id(db, rating_id)
+    @read_cache.cached("rating_stats", ttl=RATING_STATS_CACHE_TTL_SECONDS, schema=schemas.RatingStats)
+    async def aggregate_rating(db: AsyncSession, movie_id: int):
+        # Read the running totals kept by update_rating_stats
+        stats = await db.get(models.MovieRatingStats, movie_id, populate_existing=True)
+        if stats is None:
+            return {
+                "avg_rating": 0.0,
+                "rating_count": 0,
+                "histogram": {value: 0 for value in range(1, 11)}
+            }
+
+        return {
+            "avg_rating": stats.avg_rating,
+            "rating_count": stats.rating_count,
+            "histogram": stats.histogram
+        }
+
+    @staticmethod
+    async def get_rating_stats_version(db: AsyncSession, movie_id: int):
+        # The movie and its running totals, what the average rating endpoint
+        # returns. Starts with get_movie_version's columns, for the movie read
+        Stats = models.MovieRatingStats
+        result = await db.execute(
+            select(models.Movie.updated_at, models.User.updated_at, Stats.updated_at)
+            .outerjoin(models.User, models.User.id == models.Movie.user_id)
+            .outerjoin(Stats, Stats.movie_id == models.Movie.id)
+            .where(models.Movie.id == movie_id)
+        )
+        return result.first()
+
+    @staticmethod
+    async def update_rating_stats(db: AsyncSession, movie_id: int, added: int = None, removed: int = None):
+        # Apply the change as one atomic upsert in the caller's transaction
+        Stats = models.MovieRatingStats
+        delta = {"rating_sum": 0, "rating_count": 0}
+        for value, sign in ((added, 1), (removed, -1)):
+            if value is None:
+                continue
+            column = Stats.histogram_column(value)
+            delta["rating_sum"] += sign * value
+            delta["rating_count"] += sign
+            delta[column] = delta.get(column, 0) + sign
+
+        insert = get_insert(db)
+        query = (
+            insert(Stats)
+            .values(movie_id=movie_id, **delta)
+            .on_conflict_do_update(
+                index_elements=[Stats.movie_id],
+                # ON CONFLICT DO UPDATE skips Column.onupdate
+                set_={
+                    **{column: getattr(Stats, column) + value for column, value in delta.items()},
+                    "updated_at": models.utcnow(),
+                }
+            )
+        )
+        await db.execute(query)
+
+    @staticmethod
+    async def compute_rating_stats(db: AsyncSession):
+        # Recount every movie's histogram straight from the ratings table
+        query = (
+            select(models.Rating.movie_id, models.Rating.rating_value, func.count(models.Rating.id))
+            .where(models.Rating.movie_id.is_not(None))
+            .group_by(models.Rating.movie_id, models.Rating.rating_value)
+        )
+        result = await db.execute(query)
+
+        histograms = {}
+        for movie_id, rating_value, count in result.all():
+            histograms.setdefault(movie_id, {value: 0 for value in range(1, 11)})[rating_value] = count
+        return histograms
+
+    @staticmethod
+    async def check_rating_stats(db: AsyncSession, rebuild: bool = False):
+        expected = await rating_crud_service.compute_rating_stats(db)
+        result = await db.execute(select(models.MovieRatingStats))
+        stored = {stats.movie_id: stats.histogram for stats in result.scalars().all()}
+
+        empty = {value: 0 for value in range(1, 11)}
+        drift = [
+            {"movie_id": movie_id, "expected": expected.get(movie_id, empty), "stored": stored.get(movie_id, empty)}
+            for movie_id in sorted(set(expected) | set(stored))
+            if expected.get(movie_id, empty) != stored.get(movie_id, empty)
+        ]
+
+        if rebuild and drift:
+            Stats = models.MovieRatingStats
+            drifted_ids = [item["movie_id"] for item in drift]
+            await db.execute(delete(Stats).where(Stats.movie_id.in_(drifted_ids)))
+            for item in drift:
+                histogram = item["expected"]
+                if not any(histogram.values()):
+                    continue
+                db.add(Stats(
+                    movie_id=item["movie_id"],
+                    rating_sum=sum(value * count for value, count in histogram.items()),
+                    rating_count=sum(histogram.values()),
+                    **{Stats.histogram_column(value): count for value, count in histogram.items()}
+                ))
+            await db.commit()
+            await read_cache.clear("rating_stats")
+
+        return drift
+
+    @staticmethod
+    async def update_rating(db: AsyncSession, rating_payload: schemas.RatingUpdate, rating_id: int):
+        rating = await rating_crud_service.get_rating_by_id(db, rating_id)
         if not rating:
             return None
 
+        old_value = rating.rating_value
         rating_payload_dict = rating_payload.model_dump(exclude_unset=True)
 
         for k, v in rating_payload_dict.items():
             setattr(rating, k, v)
 
         db.add(rating)
-        db.commit()
-        db.refresh(rating)
-        return rating
+        if rating.movie_id is not None and rating.rating_value != old_value:
+            await rating_crud_service.update_rating_stats(
+                db, rating.movie_id, added=rating.rating_value, removed=old_value)
+        await db.commit()
+        await read_cache.invalidate("rating_stats", rating.movie_id)
+        leaderboards.mark_dirty()
+        return await db.get(models.Rating, rating.id, options=RATING_LOAD_OPTIONS, populate_existing=True)
 
     @staticmethod
-    def delete_rating(db: Session, rating_id: int = None):
-        rating = rating_crud_service.get_rating_by_id(db, rating_id)
+    async def delete_rating(db: AsyncSession, rating_id: int = None):
+        rating = await rating_crud_service.get_rating_by_id(db, rating_id)
 
-        db.delete(rating)
-        db.commit()
+        await db.delete(rating)
+        if rating.movie_id is not None:
+            await rating_crud_service.update_rating_stats(db, rating.movie_id, removed=rating.rating_value)
+        await db.commit()
+        await read_cache.invalidate("rating_stats", rating.movie_id)
+        leaderboards.mark_dirty()
 
         return None
 
@@ -220,7 +654,7 @@ class RatingCRUDService:
 class CommentCRUDService:
 
     @staticmethod
-    def create_comment(db: Session, comment: schemas.CommentCreate, movie_id: int, user_id: int):
+    async def create_comment(db: AsyncSession, comment: schemas.CommentCreate, movie_id: int, user_id: int):
         db_comment = models.Comment(
             **comment.model_dump(),
             user_id=user_id,
@@ -228,88 +662,147 @@ class CommentCRUDService:
         )
 
         db.add(db_comment)
-        db.commit()
-        db.refresh(db_comment)
-        return db_comment
+        await db.commit()
+        await read_cache.invalidate("comment", db_comment.id)
+        return await db.get(models.Comment, db_comment.id, options=COMMENT_LOAD_OPTIONS, populate_existing=True)
 
     @staticmethod
-    def get_comments(db: Session, offset: int = 0, limit: int = 10):
-        # Join comments with the reply counts
+    async def get_comments(db: AsyncSession, offset: int = 0, limit: int = 10, cursor: str = None):
+        # Reply counts are stored on each comment, the author is joined in.
+        # Deleting a user nulls user_id, those comments have no author to show
+        query = select(models.Comment).options(*COMMENT_LOAD_OPTIONS).where(models.Comment.user_id.is_not(None))
+        result = await db.execute(paginate(query, models.Comment, offset, limit, cursor))
+        return result.scalars().all()
 
-        # Subquery to count replies
-        subquery = (
-            db.query(
-                models.Comment.parent_id,
-                func.count(models.Comment.id).label("reply_count")
-            )
-            .group_by(models.Comment.parent_id)
-            .subquery()
-        )
+    @staticmethod
+    async def get_replies_to_comment(db: AsyncSession, parent_id: int, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.Comment).options(*COMMENT_LOAD_OPTIONS).where(models.Comment.parent_id == parent_id)
+        result = await db.execute(paginate(query, models.Comment, offset, limit, cursor))
+        return result.scalars().all()
+
+    @staticmethod
+    async def get_comments_by_movie(db: AsyncSession, movie_id: int, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.Comment).options(*COMMENT_LOAD_OPTIONS).where(models.Comment.movie_id == movie_id)
+        result = await db.execute(paginate(query, models.Comment, offset, limit, cursor))
+        return result.scalars().all()
 
-        # Main query to get comments with reply count and author details
-        comments_with_no_of_replies = (
-            db.query(
+    @staticmethod
+    @read_cache.cached("comment", schema=schemas.CommentOut)
+    async def get_comment_by_id(db: AsyncSession, comment_id: int):
+        # Query to get a specific comment with its stored reply count
+        query = (
+            select(
                 models.Comment,
-                models.User,  # Join the User table [so as to get the author]
-                func.coalesce(subquery.c.reply_count, 0).label("replies")
+                models.Comment.reply_count.label("replies")
             )
-
-            .join(models.User, models.Comment.user_id == models.User.id)
-            .outerjoin(subquery, models.Comment.id == subquery.c.parent_id)
-            .offset(offset)
-            .limit(limit)
-            .all()
+            .where(models.Comment.id == comment_id)
+            .options(*COMMENT_LOAD_OPTIONS)
         )
-
-        # The above query ensures that the comments are returned with no. of replies of each comment
-        return comments_with_no_of_replies
+        result = await db.execute(query)
+        return result.fetchone()
 
     @staticmethod
-    def get_replies_to_comment(db: Session, parent_id: int, offset: int = 0, limit: int = 10):
-        return db.query(models.Comment).filter(models.Comment.parent_id == parent_id).offset(offset).limit(limit).all()
+    async def get_comment_version(db: AsyncSession, comment_id: int):
+        # Reply count changes go through update(), which sets updated_at too
+        result = await db.execute(
+            select(models.Comment.updated_at, models.User.updated_at)
+            .outerjoin(models.User, models.User.id == models.Comment.user_id)
+            .where(models.Comment.id == comment_id)
+        )
+        return result.first()
 
     @staticmethod
-    def get_comments_by_movie(db: Session, movie_id: int, offset: int = 0, limit: int = 10):
-        return db.query(models.Comment).filter(models.Comment.movie_id == movie_id).offset(offset).limit(limit).all()
+    async def get_comments_by_user(db: AsyncSession, user_id: int, offset: int = 0, limit: int = 10, cursor: str = None):
+        query = select(models.Comment).options(*COMMENT_LOAD_OPTIONS).where(models.Comment.user_id == user_id)
+        result = await db.execute(paginate(query, models.Comment, offset, limit, cursor))
+        return result.scalars().all()
 
     @staticmethod
-    def get_comment_by_id(db: Session, comment_id: int):
-        # Subquery to count replies
-        reply_count_subquery = (
+    async def get_comment_threads(db: AsyncSession, movie_id: int = None, comment_id: int = None, max_depth: int = 3, per_level_limit: int = 10):
+        # Whole threads in one recursive query: every thread of a movie, or the
+        # thread under one comment. Each node keeps its first `per_level_limit`
+        # replies, down to `max_depth` levels below the root
+        Comment = models.Comment
+        same_movie = Comment.movie_id == movie_id
+        if comment_id is not None:
+            movie_id = select(Comment.movie_id).where(Comment.id == comment_id).scalar_subquery()
+            # delete_movie leaves its threads with a NULL movie_id. Spelled out
+            # rather than IS NOT DISTINCT FROM, which Postgres can't index
+            same_movie = or_(Comment.movie_id == movie_id, and_(Comment.movie_id.is_(None), movie_id.is_(None)))
+
+        # Replies share their thread's movie_id, so ranking siblings only scans one movie
+        ranked = (
             select(
-                models.Comment.parent_id,
-                func.count(models.Comment.id).label("reply_count")
+                Comment.id,
+                Comment.parent_id,
+                func.row_number().over(
+                    partition_by=Comment.parent_id,
+                    order_by=(Comment.created_at, Comment.id)
+                ).label("position")
             )
-            .group_by(models.Comment.parent_id)
-            .subquery()
+            .where(same_movie)
+            .cte("ranked")
+        )
+
+        if comment_id is not None:
+            roots = ranked.c.id == comment_id
+        else:
+            roots = and_(ranked.c.parent_id.is_(None), ranked.c.position <= per_level_limit)
+        tree = (
+            select(ranked.c.id, literal_column("0", Integer).label("depth"))
+            .where(roots)
+            .cte("tree", recursive=True)
+        )
+        tree = tree.union_all(
+            select(ranked.c.id, tree.c.depth + 1)
+            .join(tree, ranked.c.parent_id == tree.c.id)
+            .where(tree.c.depth < max_depth, ranked.c.position <= per_level_limit)
         )
 
-        # Query to get a specific comment with reply count
         query = (
             select(
-                models.Comment,
-                func.coalesce(reply_count_subquery.c.reply_count,
-                              0).label("replies")
+                Comment.id,
+                Comment.parent_id,
+                Comment.user_id,
+                models.User.username,
+                Comment.comment,
+                Comment.created_at,
+                Comment.reply_count,
+                tree.c.depth
             )
-            .outerjoin(reply_count_subquery, models.Comment.id == reply_count_subquery.c.parent_id)
-            .where(models.Comment.id == comment_id)
+            .join(tree, Comment.id == tree.c.id)
+            .outerjoin(models.User, Comment.user_id == models.User.id)
+            .order_by(tree.c.depth, Comment.created_at, Comment.id)
         )
-        comment_with_no_of_replies = db.execute(query).fetchone()
-
-        # The above query ensures that comment is returned with the no. of replies
-        return comment_with_no_of_replies
-
-    @staticmethod
-    def get_comments_by_user(db: Session, user_id: int, offset: int = 0, limit: int = 10):
-        return db.query(models.Comment).filter(models.Comment.user_id == user_id).offset(offset).limit(limit).all()
-
-    @staticmethod
-    def get_a_comment(db: Session, comment_id: int):
-        return db.query(models.Comment).filter(models.Comment.id == comment_id).first()
-
-    @staticmethod
-    def reply_comment(comment_id: int, db: Session, comment: schemas.CommentBase, user_id: int):
-        parent_comment = comment_crud_service.get_a_comment(db, comment_id)
+        result = await db.execute(query)
+
+        # Rows come parents first, so each node's parent is already in place
+        nodes, threads = {}, []
+        for row in result.all():
+            node = {
+                "id": row.id,
+                "user_id": row.user_id,
+                "author": row.username,
+                "comment": row.comment,
+                "created_at": row.created_at,
+                "reply_count": row.reply_count,
+                "replies": []
+            }
+            nodes[row.id] = node
+            if row.depth == 0:
+                threads.append(node)
+            else:
+                nodes[row.parent_id]["replies"].append(node)
+        return threads
+
+    @staticmethod
+    async def get_a_comment(db: AsyncSession, comment_id: int):
+        result = await db.execute(select(models.Comment).options(*COMMENT_LOAD_OPTIONS).where(models.Comment.id == comment_id))
+        return result.scalars().first()
+
+    @staticmethod
+    async def reply_comment(comment_id: int, db: AsyncSession, comment: schemas.CommentBase, user_id: int):
+        parent_comment = await comment_crud_service.get_a_comment(db, comment_id)
         if not parent_comment:
             return None
         movie_id = parent_comment.movie_id
@@ -320,13 +813,15 @@ class CommentCRUDService:
             **comment.model_dump(), movie_id=movie_id, parent_id=parent_id, user_id=user_id)
 
         db.add(new_comment)
-        db.commit()
-        db.refresh(new_comment)
-        return new_comment
+        await comment_crud_service.update_reply_count(db, parent_id, 1)
+        await db.commit()
+        await read_cache.invalidate("comment", parent_id)
+        await read_cache.invalidate("comment", new_comment.id)
+        return await db.get(models.Comment, new_comment.id, options=COMMENT_LOAD_OPTIONS, populate_existing=True)
 
     @staticmethod
-    def update_comment(db: Session, comment_payload: schemas.CommentUpdate, comment_id: int):
-        comment = comment_crud_service.get_a_comment(db, comment_id)
+    async def update_comment(db: AsyncSession, comment_payload: schemas.CommentUpdate, comment_id: int):
+        comment = await comment_crud_service.get_a_comment(db, comment_id)
         if not comment:
             return None
         comment_payload_dict = comment_payload.model_dump(exclude_unset=True)
@@ -335,19 +830,61 @@ class CommentCRUDService:
             setattr(comment, k, v)
 
         db.add(comment)
-        db.commit()
-        db.refresh(comment)
-        return comment
+        await db.commit()
+        await read_cache.invalidate("comment", comment.id)
+        return await db.get(models.Comment, comment.id, options=COMMENT_LOAD_OPTIONS, populate_existing=True)
 
     @staticmethod
-    def delete_comment(db: Session, comment_id: int):
-        comment = comment_crud_service.get_a_comment(db, comment_id)
+    async def delete_comment(db: AsyncSession, comment_id: int):
+        comment = await comment_crud_service.get_a_comment(db, comment_id)
 
-        db.delete(comment)
-        db.commit()
+        if comment.parent_id is not None:
+            await comment_crud_service.update_reply_count(db, comment.parent_id, -1)
+        await db.delete(comment)
+        await db.commit()
+        await read_cache.invalidate("comment", comment_id)
+        if comment.parent_id is not None:
+            await read_cache.invalidate("comment", comment.parent_id)
 
         return None
 
+    @staticmethod
+    async def update_reply_count(db: AsyncSession, comment_id: int, delta: int):
+        # Relative update in the caller's transaction, so concurrent replies don't lose counts
+        await db.execute(
+            update(models.Comment)
+            .where(models.Comment.id == comment_id)
+            .values(reply_count=models.Comment.reply_count + delta)
+        )
+
+    @staticmethod
+    async def check_reply_counts(db: AsyncSession, rebuild: bool = False):
+        replies = aliased(models.Comment)
+        expected = (
+            select(func.count(replies.id))
+            .where(replies.parent_id == models.Comment.id)
+            .scalar_subquery()
+        )
+        result = await db.execute(
+            select(models.Comment.id, models.Comment.reply_count, expected.label("expected"))
+            .where(models.Comment.reply_count != expected)
+            .order_by(models.Comment.id)
+        )
+        drift = [
+            {"comment_id": comment_id, "expected": count, "stored": stored}
+            for comment_id, stored, count in result.all()
+        ]
+
+        if rebuild and drift:
+            await db.execute(
+                update(models.Comment)
+                .where(models.Comment.id.in_([item["comment_id"] for item in drift]))
+                .values(reply_count=expected)
+            )
+            await db.commit()
+            await read_cache.clear("comment")
+        return drift
+
 
 user_crud_service = UserCRUDService()
 movie_crud_service = MovieCRUDService()
@@ -1,25 +1,91 @@
 import os
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 load_dotenv()
 
+# Per process: every uvicorn worker opens up to DB_POOL_SIZE + DB_MAX_OVERFLOW
+# connections, keep workers * that below the server's max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Connections older than this are replaced, before the server or a proxy drops them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# Postgres only, 0 leaves the server's statement_timeout alone
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
 
-SQLALCHEMY_DATABASE_URL = os.environ.get('DATABASE_URL')
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+def get_async_database_url(url: str) -> str:
+    # Point plain database urls at their asyncio drivers
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that times how long each checkout waits.
+
+    The wait is left in the connection record's info for the checkout event,
+    see metrics.Metrics.instrument. Checkouts that time out are counted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter_ns()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        record.info["checkout_wait_ns"] = time.perf_counter_ns() - start
+        return record
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool, keep the counter monotonic
+        pool = super().recreate()
+        pool.timeouts = self.timeouts
+        return pool
+
+
+def engine_options(url: str, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW,
+                   pool_timeout: float = DB_POOL_TIMEOUT, pool_recycle: int = DB_POOL_RECYCLE,
+                   pool_pre_ping: bool = DB_POOL_PRE_PING, statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS):
+    """Keyword arguments for create_async_engine(url)."""
+    options = {"pool_pre_ping": pool_pre_ping, "pool_recycle": pool_recycle}
+    # SQLite gets a NullPool or StaticPool, which take no size or timeout
+    if url.startswith("sqlite"):
+        return options
+    options.update(poolclass=TimedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                   pool_timeout=pool_timeout)
+    if statement_timeout_ms and url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(statement_timeout_ms)}}
+    return options
+
+
+SQLALCHEMY_DATABASE_URL = get_async_database_url(os.environ.get('DATABASE_URL'))
+
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL)
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = async_sessionmaker(
+    autoflush=False, bind=engine, expire_on_commit=False)
 
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
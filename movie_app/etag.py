@@ -0,0 +1,40 @@
+import hashlib
+import os
+from dotenv import load_dotenv
+from fastapi import Request, Response
+
+load_dotenv()
+
+HTTP_CACHE_MAX_AGE_SECONDS = int(os.getenv("HTTP_CACHE_MAX_AGE_SECONDS", 0))
+
+# By default clients may store responses but revalidate them every time
+CACHE_CONTROL = f"public, max-age={HTTP_CACHE_MAX_AGE_SECONDS}" if HTTP_CACHE_MAX_AGE_SECONDS else "no-cache"
+
+
+def make_etag(*parts):
+    # Strong ETag over the resource path and the updated_at of every row behind it
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def not_modified(request: Request, response: Response, version):
+    """Set ETag and Cache-Control, and return a 304 if the client's copy is current.
+
+    `version` comes from a cheap lookup of the rows' updated_at, so a
+    revalidation never loads or serializes the resource itself.
+    """
+    etag = make_etag(request.url.path, *version)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
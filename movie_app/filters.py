@@ -0,0 +1,57 @@
+from fastapi import HTTPException
+import movie_app.schemas as schemas
+
+QUERY_PLAN_HEADER = "X-Query-Plan"
+
+# Indexes that return every movie in a sort order, so a page stops reading at `limit`
+ORDERED_INDEXES = {
+    None: "ix_movies_created_at_id",
+    "newest": "ix_movies_created_at_id",
+    "title": "ix_movies_title",
+}
+
+# Filters that bound the rows read to one index range, in order of preference.
+# The other filters are checked on those rows and the page is sorted after
+RANGE_INDEXES = {
+    "genre": "ix_movies_genre_created_at_id",
+    "owner_id": "ix_movies_user_id_created_at_id",
+    "release_year": "ix_movies_release_year_id",
+}
+
+
+def active_filters(filters: schemas.MovieListFilters):
+    active = set()
+    if filters.genre:
+        active.add("genre")
+    if filters.owner_id is not None:
+        active.add("owner_id")
+    if filters.year_from is not None or filters.year_to is not None:
+        active.add("release_year")
+    if filters.min_rating is not None:
+        active.add("min_rating")
+    return active
+
+
+def plan_movie_list(filters: schemas.MovieListFilters, sort: str = None):
+    """Name the index a filtered movie list is read through.
+
+    Combinations no index serves would scan the whole table, those are
+    rejected with a 400 instead.
+    """
+    if filters.year_from is not None and filters.year_to is not None and filters.year_from > filters.year_to:
+        raise HTTPException(status_code=400, detail="year_from is after year_to")
+
+    active = active_filters(filters)
+    if not active:
+        if sort not in ORDERED_INDEXES:
+            raise HTTPException(status_code=400, detail=f"Sorting by {sort} needs a genre, owner_id or release year filter")
+        return ORDERED_INDEXES[sort]
+
+    # One genre or owner in keyset order is read straight from its index
+    if sort in (None, "newest") and (active == {"genre"} and len(filters.genre) == 1 or active == {"owner_id"}):
+        return RANGE_INDEXES[active.pop()]
+
+    for name, index in RANGE_INDEXES.items():
+        if name in active:
+            return index
+    raise HTTPException(status_code=400, detail="min_rating needs a genre, owner_id or release year filter")
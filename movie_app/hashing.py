@@ -0,0 +1,109 @@
+import os
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+load_dotenv()
+
+HASH_POOL_EXECUTOR = os.getenv("HASH_POOL_EXECUTOR", "thread")
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", 4))
+HASH_POOL_MAX_PENDING = int(os.getenv("HASH_POOL_MAX_PENDING", 64))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# Module level so they can be pickled into a process pool
+def _hash_password(password: str):
+    return pwd_context.hash(password)
+
+
+def _verify_password(plain_password: str, hashed_password: str):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashingPool:
+    """Runs bcrypt work off the event loop on a bounded executor.
+
+    Jobs beyond `max_pending` are rejected with a 503 instead of queueing
+    without limit, so a login burst sheds load rather than piling up.
+    """
+
+    def __init__(self, executor: str = "thread", workers: int = 4, max_pending: int = 64):
+        self.executor_type = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Executor | None = None
+
+        # Only touched from the event loop thread
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+    async def hash(self, password: str):
+        return await self.run(_hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str):
+        return await self.run(_verify_password, plain_password, hashed_password)
+
+    def stats(self):
+        return {
+            "executor": self.executor_type,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.workers),
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_seconds": self.total_seconds / self.completed if self.completed else 0.0,
+            "max_seconds": self.max_seconds,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+hashing_pool = HashingPool(
+    executor=HASH_POOL_EXECUTOR,
+    workers=HASH_POOL_WORKERS,
+    max_pending=HASH_POOL_MAX_PENDING,
+)
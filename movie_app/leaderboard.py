@@ -0,0 +1,131 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from movie_app.logger import logger
+import movie_app.models as models
+
+load_dotenv()
+
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 100))
+# Weight of the site-wide mean in the Bayesian average, in ratings
+LEADERBOARD_PRIOR_WEIGHT = float(os.getenv("LEADERBOARD_PRIOR_WEIGHT", 10))
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", 60))
+# Refresh at least this often without writes, trending moves with the clock
+LEADERBOARD_MAX_AGE_SECONDS = float(os.getenv("LEADERBOARD_MAX_AGE_SECONDS", 900))
+TRENDING_DAYS = int(os.getenv("TRENDING_DAYS", 7))
+
+
+def bayesian_average(rating_sum, rating_count, mean: float, prior_weight: float):
+    # Few ratings pull towards the site-wide mean, many ratings speak for themselves
+    return (prior_weight * mean + rating_sum) * 1.0 / (prior_weight + rating_count)
+
+
+def entry(row):
+    return {
+        "movie_id": row.id,
+        "title": row.title,
+        "genre": row.genre,
+        "score": float(row.score),
+        "avg_rating": row.rating_sum / row.rating_count,
+        "rating_count": row.rating_count,
+    }
+
+
+class Leaderboards:
+    """Top rated and trending movies, precomputed and served from memory.
+
+    refresh() ranks everything in a few statements and swaps the new boards
+    in at once, reads are a dict lookup and a slice.
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE, prior_weight: float = LEADERBOARD_PRIOR_WEIGHT,
+                 trending_days: int = TRENDING_DAYS):
+        self.size = size
+        self.prior_weight = prior_weight
+        self.trending_days = trending_days
+        self.refreshed_at = None
+        self.dirty = True
+        self._boards = {"overall": [], "trending": [], "genre": {}}
+
+    def mark_dirty(self):
+        # Called after committed rating and movie writes
+        self.dirty = True
+
+    def top(self, limit: int = 10):
+        return self._boards["overall"][:limit]
+
+    def top_by_genre(self, genre: str, limit: int = 10):
+        return self._boards["genre"].get(genre, [])[:limit]
+
+    def trending(self, limit: int = 10):
+        return self._boards["trending"][:limit]
+
+    def stale(self, max_age: float = LEADERBOARD_MAX_AGE_SECONDS):
+        if self.dirty or self.refreshed_at is None:
+            return True
+        return (datetime.now(timezone.utc) - self.refreshed_at).total_seconds() >= max_age
+
+    async def refresh(self, db: AsyncSession):
+        self.dirty = False
+        Movie, Stats, Rating = models.Movie, models.MovieRatingStats, models.Rating
+
+        totals = (await db.execute(select(func.sum(Stats.rating_sum), func.sum(Stats.rating_count)))).first()
+        mean = totals[0] / totals[1] if totals[1] else 0.0
+        score = bayesian_average(Stats.rating_sum, Stats.rating_count, mean, self.prior_weight)
+
+        rated = (
+            select(Movie.id, Movie.title, Movie.genre, Stats.rating_sum, Stats.rating_count, score.label("score"))
+            .join(Stats, Stats.movie_id == Movie.id)
+            .where(Stats.rating_count > 0)
+        )
+        overall = await db.execute(rated.order_by(score.desc(), Movie.id).limit(self.size))
+
+        ranked = rated.add_columns(
+            func.row_number().over(partition_by=Movie.genre, order_by=(score.desc(), Movie.id)).label("rank")
+        ).subquery()
+        by_genre = await db.execute(
+            select(ranked).where(ranked.c.rank <= self.size).order_by(ranked.c.genre, ranked.c.rank))
+
+        # Most rated since the cutoff, ties broken by their Bayesian average
+        since = datetime.now(timezone.utc) - timedelta(days=self.trending_days)
+        weekly = (
+            select(Rating.movie_id,
+                   func.sum(Rating.rating_value).label("rating_sum"),
+                   func.count(Rating.id).label("rating_count"))
+            .where(Rating.created_at >= since, Rating.movie_id.is_not(None), Rating.rating_value.is_not(None))
+            .group_by(Rating.movie_id)
+            .subquery()
+        )
+        weekly_score = bayesian_average(weekly.c.rating_sum, weekly.c.rating_count, mean, self.prior_weight)
+        trending = await db.execute(
+            select(Movie.id, Movie.title, Movie.genre, weekly.c.rating_sum, weekly.c.rating_count,
+                   weekly_score.label("score"))
+            .join(weekly, weekly.c.movie_id == Movie.id)
+            .order_by(weekly.c.rating_count.desc(), weekly_score.desc(), Movie.id)
+            .limit(self.size)
+        )
+
+        boards = {"overall": [entry(row) for row in overall], "trending": [entry(row) for row in trending], "genre": {}}
+        for row in by_genre:
+            boards["genre"].setdefault(row.genre, []).append(entry(row))
+        self._boards = boards
+        self.refreshed_at = datetime.now(timezone.utc)
+
+    async def run(self, session_factory, interval: float = LEADERBOARD_REFRESH_SECONDS):
+        # Background refresh loop started by main.lifespan
+        while True:
+            await asyncio.sleep(interval)
+            if not self.stale():
+                continue
+            try:
+                async with session_factory() as db:
+                    await self.refresh(db)
+            except Exception:
+                self.dirty = True
+                logger.exception("Refreshing leaderboards failed")
+
+
+leaderboards = Leaderboards()
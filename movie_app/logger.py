@@ -1,6 +1,11 @@
+import atexit
 import os
 import logging
+import queue
 import sys
+import threading
+import orjson
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
 from logtail import LogtailHandler
 
@@ -8,6 +13,108 @@ from logtail import LogtailHandler
 load_dotenv(dotenv_path='movie_app/.env')
 
 token = os.getenv("BETTER_STACK_TOKEN")
+LOGTAIL_HOST = os.getenv("LOGTAIL_HOST", "https://in.logs.betterstack.com")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+# Longest shutdown waits for the handlers to hand off what is left
+LOG_FLUSH_TIMEOUT_SECONDS = float(os.getenv("LOG_FLUSH_TIMEOUT_SECONDS", 5))
+
+
+class BoundedLogtailHandler(LogtailHandler):
+    """LogtailHandler whose flush gives up after LOG_FLUSH_TIMEOUT_SECONDS.
+
+    Uploads are retried for over a minute when Better Stack is unreachable,
+    logging.shutdown flushes every handler at exit and would wait them out.
+    """
+
+    def flush(self):
+        flusher = threading.Thread(target=super().flush, daemon=True)
+        flusher.start()
+        flusher.join(LOG_FLUSH_TIMEOUT_SECONDS)
+
+
+class StructuredFormatter(logging.Formatter):
+    """Write access log entries as one JSON line, everything else as before."""
+
+    def format(self, record):
+        entry = getattr(record, "access", None)
+        if isinstance(entry, dict):
+            return orjson.dumps(entry).decode()
+        return super().format(record)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hand records to a bounded queue without blocking the caller.
+
+    Records that don't fit are dropped and counted. Nothing is formatted
+    here, the listener's handlers do that on their own thread.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # Handler.handle holds the handler lock, the counters need no other
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener(QueueListener):
+    """QueueListener that drains up to `batch_size` records per wakeup."""
+
+    def __init__(self, queue, *handlers, batch_size: int = LOG_BATCH_SIZE):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        self.processed = 0
+        self.batches = 0
+
+    def _monitor(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self.batches += 1
+            for record in batch:
+                self.queue.task_done()
+                if record is self._sentinel:
+                    return
+                self.handle(record)
+                self.processed += 1
+
+    def enqueue_sentinel(self):
+        # The queue may be full, block until the listener makes room
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+def log_stats():
+    return {
+        "queue_size": log_queue.qsize(),
+        "queue_capacity": log_queue.maxsize,
+        "enqueued": queue_handler.enqueued,
+        "dropped": queue_handler.dropped,
+        "processed": log_listener.processed,
+        "batches": log_listener.batches,
+    }
+
 
 # Get logger
 
@@ -15,19 +122,28 @@ logger = logging.getLogger()
 
 # Create a formatter
 
-formatter = logging.Formatter(
+formatter = StructuredFormatter(
     fmt="%(asctime)s - %(levelname)s - %(message)s"
 )
 
 # Create handlers
 stream_handler = logging.StreamHandler(sys.stdout)
-better_stack_handler = LogtailHandler(source_token=token)
+better_stack_handler = BoundedLogtailHandler(source_token=token, host=LOGTAIL_HOST)
 
 # Set formatters
 stream_handler.setFormatter(formatter)
+better_stack_handler.setFormatter(StructuredFormatter())
+
+# Request handling only enqueues records, writing and uploading them
+# happens on the listener thread
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+log_listener = BatchingQueueListener(log_queue, stream_handler, better_stack_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # Add handlers to the logger
-logger.handlers = [stream_handler, better_stack_handler]
+logger.handlers = [queue_handler]
 
 # Set log level
 logger.setLevel(logging.INFO)
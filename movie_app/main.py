@@ -1,23 +1,54 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from movie_app.logger import logger
-from movie_app.middleware import log_middleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from movie_app.auth import authenticate_user, create_access_token, pwd_context
-from movie_app.crud import user_crud_service
+from movie_app.metrics import metrics
+from movie_app.middleware import LogMiddleware, MetricsMiddleware, QueryProfileMiddleware
+from movie_app.query_profile import query_profiler
+from movie_app.auth import authenticate_user, create_access_token, get_password_hash
+from movie_app.cache import principal_cache, read_cache
+from movie_app.hashing import hashing_pool
+from movie_app.crud import movie_crud_service, user_crud_service
 import movie_app.schemas as schemas
-from movie_app.database import engine, Base, get_db
+from movie_app.database import SessionLocal, engine, get_db
+from movie_app.leaderboard import leaderboards
+from movie_app.migrations import migrate
 from movie_app.routers.users import user_router
 from movie_app.routers.comments import comment_router
 from movie_app.routers.movies import movie_router
 from movie_app.routers.ratings import rating_router
 
 
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await migrate(engine)
+    async with SessionLocal() as db:
+        await user_crud_service.check_case_insensitive_lookup(db)
+    async with SessionLocal() as db:
+        count = await movie_crud_service.load_title_suggestions(db)
+    logger.info(f"Loaded {count} movie titles for suggestions")
+    async with SessionLocal() as db:
+        await leaderboards.refresh(db)
+    refresh_task = asyncio.create_task(leaderboards.run(SessionLocal))
+    yield
+    refresh_task.cancel()
+    # A refresh may be mid-query, let it return its connection before disposing
+    with suppress(asyncio.CancelledError):
+        await refresh_task
+    hashing_pool.shutdown()
+    await engine.dispose()
 
-app = FastAPI()
-app.add_middleware(BaseHTTPMiddleware, dispatch=log_middleware)
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(LogMiddleware)
+app.add_middleware(MetricsMiddleware)
+# Outermost, so the profile is in place while the other middleware log
+app.add_middleware(QueryProfileMiddleware)
+metrics.instrument(engine)
+query_profiler.instrument(engine)
 logger.info('Starting API....')
 
 
@@ -25,6 +56,17 @@ logger.info('Starting API....')
 async def index():
     return {'message': 'Welcome to Movie API'}
 
+
+@app.get('/cache/stats')
+async def cache_stats():
+    # Hit ratios since startup, per cached CRUD read and for authenticated principals
+    return {'read': read_cache.stats(), 'principal': principal_cache.stats()}
+
+
+@app.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
 app.include_router(user_router, prefix="/users", tags=["Users"])
 app.include_router(
     comment_router, prefix="/movies/comments", tags=["Comments"])
@@ -34,20 +76,19 @@ app.include_router(
 
 
 @app.post("/signup/", status_code=201, response_model=schemas.User)
-async def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = user_crud_service.get_user_by_email_or_username(
-        db, credentials=user.username)
-    hashed_password = pwd_context.hash(user.password)
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await user_crud_service.get_conflicting_user(db, email=user.email, username=user.username)
     if db_user:
         logger.warning("User already exists in database.....")
         raise HTTPException(
             status_code=400, detail="User already registered")
-    return user_crud_service.create_user(db=db, user=user, hashed_password=hashed_password)
+    hashed_password = await get_password_hash(user.password)
+    return await user_crud_service.create_user(db=db, user=user, hashed_password=hashed_password)
 
 
 @app.post("/login", status_code=200)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         logger.warning("Signup made with incorrect credentials...")
         raise HTTPException(
@@ -0,0 +1,179 @@
+import time
+from bisect import bisect_left
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from movie_app.logger import log_stats
+
+# Upper bounds in seconds, the last bucket is +Inf
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Checkouts are instant until the pool runs dry, then wait up to DB_POOL_TIMEOUT
+POOL_WAIT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Per-bucket counts plus sum, cumulated only when rendered.
+
+    Requests and async engine events are observed on the event loop thread,
+    so the counters are plain ints without locks.
+    """
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, labels: dict):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            yield "_bucket", {**labels, "le": bound}, cumulative
+        yield "_sum", labels, self.sum
+        yield "_count", labels, cumulative
+
+
+class Metrics:
+    """Request, query and pool metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = {}
+        self.request_latency = {}
+        self.queries = {}
+        self.query_errors = {}
+        self.query_latency = {}
+        self.pool_checkouts = 0
+        self.pool_checked_out = 0
+        self.pool_wait = Histogram(POOL_WAIT_BUCKETS)
+        self.engine = None
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float):
+        key = (method, route, status_code)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.request_latency.get((method, route))
+        if histogram is None:
+            histogram = self.request_latency[(method, route)] = Histogram(REQUEST_BUCKETS)
+        histogram.observe(seconds)
+
+    def observe_query(self, operation: str, seconds: float):
+        self.queries[operation] = self.queries.get(operation, 0) + 1
+        histogram = self.query_latency.get(operation)
+        if histogram is None:
+            histogram = self.query_latency[operation] = Histogram(QUERY_BUCKETS)
+        histogram.observe(seconds)
+
+    def instrument(self, engine: AsyncEngine | Engine):
+        """Count and time every statement `engine` runs and track its pool."""
+        self.engine = engine
+        engine = getattr(engine, "sync_engine", engine)
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info["query_start_ns"] = time.perf_counter_ns()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            start = conn.info.pop("query_start_ns", None)
+            if start is not None:
+                self.observe_query(operation(statement), (time.perf_counter_ns() - start) / 1e9)
+
+        @event.listens_for(engine, "handle_error")
+        def handle_error(context):
+            if context.connection is not None:
+                context.connection.info.pop("query_start_ns", None)
+            key = operation(context.statement or "")
+            self.query_errors[key] = self.query_errors.get(key, 0) + 1
+
+        @event.listens_for(engine, "checkout")
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            self.pool_checkouts += 1
+            self.pool_checked_out += 1
+            # Left by database.TimedQueuePool, other pools don't time checkouts
+            wait_ns = connection_record.info.pop("checkout_wait_ns", None)
+            if wait_ns is not None:
+                self.pool_wait.observe(wait_ns / 1e9)
+
+        @event.listens_for(engine, "checkin")
+        def checkin(dbapi_connection, connection_record):
+            self.pool_checked_out -= 1
+
+    def pool_stats(self):
+        stats = {"checkouts_total": self.pool_checkouts, "checked_out": self.pool_checked_out}
+        pool = self.engine.pool if self.engine is not None else None
+        # NullPool and StaticPool have no size or overflow
+        for name in ("size", "overflow", "checkedin"):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        if hasattr(pool, "timeouts"):
+            stats["timeouts_total"] = pool.timeouts
+        return stats
+
+    def samples(self):
+        yield "http_requests_in_flight", "gauge", [({}, self.in_flight)]
+        yield "http_requests_total", "counter", [
+            ({"method": method, "route": route, "status": status}, count)
+            for (method, route, status), count in self.requests.items()
+        ]
+        yield "http_request_duration_seconds", "histogram", [
+            sample for (method, route), histogram in self.request_latency.items()
+            for sample in histogram.samples({"method": method, "route": route})
+        ]
+        yield "db_queries_total", "counter", [
+            ({"operation": key}, count) for key, count in self.queries.items()
+        ]
+        yield "db_query_errors_total", "counter", [
+            ({"operation": key}, count) for key, count in self.query_errors.items()
+        ]
+        yield "db_query_duration_seconds", "histogram", [
+            sample for key, histogram in self.query_latency.items()
+            for sample in histogram.samples({"operation": key})
+        ]
+        pool = self.pool_stats()
+        yield "db_pool_checkouts_total", "counter", [({}, pool.pop("checkouts_total"))]
+        if "timeouts_total" in pool:
+            yield "db_pool_checkout_timeouts_total", "counter", [({}, pool.pop("timeouts_total"))]
+        yield "db_pool_checkout_wait_seconds", "histogram", list(self.pool_wait.samples({}))
+        for name, value in pool.items():
+            yield f"db_pool_{name}", "gauge", [({}, value)]
+        logs = log_stats()
+        yield "log_records_enqueued_total", "counter", [({}, logs["enqueued"])]
+        yield "log_records_dropped_total", "counter", [({}, logs["dropped"])]
+        yield "log_queue_size", "gauge", [({}, logs["queue_size"])]
+
+    def render(self):
+        lines = []
+        for name, kind, samples in self.samples():
+            lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                # Histograms add a suffix to the name of each sample
+                suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+                lines.append(f"{name}{suffix}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def operation(statement: str):
+    # First keyword, so series stay few whatever the statements are
+    words = statement.split(None, 1)
+    keyword = words[0].upper() if words else ""
+    return keyword if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+def label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+# Instrumented with database.engine in main, served at /metrics
+metrics = Metrics()
@@ -1,20 +1,193 @@
-from fastapi import Request
-from movie_app.logger import logger
+import os
+import random
+import re
 import time
+import uuid
+from urllib.parse import parse_qsl
+from dotenv import load_dotenv
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from movie_app.logger import logger
+from movie_app.metrics import metrics
+import movie_app.query_profile as query_profile
+
+load_dotenv()
+
+# "text" logs the old dict message, "json" one orjson line per request
+ACCESS_LOG_FORMAT = os.getenv("ACCESS_LOG_FORMAT", "text")
+# Share of fast 2xx responses that are logged, everything else always is
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", 1.0))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", 1000))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Incoming ids are reused when they are safe to put in a log line
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,128}")
+
+
+def route_template(scope: Scope):
+    # FastAPI leaves the matched route in the scope, unmatched requests have none
+    route = scope.get("route")
+    return getattr(route, "path", None)
+
+
+def request_id(scope: Scope):
+    for name, value in scope["headers"]:
+        if name == b"x-request-id":
+            value = value.decode("latin-1")
+            if REQUEST_ID_PATTERN.fullmatch(value):
+                return value
+    return uuid.uuid4().hex
+
+
+class LogMiddleware:
+    """Log every HTTP request, or a sample of the fast successful ones.
+
+    Plain ASGI instead of BaseHTTPMiddleware, so requests run in the
+    server's task and response bodies pass through as they are sent. Each
+    request gets an X-Request-ID, taken from the client when it sent a
+    usable one, which is echoed in the response and logged.
+    """
+
+    def __init__(self, app: ASGIApp, format: str = ACCESS_LOG_FORMAT, sample_rate: float = ACCESS_LOG_SAMPLE_RATE,
+                 slow_ms: float = ACCESS_LOG_SLOW_MS):
+        self.app = app
+        self.format = format
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter_ns()
+        rid = request_id(scope)
+        scope.setdefault("state", {})["request_id"] = rid
+        # Stays 500 when the app raises before starting a response
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.log(scope, rid, status_code, time.perf_counter_ns() - start)
+
+    def log(self, scope: Scope, rid: str, status_code: int, elapsed_ns: int):
+        duration_ms = elapsed_ns / 1e6
+        slow = duration_ms >= self.slow_ms
+        sampled = 200 <= status_code < 300 and not slow and self.sample_rate < 1
+        if sampled and random.random() >= self.sample_rate:
+            return
+
+        if self.format != "json":
+            log_dict = {
+                'url': scope["path"],
+                'method': scope["method"],
+                'process_time': elapsed_ns / 1e9,
+                'status_code': status_code,
+                'request_id': rid
+            }
+            logger.info(log_dict, extra=log_dict)
+            return
+
+        # Serialized by logger.StructuredFormatter on the listener thread
+        entry = {
+            "ts": time.time(),
+            "request_id": rid,
+            "method": scope["method"],
+            "route": route_template(scope),
+            "status": status_code,
+            "duration_ms": round(duration_ms, 3),
+        }
+        if sampled:
+            entry["sample_rate"] = self.sample_rate
+        profile = query_profile.current_profile.get()
+        if profile is not None:
+            entry["db_queries"] = profile.count
+            entry["db_ms"] = round(profile.total_ms, 3)
+        if status_code >= 500:
+            logger.error(entry, extra={"access": entry})
+        elif slow:
+            entry["slow"] = True
+            logger.warning(entry, extra={"access": entry})
+        else:
+            logger.info(entry, extra={"access": entry})
+
+
+class MetricsMiddleware:
+    """Count requests and time them per route template, see metrics.Metrics."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter_ns()
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            # Unmatched paths share one series, raw paths would be unbounded
+            metrics.observe_request(scope["method"], route_template(scope) or "unmatched", status_code,
+                                    (time.perf_counter_ns() - start) / 1e9)
+
+
+class QueryProfileMiddleware:
+    """Collect the statements each request runs, see query_profile.QueryProfiler.
+
+    Requests only count their statements and time them, for the access log.
+    With SQL_PROFILE_ENABLED, a request carrying an X-SQL-Profile header or
+    a sql_profile=1 query parameter gets a detailed profile, returned in the
+    X-SQL-Profile and Server-Timing response headers.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
+        requested = False
+        if query_profile.SQL_PROFILE_ENABLED:
+            header = query_profile.SQL_PROFILE_HEADER.lower().encode("latin-1")
+            requested = any(name == header for name, _ in scope["headers"])
+            if not requested and query_profile.SQL_PROFILE_PARAM.encode("latin-1") in scope["query_string"]:
+                params = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+                requested = any(name == query_profile.SQL_PROFILE_PARAM for name, _ in params)
 
-# Add a logging middleware
-async def log_middleware(request: Request, call_next):
-    start = time.time()
+        profile = query_profile.QueryProfile(detailed=requested)
+        token = query_profile.current_profile.set(profile)
 
-    response = await call_next(request)
+        async def send_with_profile(message: Message):
+            if message["type"] == "http.response.start":
+                server_timing = f'db;dur={round(profile.total_ms, 3)};desc="{profile.count} queries"'
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"server-timing", server_timing.encode("latin-1")),
+                    (b"x-sql-profile", profile.header()),
+                ]
+            await send(message)
 
-    process_time = time.time() - start
-    log_dict = {
-        'url': request.url.path,
-        'method': request.method,
-        'process_time': process_time,
-        'status_code': response.status_code
-    }
-    logger.info(log_dict, extra=log_dict)
-    return response
+        try:
+            await self.app(scope, receive, send_with_profile if requested else send)
+        finally:
+            query_profile.current_profile.reset(token)
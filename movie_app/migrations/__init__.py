@@ -0,0 +1,80 @@
+"""Versioned schema migrations.
+
+Each `vNNNN_<name>` module in this package exposes `upgrade(conn)`, which
+receives a synchronous connection inside the migration transaction. Applied
+versions are recorded in `schema_migrations`, so `migrate()` only runs the
+pending ones, in order. Migrations describe the schema as it was at that
+version and must not import `movie_app.models`.
+
+Usage:
+    python -m movie_app.cli migrate
+"""
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from movie_app.logger import logger
+from movie_app.migrations import (
+    v0001_initial,
+    v0002_filter_indexes,
+    v0003_comment_reply_count,
+    v0004_movie_search,
+    v0005_title_trigram,
+    v0006_movie_list_indexes,
+    v0007_updated_at,
+    v0008_unique_lower_user_indexes,
+)
+
+MIGRATIONS = [
+    v0001_initial,
+    v0002_filter_indexes,
+    v0003_comment_reply_count,
+    v0004_movie_search,
+    v0005_title_trigram,
+    v0006_movie_list_indexes,
+    v0007_updated_at,
+    v0008_unique_lower_user_indexes,
+]
+
+# Arbitrary key for the Postgres advisory lock held while migrating
+MIGRATION_LOCK_KEY = 7310594
+
+version_table = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False,
+           server_default=text("CURRENT_TIMESTAMP")),
+)
+
+
+def parse_version(module):
+    # v0002_filter_indexes -> (2, "filter_indexes")
+    version, name = module.__name__.rsplit(".", 1)[1].split("_", 1)
+    return int(version[1:]), name
+
+
+def _upgrade(conn):
+    if conn.dialect.name == "postgresql":
+        # Several app workers may start at once, only one of them migrates
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+    version_table.create(conn, checkfirst=True)
+    applied = set(conn.execute(select(version_table.c.version)).scalars())
+
+    ran = []
+    for module in MIGRATIONS:
+        version, name = parse_version(module)
+        if version in applied:
+            continue
+        logger.info(f"Applying migration {version:04d} {name}")
+        module.upgrade(conn)
+        conn.execute(version_table.insert().values(version=version, name=name))
+        ran.append((version, name))
+    return ran
+
+
+async def migrate(engine: AsyncEngine):
+    """Apply pending migrations in one transaction and return the (version, name) pairs that ran."""
+    async with engine.begin() as conn:
+        return await conn.run_sync(_upgrade)
@@ -0,0 +1,85 @@
+"""Baseline schema, as previously created by Base.metadata.create_all.
+
+Every object is created with checkfirst, so databases that were set up by
+create_all before migrations existed are adopted without changes.
+"""
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, func, text
+from sqlalchemy.schema import CreateIndex
+
+metadata = MetaData()
+
+users = Table(
+    "users",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True, nullable=False),
+    Column("email", String, unique=True, index=True, nullable=False),
+    Column("username", String, unique=True, nullable=False, index=True),
+    Column("full_name", String, nullable=False),
+    Column("hashed_password", String, nullable=False),
+    Column("created_at", DateTime(timezone=True), nullable=False,
+           server_default=text("CURRENT_TIMESTAMP")),
+)
+Index("ix_users_lower_email", func.lower(users.c.email))
+Index("ix_users_lower_username", func.lower(users.c.username))
+Index("ix_users_created_at_id", users.c.created_at, users.c.id)
+
+movies = Table(
+    "movies",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True, nullable=False),
+    Column("title", String, nullable=False, index=True),
+    Column("genre", String, nullable=False),
+    Column("description", String),
+    Column("release_year", Integer),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("created_at", DateTime(timezone=True), nullable=False,
+           server_default=text("CURRENT_TIMESTAMP")),
+)
+Index("ix_movies_created_at_id", movies.c.created_at, movies.c.id)
+
+ratings = Table(
+    "ratings",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True, autoincrement=True, nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("movie_id", Integer, ForeignKey("movies.id")),
+    Column("rating_value", Integer),
+    Column("created_at", DateTime(timezone=True), nullable=False,
+           server_default=text("CURRENT_TIMESTAMP")),
+)
+Index("ix_ratings_created_at_id", ratings.c.created_at, ratings.c.id)
+
+movie_rating_stats = Table(
+    "movie_rating_stats",
+    metadata,
+    Column("movie_id", Integer, ForeignKey("movies.id", ondelete="CASCADE"),
+           primary_key=True, nullable=False),
+    Column("rating_sum", Integer, nullable=False, server_default=text("0")),
+    Column("rating_count", Integer, nullable=False, server_default=text("0")),
+    *(Column(f"count_{value}", Integer, nullable=False, server_default=text("0"))
+      for value in range(1, 11)),
+)
+
+comments = Table(
+    "comments",
+    metadata,
+    Column("id", Integer, primary_key=True, nullable=False, autoincrement=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("movie_id", Integer, ForeignKey("movies.id")),
+    Column("comment", String),
+    Column("parent_id", Integer, ForeignKey("comments.id"), nullable=True),
+    Column("created_at", DateTime(timezone=True), nullable=False,
+           server_default=text("CURRENT_TIMESTAMP")),
+)
+Index("ix_comments_created_at_id", comments.c.created_at, comments.c.id)
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
+
+    # create_all skips the indexes of tables that already exist, and the
+    # lower()/keyset indexes were added after some databases were created.
+    # IF NOT EXISTS because SQLite can't reflect the expression indexes
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
@@ -0,0 +1,96 @@
+"""Composite indexes on the filter columns, and at most one rating per user per movie.
+
+Each filter index ends in (created_at, id) so the filtered lists are read in
+keyset order straight from the index. The unique (user_id, movie_id) index
+also serves lookups by user.
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, case, func, select
+from sqlalchemy.schema import CreateIndex
+
+from movie_app.logger import logger
+
+metadata = MetaData()
+
+movies = Table(
+    "movies",
+    metadata,
+    Column("id", Integer),
+    Column("genre", String),
+    Column("created_at", DateTime(timezone=True)),
+)
+ratings = Table(
+    "ratings",
+    metadata,
+    Column("id", Integer),
+    Column("user_id", Integer),
+    Column("movie_id", Integer),
+    Column("rating_value", Integer),
+    Column("created_at", DateTime(timezone=True)),
+)
+movie_rating_stats = Table(
+    "movie_rating_stats",
+    metadata,
+    Column("movie_id", Integer),
+    Column("rating_sum", Integer),
+    Column("rating_count", Integer),
+    *(Column(f"count_{value}", Integer) for value in range(1, 11)),
+)
+comments = Table(
+    "comments",
+    metadata,
+    Column("id", Integer),
+    Column("user_id", Integer),
+    Column("movie_id", Integer),
+    Column("parent_id", Integer),
+    Column("created_at", DateTime(timezone=True)),
+)
+
+indexes = [
+    Index("ix_movies_genre_created_at_id", movies.c.genre, movies.c.created_at, movies.c.id),
+    Index("uq_ratings_user_id_movie_id", ratings.c.user_id, ratings.c.movie_id, unique=True),
+    Index("ix_ratings_movie_id_created_at_id", ratings.c.movie_id, ratings.c.created_at, ratings.c.id),
+    Index("ix_comments_movie_id_created_at_id", comments.c.movie_id, comments.c.created_at, comments.c.id),
+    Index("ix_comments_user_id_created_at_id", comments.c.user_id, comments.c.created_at, comments.c.id),
+    Index("ix_comments_parent_id_created_at_id", comments.c.parent_id, comments.c.created_at, comments.c.id),
+]
+
+
+def remove_duplicate_ratings(conn):
+    # The rate endpoint only checked for an existing rating before inserting,
+    # so concurrent requests could store two. Keep the first one
+    first = (
+        select(func.min(ratings.c.id))
+        .where(ratings.c.user_id.is_not(None), ratings.c.movie_id.is_not(None))
+        .group_by(ratings.c.user_id, ratings.c.movie_id)
+    )
+    duplicates = conn.execute(
+        select(ratings.c.id, ratings.c.movie_id)
+        .where(ratings.c.user_id.is_not(None), ratings.c.movie_id.is_not(None), ratings.c.id.not_in(first))
+    ).all()
+    if not duplicates:
+        return
+
+    movie_ids = {row.movie_id for row in duplicates}
+    conn.execute(ratings.delete().where(ratings.c.id.in_([row.id for row in duplicates])))
+
+    # Recount the affected movies from what is left
+    conn.execute(movie_rating_stats.delete().where(movie_rating_stats.c.movie_id.in_(movie_ids)))
+    totals = (
+        select(
+            ratings.c.movie_id,
+            func.sum(ratings.c.rating_value),
+            func.count(ratings.c.id),
+            *(func.sum(case((ratings.c.rating_value == value, 1), else_=0)) for value in range(1, 11)),
+        )
+        .where(ratings.c.movie_id.in_(movie_ids), ratings.c.rating_value.is_not(None))
+        .group_by(ratings.c.movie_id)
+    )
+    conn.execute(movie_rating_stats.insert().from_select(
+        [column.name for column in movie_rating_stats.columns], totals))
+    logger.warning(f"Removed {len(duplicates)} duplicate ratings across {len(movie_ids)} movies")
+
+
+def upgrade(conn):
+    remove_duplicate_ratings(conn)
+    for index in indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
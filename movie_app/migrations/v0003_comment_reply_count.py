@@ -0,0 +1,24 @@
+"""Denormalized comments.reply_count, backfilled from the existing replies."""
+from sqlalchemy import Column, Integer, MetaData, Table, func, select, text
+
+metadata = MetaData()
+
+comments = Table(
+    "comments",
+    metadata,
+    Column("id", Integer),
+    Column("parent_id", Integer),
+    Column("reply_count", Integer),
+)
+
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE comments ADD COLUMN reply_count INTEGER DEFAULT 0 NOT NULL"))
+
+    replies = comments.alias("replies")
+    reply_count = (
+        select(func.count(replies.c.id))
+        .where(replies.c.parent_id == comments.c.id)
+        .scalar_subquery()
+    )
+    conn.execute(comments.update().values(reply_count=reply_count))
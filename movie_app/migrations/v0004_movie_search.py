@@ -0,0 +1,48 @@
+"""Full-text search over movie titles and descriptions.
+
+Postgres gets a generated tsvector column (title weighted above description)
+with a GIN index. SQLite gets an external-content FTS5 table kept in step by
+triggers on movies.
+"""
+
+POSTGRES = [
+    """
+    ALTER TABLE movies ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_movies_search_vector ON movies USING GIN (search_vector)",
+]
+
+SQLITE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5(
+        title, description, content='movies', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON movies BEGIN
+        INSERT INTO movies_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON movies BEGIN
+        INSERT INTO movies_fts (movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS movies_fts_update AFTER UPDATE OF title, description ON movies BEGIN
+        INSERT INTO movies_fts (movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO movies_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    # Index the movies that already exist
+    "INSERT INTO movies_fts (movies_fts) VALUES ('rebuild')",
+]
+
+
+def upgrade(conn):
+    statements = POSTGRES if conn.dialect.name == "postgresql" else SQLITE
+    for statement in statements:
+        conn.exec_driver_sql(statement)
@@ -0,0 +1,17 @@
+"""Trigram index on movie titles for typo tolerant title lookups.
+
+Postgres only: pg_trgm plus a GIN index serving the `%` similarity operator.
+SQLite falls back to the in-process index in movie_app.trigram.
+"""
+
+POSTGRES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_movies_title_trgm ON movies USING GIN (title gin_trgm_ops)",
+]
+
+
+def upgrade(conn):
+    if conn.dialect.name != "postgresql":
+        return
+    for statement in POSTGRES:
+        conn.exec_driver_sql(statement)
@@ -0,0 +1,28 @@
+"""Indexes for the filtered movie list, see movie_app/filters.py.
+
+Owner lists are read in keyset order like the genre lists. Release year
+ranges are bounded by their own index.
+"""
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, Table
+from sqlalchemy.schema import CreateIndex
+
+metadata = MetaData()
+
+movies = Table(
+    "movies",
+    metadata,
+    Column("id", Integer),
+    Column("release_year", Integer),
+    Column("user_id", Integer),
+    Column("created_at", DateTime(timezone=True)),
+)
+
+indexes = [
+    Index("ix_movies_user_id_created_at_id", movies.c.user_id, movies.c.created_at, movies.c.id),
+    Index("ix_movies_release_year_id", movies.c.release_year, movies.c.id),
+]
+
+
+def upgrade(conn):
+    for index in indexes:
+        conn.execute(CreateIndex(index, if_not_exists=True))
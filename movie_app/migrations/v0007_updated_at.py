@@ -0,0 +1,26 @@
+"""updated_at on every table, the version behind the ETags in movie_app/etag.py.
+
+Existing rows start at their created_at, rating stats at the migration time.
+SQLite can't add a column with a CURRENT_TIMESTAMP default, the ORM sets the
+value on every insert and update anyway.
+"""
+from sqlalchemy import text
+
+TABLES = {
+    "users": "created_at",
+    "movies": "created_at",
+    "ratings": "created_at",
+    "comments": "created_at",
+    "movie_rating_stats": "CURRENT_TIMESTAMP",
+}
+
+
+def upgrade(conn):
+    if conn.dialect.name == "postgresql":
+        column = "TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP"
+    else:
+        column = "DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00'"
+
+    for table, initial in TABLES.items():
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at {column}"))
+        conn.execute(text(f"UPDATE {table} SET updated_at = {initial}"))
@@ -0,0 +1,37 @@
+"""Emails and usernames unique regardless of case, see crud.get_user_by_email_or_username.
+
+The lower() indexes from the baseline become unique. Databases that already
+hold accounts differing only in case keep them as they are, with a warning:
+`python -m movie_app.cli user-duplicates` lists the accounts, and makes the
+indexes unique once they are resolved.
+"""
+from sqlalchemy import text
+
+from movie_app.logger import logger
+
+COLUMNS = ("email", "username")
+
+
+def duplicates(conn):
+    # (column, lowered value, accounts) for every value held by more than one account
+    found = []
+    for column in COLUMNS:
+        rows = conn.execute(text(
+            f"SELECT lower({column}), count(*) FROM users GROUP BY lower({column}) HAVING count(*) > 1 ORDER BY 1"))
+        found.extend((column, value, count) for value, count in rows)
+    return found
+
+
+def make_unique(conn):
+    for column in COLUMNS:
+        conn.execute(text(f"DROP INDEX IF EXISTS ix_users_lower_{column}"))
+        conn.execute(text(f"CREATE UNIQUE INDEX ix_users_lower_{column} ON users (lower({column}))"))
+
+
+def upgrade(conn):
+    found = duplicates(conn)
+    if found:
+        logger.warning(f"{len(found)} email(s)/username(s) are shared by accounts differing only in case, "
+                       "ix_users_lower_email and ix_users_lower_username stay non-unique until they are resolved")
+        return
+    make_unique(conn)
@@ -1,8 +1,23 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, text
+from datetime import datetime, timezone
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, func, text
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
 
 from movie_app.database import Base
 
+# SQLite's CURRENT_TIMESTAMP has no fractional seconds, so bind datetimes in the
+# same format or keyset comparisons against stored values never match
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
+
+def utcnow():
+    # updated_at is set here rather than by CURRENT_TIMESTAMP, for microseconds
+    # on SQLite too: two writes in the same second must give different ETags
+    return datetime.now(timezone.utc)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -13,13 +28,23 @@ class User(Base):
     username = Column(String, unique=True, nullable=False, index=True)
     full_name = Column(String, nullable=False)
     hashed_password = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), nullable=False,
+    created_at = Column(Timestamp, nullable=False,
+                        server_default=text('CURRENT_TIMESTAMP'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow,
                         server_default=text('CURRENT_TIMESTAMP'))
 
     movies = relationship("Movie", back_populates="owner")
     ratings = relationship('Rating', back_populates='user')
     comments = relationship('Comment', back_populates='author')
 
+    # Back the case-insensitive email/username login lookup, and keep it to
+    # one account per email or username
+    __table_args__ = (
+        Index("ix_users_lower_email", func.lower(email), unique=True),
+        Index("ix_users_lower_username", func.lower(username), unique=True),
+        Index("ix_users_created_at_id", created_at, id),
+    )
+
 
 class Movie(Base):
     __tablename__ = "movies"
@@ -31,13 +56,24 @@ class Movie(Base):
     description = Column(String)
     release_year = Column(Integer)
     user_id = Column(Integer, ForeignKey("users.id"))
-    created_at = Column(DateTime(timezone=True), nullable=False,
+    created_at = Column(Timestamp, nullable=False,
+                        server_default=text('CURRENT_TIMESTAMP'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow,
                         server_default=text('CURRENT_TIMESTAMP'))
 
     owner = relationship("User", back_populates="movies")
     ratings = relationship("Rating", back_populates="movie")
     comments = relationship("Comment", back_populates="movie")
 
+    # Keyset pagination order, see movie_app/pagination.py. Filtered lists
+    # get the same order behind their filter column
+    __table_args__ = (
+        Index("ix_movies_created_at_id", created_at, id),
+        Index("ix_movies_genre_created_at_id", genre, created_at, id),
+        Index("ix_movies_user_id_created_at_id", user_id, created_at, id),
+        Index("ix_movies_release_year_id", release_year, id),
+    )
+
 
 class Rating(Base):
     __tablename__ = "ratings"
@@ -47,12 +83,56 @@ class Rating(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     movie_id = Column(Integer, ForeignKey("movies.id"))
     rating_value = Column(Integer)
-    created_at = Column(DateTime(timezone=True), nullable=False,
+    created_at = Column(Timestamp, nullable=False,
+                        server_default=text('CURRENT_TIMESTAMP'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow,
                         server_default=text('CURRENT_TIMESTAMP'))
 
     user = relationship('User', back_populates='ratings')
     movie = relationship('Movie', back_populates='ratings')
 
+    # Keyset pagination order, see movie_app/pagination.py. A user rates a
+    # movie once, and that index also serves lookups by user
+    __table_args__ = (
+        Index("ix_ratings_created_at_id", created_at, id),
+        Index("ix_ratings_movie_id_created_at_id", movie_id, created_at, id),
+        Index("uq_ratings_user_id_movie_id", user_id, movie_id, unique=True),
+    )
+
+
+class MovieRatingStats(Base):
+    """Running rating totals per movie, kept in step with `ratings` on every write."""
+    __tablename__ = "movie_rating_stats"
+
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"),
+                      primary_key=True, nullable=False)
+    rating_sum = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    rating_count = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_1 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_2 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_3 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_4 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_5 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_6 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_7 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_8 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_9 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    count_10 = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow,
+                        server_default=text('CURRENT_TIMESTAMP'))
+
+    @staticmethod
+    def histogram_column(rating_value: int):
+        return f"count_{rating_value}"
+
+    @property
+    def histogram(self):
+        return {value: getattr(self, self.histogram_column(value)) for value in range(1, 11)}
+
+    @property
+    def avg_rating(self):
+        return round(self.rating_sum / self.rating_count, 2) if self.rating_count else 0.0
+
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -63,9 +143,22 @@ class Comment(Base):
     movie_id = Column(Integer, ForeignKey("movies.id"))
     comment = Column(String)
     parent_id = Column(Integer, ForeignKey("comments.id"), nullable=True)
-    created_at = Column(DateTime(timezone=True), nullable=False,
+    created_at = Column(Timestamp, nullable=False,
+                        server_default=text('CURRENT_TIMESTAMP'))
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow,
                         server_default=text('CURRENT_TIMESTAMP'))
+    # Kept in step by CommentCRUDService.reply_comment/delete_comment
+    reply_count = Column(Integer, nullable=False, default=0, server_default=text('0'))
 
     author = relationship('User', back_populates='comments')
     movie = relationship('Movie', back_populates='comments')
     replies = relationship('Comment', backref='parent', remote_side=[id])
+
+    # Keyset pagination order, see movie_app/pagination.py. Filtered lists
+    # get the same order behind their filter column
+    __table_args__ = (
+        Index("ix_comments_created_at_id", created_at, id),
+        Index("ix_comments_movie_id_created_at_id", movie_id, created_at, id),
+        Index("ix_comments_user_id_created_at_id", user_id, created_at, id),
+        Index("ix_comments_parent_id_created_at_id", parent_id, created_at, id),
+    )
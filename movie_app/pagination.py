@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException, Response
+from sqlalchemy import literal, tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(row):
+    payload = json.dumps([row.created_at.isoformat(), row.id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(query, model, offset: int = 0, limit: int = 10, cursor: str = None):
+    # Stable (created_at, id) order, served by the matching composite index.
+    # With a cursor the page starts after the last row seen instead of
+    # scanning and discarding `offset` rows
+    query = query.order_by(model.created_at, model.id)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # Bind with the column type so SQLite compares the same text format
+        bound = tuple_(literal(created_at, model.created_at.type), row_id)
+        query = query.where(tuple_(model.created_at, model.id) > bound)
+    else:
+        query = query.offset(offset)
+    return query.limit(limit)
+
+
+def set_next_cursor(response: Response, rows, limit: int):
+    # A short page means there is nothing after it
+    if rows and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1])
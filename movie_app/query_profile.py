@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import os
+import re
+import sys
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+import greenlet
+import orjson
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from movie_app.logger import logger
+
+load_dotenv()
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+# A slow statement is EXPLAINed again at most this often
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", 300))
+# Lets clients ask for the SQL behind a response, keep it off in production
+SQL_PROFILE_ENABLED = os.getenv("SQL_PROFILE_ENABLED", "false").lower() == "true"
+SQL_PROFILE_HEADER = "X-SQL-Profile"
+SQL_PROFILE_PARAM = "sql_profile"
+# Proxies fail responses whose headers outgrow their buffers, often 4-8 KB in all
+SQL_PROFILE_HEADER_MAX_BYTES = int(os.getenv("SQL_PROFILE_HEADER_MAX_BYTES", 2048))
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+PLACEHOLDERS = re.compile(r"\$\d+|%\(\w+\)s|%s")
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+# The profile of the request being served, see middleware.QueryProfileMiddleware
+current_profile = ContextVar("current_profile", default=None)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str):
+    # Same shape of statement, same fingerprint: literals and placeholders
+    # become ?, IN lists of any length become (...)
+    normalized = PLACEHOLDERS.sub("?", statement)
+    normalized = LITERALS.sub("?", normalized)
+    normalized = PLACEHOLDER_LISTS.sub("(...)", normalized)
+    return " ".join(normalized.split())
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_id(normalized: str):
+    return hashlib.blake2b(normalized.encode(), digest_size=6).hexdigest()
+
+
+def caller():
+    # The innermost movie_app function that issued the statement. With the
+    # async engine the statement runs in a greenlet, the awaiting coroutines
+    # are on the stack of the greenlet that spawned it
+    parent = greenlet.getcurrent().parent
+    frame = parent.gr_frame if parent is not None else sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.startswith(PACKAGE_DIR) and not code.co_filename.endswith("query_profile.py"):
+            return getattr(code, "co_qualname", code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class QueryProfile:
+    """Statements one request ran, with their durations and row counts.
+
+    Every request counts its statements and their time, for the access log.
+    Only detailed profiles, the ones a client asked for, keep each statement
+    and where it was issued.
+    """
+
+    __slots__ = ("detailed", "count", "total_ms", "queries")
+
+    def __init__(self, detailed: bool = True):
+        self.detailed = detailed
+        self.count = 0
+        self.total_ms = 0.0
+        self.queries = []
+
+    def record(self, statement: str, caller: str, ms: float, rows: int):
+        self.count += 1
+        self.total_ms += ms
+        if self.detailed:
+            self.queries.append((fingerprint(statement), caller, ms, rows))
+
+    def summary(self, limit: int = 20, sql_chars: int = 300):
+        """Per fingerprint counts and times, slowest first.
+
+        A fingerprint that ran more than once is listed under `duplicates`,
+        usually a loop issuing one query per row (N+1). Statements past
+        `limit` are only counted under `omitted`.
+        """
+        groups = {}
+        for normalized, query_caller, ms, rows in self.queries:
+            group = groups.get(normalized)
+            if group is None:
+                group = groups[normalized] = {
+                    "id": fingerprint_id(normalized), "sql": normalized[:sql_chars], "callers": [],
+                    "count": 0, "total_ms": 0.0, "rows": None,
+                }
+            group["count"] += 1
+            group["total_ms"] += ms
+            if rows is not None:
+                group["rows"] = (group["rows"] or 0) + rows
+            if query_caller not in group["callers"]:
+                group["callers"].append(query_caller)
+
+        statements = sorted(groups.values(), key=lambda group: group["total_ms"], reverse=True)
+        for group in statements:
+            group["total_ms"] = round(group["total_ms"], 3)
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "duplicates": [group["id"] for group in statements if group["count"] > 1],
+            "statements": statements[:limit],
+            "omitted": max(len(statements) - limit, 0),
+        }
+
+    def header(self, max_bytes: int = SQL_PROFILE_HEADER_MAX_BYTES):
+        """The summary as an X-SQL-Profile value of at most `max_bytes`.
+
+        The fastest statements are left out until it fits, then the
+        duplicate ids.
+        """
+        summary = self.summary(sql_chars=200)
+        while True:
+            value = orjson.dumps(summary).decode().encode("ascii", "backslashreplace")
+            if len(value) <= max_bytes:
+                return value
+            if summary["statements"]:
+                summary["statements"].pop()
+                summary["omitted"] += 1
+            elif summary["duplicates"]:
+                summary["duplicates"].pop()
+            else:
+                return value
+
+
+class QueryProfiler:
+    """Attribute every statement to the current request and catch slow ones.
+
+    Statements over `slow_ms` are logged with their fingerprint and caller,
+    and EXPLAINed on a separate connection in the background so the request
+    that ran them isn't held up.
+    """
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, explain_interval: float = SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS):
+        self.slow_ms = slow_ms
+        self.explain_interval = explain_interval
+        self.pending = set()
+        self._engines = {}
+        self._explained = {}
+
+    def instrument(self, engine: AsyncEngine):
+        self._engines[engine.sync_engine] = engine
+
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info["profile_start_ns"] = time.perf_counter_ns()
+
+        @event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            start = conn.info.pop("profile_start_ns", None)
+            if start is None:
+                return
+            ms = (time.perf_counter_ns() - start) / 1e6
+            profile = current_profile.get()
+            slow = ms >= self.slow_ms
+            if profile is not None and not profile.detailed and not slow:
+                # Just the totals for the access log, no frame walk
+                profile.record(statement, None, ms, None)
+                return
+            if profile is None and not slow:
+                return
+
+            # SELECT row counts aren't known until the rows are fetched, drivers report -1
+            rows = cursor.rowcount if cursor.rowcount >= 0 else None
+            query_caller = caller()
+            if profile is not None:
+                profile.record(statement, query_caller, ms, rows)
+            if slow:
+                # Batched statements have no single set of parameters to EXPLAIN with
+                explain = not executemany and conn.engine in self._engines
+                self.slow(conn.engine, statement, parameters, query_caller, ms, explain)
+
+    def slow(self, engine, statement: str, parameters, query_caller: str, ms: float, explain: bool = True):
+        normalized = fingerprint(statement)
+        query_id = fingerprint_id(normalized)
+        log_dict = {"slow_query": query_id, "ms": round(ms, 3), "caller": query_caller, "sql": normalized[:1000]}
+        logger.warning(log_dict, extra=log_dict)
+
+        if not explain or statement.lstrip()[:7].upper() == "EXPLAIN":
+            return
+        now = time.monotonic()
+        if query_id in self._explained and now - self._explained[query_id] < self.explain_interval:
+            return
+        self._explained[query_id] = now
+        task = asyncio.get_running_loop().create_task(self.explain(self._engines[engine], query_id, statement, parameters))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def explain(self, engine: AsyncEngine, query_id: str, statement: str, parameters):
+        postgresql = engine.dialect.name == "postgresql"
+        try:
+            async with engine.connect() as conn:
+                result = await conn.exec_driver_sql(
+                    ("EXPLAIN " if postgresql else "EXPLAIN QUERY PLAN ") + statement, parameters)
+                plan = [row[0] if postgresql else row[-1] for row in result]
+        except Exception as exc:
+            log_dict = {"slow_query": query_id, "explain_error": str(exc)}
+        else:
+            log_dict = {"slow_query": query_id, "plan": plan}
+        logger.warning(log_dict, extra=log_dict)
+
+
+# Instrumented with database.engine in main
+query_profiler = QueryProfiler()
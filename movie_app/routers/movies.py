@@ -1,28 +1,90 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from movie_app.logger import logger
 from movie_app.auth import get_current_user
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import movie_app.schemas as schemas
 from movie_app.crud import movie_crud_service
 from movie_app.database import get_db
+from movie_app.leaderboard import LEADERBOARD_SIZE, leaderboards
+from movie_app.etag import not_modified
+from movie_app.filters import QUERY_PLAN_HEADER, plan_movie_list
+from movie_app.pagination import set_next_cursor
+from movie_app.suggest import title_suggestions
 
 movie_router = APIRouter()
 
 
 @movie_router.get("/", status_code=200, response_model=List[schemas.Movie])
-async def get_movies(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    movies = movie_crud_service.get_movies(
+async def get_movies(
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    genre: List[str] = Query(default=[]),
+    owner_id: int | None = None,
+    year_from: int | None = None,
+    year_to: int | None = None,
+    min_rating: float | None = Query(default=None, ge=1, le=10),
+    sort: schemas.MovieSort | None = None,
+    offset: int = 0,
+    limit: int = 10,
+    cursor: str | None = None,
+):
+    if cursor and sort:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Cursor paging only supports the default order, use offset")
+
+    filters = schemas.MovieListFilters(
+        genre=genre, owner_id=owner_id, year_from=year_from, year_to=year_to, min_rating=min_rating)
+    response.headers[QUERY_PLAN_HEADER] = plan_movie_list(filters, sort)
+    movies = await movie_crud_service.get_movies(
         db,
         offset=offset,
-        limit=limit
+        limit=limit,
+        cursor=cursor,
+        filters=filters,
+        sort=sort
     )
+    if sort is None:
+        set_next_cursor(response, movies, limit)
     return movies
 
 
+@movie_router.get("/search", status_code=200, response_model=List[schemas.MovieSearchResult])
+async def search_movies(q: str = Query(min_length=1, max_length=200), prefix: bool = True, db: AsyncSession = Depends(get_db), offset: int = 0, limit: int = 10):
+    # Best matches first. Ranked results page by offset, not by cursor
+    results = await movie_crud_service.search_movies(
+        db, q, prefix=prefix, offset=offset, limit=limit)
+    return [{"movie": movie, "score": score} for movie, score in results]
+
+
+@movie_router.get("/suggest", status_code=200, response_model=List[schemas.MovieSuggestion])
+async def suggest_titles(q: str = Query(min_length=1, max_length=200), limit: int = Query(default=10, ge=1, le=20)):
+    # Served from memory on the event loop, no database session or threadpool hop
+    return [{"id": movie_id, "title": title} for movie_id, title in title_suggestions.suggest(q, limit)]
+
+
+@movie_router.get("/top", status_code=200, response_model=List[schemas.LeaderboardEntry])
+async def get_top_movies(limit: int = Query(default=10, ge=1, le=LEADERBOARD_SIZE)):
+    # Precomputed by movie_app.leaderboard, no database access
+    return leaderboards.top(limit)
+
+
+@movie_router.get("/top/trending", status_code=200, response_model=List[schemas.LeaderboardEntry])
+async def get_trending_movies(limit: int = Query(default=10, ge=1, le=LEADERBOARD_SIZE)):
+    return leaderboards.trending(limit)
+
+
+@movie_router.get("/top/genre/{genre}", status_code=200, response_model=List[schemas.LeaderboardEntry])
+async def get_top_movies_by_genre(genre: str, limit: int = Query(default=10, ge=1, le=LEADERBOARD_SIZE)):
+    return leaderboards.top_by_genre(genre, limit)
+
+
 @movie_router.get("/{movie_id}", status_code=200, response_model=schemas.Movie)
-async def get_movie_by_id(movie_id: str, db: Session = Depends(get_db)):
-    movie = movie_crud_service.get_movie_by_id(db, movie_id)
+async def get_movie_by_id(movie_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    version = await movie_crud_service.get_movie_version(db, movie_id)
+    if version and (cached := not_modified(request, response, version)):
+        return cached
+    movie = await movie_crud_service.get_movie_by_id(db, movie_id, version=version)
     if not movie:
         logger.warning("Getting movie with wrong id....")
         raise HTTPException(detail="Movie not found",
@@ -31,27 +93,38 @@ async def get_movie_by_id(movie_id: str, db: Session = Depends(get_db)):
 
 
 @movie_router.get("/genre/{genre}", status_code=200, response_model=List[schemas.Movie])
-async def get_movie_by_genre(genre: str, db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    movie = movie_crud_service.get_movie_by_genre(db, genre, offset, limit)
+async def get_movie_by_genre(genre: str, response: Response, db: AsyncSession = Depends(get_db), offset: int = 0, limit: int = 10, cursor: str | None = None):
+    movie = await movie_crud_service.get_movie_by_genre(db, genre, offset, limit, cursor)
     if not movie:
         raise HTTPException(detail="Movie not found",
                             status_code=status.HTTP_404_NOT_FOUND)
+    set_next_cursor(response, movie, limit)
     return movie
 
 
 @movie_router.get("/title/{movie_title}", status_code=200, response_model=List[schemas.Movie])
-async def get_movie_by_title(movie_title: str, db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    movie = movie_crud_service.get_movie_by_title(db, movie_title, offset, limit)
+async def get_movie_by_title(movie_title: str, response: Response, db: AsyncSession = Depends(get_db), offset: int = 0, limit: int = 10, cursor: str | None = None):
+    movie = await movie_crud_service.get_movie_by_title(db, movie_title, offset, limit, cursor)
     if not movie:
         logger.info("Getting movie with wrong title...")
         raise HTTPException(detail="Movie not found",
                             status_code=status.HTTP_404_NOT_FOUND)
+    set_next_cursor(response, movie, limit)
     return movie
 
 
+@movie_router.get("/title/{movie_title}/similar", status_code=200, response_model=List[schemas.MovieSearchResult])
+async def get_similar_titles(movie_title: str, db: AsyncSession = Depends(get_db), limit: int = Query(default=10, ge=1, le=50)):
+    results = await movie_crud_service.get_similar_titles(db, movie_title, limit)
+    if not results:
+        raise HTTPException(detail="Movie not found",
+                            status_code=status.HTTP_404_NOT_FOUND)
+    return [{"movie": movie, "score": score} for movie, score in results]
+
+
 @movie_router.post('/', status_code=201, response_model=schemas.Movie)
-async def list_movie(payload: schemas.MovieCreate, current_user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    movie = movie_crud_service.create_movie(
+async def list_movie(payload: schemas.MovieCreate, current_user: schemas.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    movie = await movie_crud_service.create_movie(
         db,
         payload,
         user_id=current_user.id
@@ -60,22 +133,22 @@ async def list_movie(payload: schemas.MovieCreate, current_user: schemas.User =
 
 
 @movie_router.put('/{movie_id}', status_code=200, response_model=schemas.Movie)
-async def update_movie(movie_id: int, payload: schemas.MovieUpdate, current_user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db_movie = movie_crud_service.get_movie_by_id(db, movie_id=movie_id)
+async def update_movie(movie_id: int, payload: schemas.MovieUpdate, current_user: schemas.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    db_movie = await movie_crud_service.get_movie_by_id(db, movie_id=movie_id)
     if not db_movie:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
     if db_movie.user_id != current_user.id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
-    movie = movie_crud_service.update_movie(
+    movie = await movie_crud_service.update_movie(
         db, movie_id=movie_id, movie_payload=payload)
     return movie
 
 
 @movie_router.delete("/{movie_id}", status_code=200)
-async def delete_movie(movie_id: int, current_user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    movie = movie_crud_service.get_movie_by_id(db, movie_id)
+async def delete_movie(movie_id: int, current_user: schemas.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    movie = await movie_crud_service.get_movie_by_id(db, movie_id)
     if not movie:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
@@ -83,6 +156,6 @@ async def delete_movie(movie_id: int, current_user: schemas.User = Depends(get_c
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
 
-    movie_crud_service.delete_movie(db, movie_id)
+    await movie_crud_service.delete_movie(db, movie_id)
 
     return {"message": "Successful"}
@@ -1,28 +1,32 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from movie_app.auth import get_current_user
 from movie_app.logger import logger
 import movie_app.schemas as schemas
 from movie_app.crud import rating_crud_service, movie_crud_service
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import movie_app.schemas as schemas
 from movie_app.database import get_db
+from movie_app.etag import not_modified
+from movie_app.pagination import set_next_cursor
 
 rating_router = APIRouter()
 
 @rating_router.get("/", status_code=200, response_model=List[schemas.Rating])
-async def get_ratings(db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    ratings = rating_crud_service.get_ratings(
+async def get_ratings(response: Response, db: AsyncSession = Depends(get_db), offset: int = 0, limit: int = 10, cursor: str | None = None):
+    ratings = await rating_crud_service.get_ratings(
         db,
         offset=offset,
-        limit=limit
+        limit=limit,
+        cursor=cursor
     )
+    set_next_cursor(response, ratings, limit)
     return ratings
 
 
 @rating_router.get("/{rating_id}", status_code=200, response_model=schemas.Rating)
-async def get_rating_by_id(rating_id: int, db: Session = Depends(get_db)):
-    rating = rating_crud_service.get_rating_by_id(
+async def get_rating_by_id(rating_id: int, db: AsyncSession = Depends(get_db)):
+    rating = await rating_crud_service.get_rating_by_id(
         db,
         rating_id=rating_id
     )
@@ -32,29 +36,34 @@ async def get_rating_by_id(rating_id: int, db: Session = Depends(get_db)):
 
 
 @rating_router.get("/movie_id/{movie_id}", status_code=200, response_model=List[schemas.Rating])
-async def get_ratings_by_movie_id(movie_id: int, db: Session = Depends(get_db), offset: int = 0, limit: int = 10):
-    movie = movie_crud_service.get_movie_by_id(db, movie_id)
+async def get_ratings_by_movie_id(movie_id: int, response: Response, db: AsyncSession = Depends(get_db), offset: int = 0, limit: int = 10, cursor: str | None = None):
+    movie = await movie_crud_service.get_movie_by_id(db, movie_id)
     if not movie:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
-    ratings = rating_crud_service.get_ratings_by_movie_id(
+    ratings = await rating_crud_service.get_ratings_by_movie_id(
         db,
         movie_id=movie_id,
         offset=offset,
-        limit=limit
+        limit=limit,
+        cursor=cursor
     )
+    set_next_cursor(response, ratings, limit)
     return ratings
 
 @rating_router.get("/average_rating/{movie_id}", status_code=200)
-async def get_movie_avg_rating(movie_id: int, db: Session = Depends(get_db)):
-    movie = movie_crud_service.get_movie_by_id(db, movie_id)
+async def get_movie_avg_rating(movie_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    version = await rating_crud_service.get_rating_stats_version(db, movie_id)
+    if version and (cached := not_modified(request, response, version)):
+        return cached
+    movie = await movie_crud_service.get_movie_by_id(db, movie_id, version=version and version[:2])
     if not movie:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
-    avg_rating = rating_crud_service.aggregate_rating(db, movie_id)
+    rating_stats = await rating_crud_service.aggregate_rating(db, movie_id, version=version)
     data = {
         "movie_id": movie.id,
         "movie_title": movie.title,
         "owner_id": movie.user_id,
-        "avg_rating": avg_rating
+        **rating_stats.model_dump()
     }
 
     return {"message": "successful", "data": data}
@@ -63,51 +72,65 @@ async def get_movie_avg_rating(movie_id: int, db: Session = Depends(get_db)):
     
 
 @rating_router.post('/{movie_id}', status_code=201, response_model=schemas.Rating)
-async def rate_movie(movie_id: int, rating: schemas.RatingCreate, current_user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    movie = movie_crud_service.get_movie_by_id(db, movie_id)
+async def rate_movie(movie_id: int, rating: schemas.RatingCreate, current_user: schemas.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    movie = await movie_crud_service.get_movie_by_id(db, movie_id)
     if not movie:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
-    # Query to see if there is an existing rating
 
-    db_rating = rating_crud_service.get_rating(db, user_id=current_user.id, movie_id=movie_id)
-    
+    # The insert skips an existing rating instead of checking for one first
+    new_rating = await rating_crud_service.rate_movie_by_id(
+        db,
+        rating=rating,
+        user_id=current_user.id,
+        movie_id=movie_id
+    )
+
     # Check if user has already rated movie
-    if db_rating is not None:
+    if new_rating is None:
         logger.warning("User trying to rate an already rated movie...")
         raise HTTPException(status.HTTP_409_CONFLICT, detail="You have already rated movie. Update existing rating")
+    return new_rating
+
 
-    new_rating = rating_crud_service.rate_movie_by_id(
+@rating_router.put('/movie_id/{movie_id}', status_code=200, response_model=schemas.Rating)
+async def set_movie_rating(movie_id: int, rating: schemas.RatingCreate, current_user: schemas.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Idempotent: creates the user's rating or replaces its value
+    movie = await movie_crud_service.get_movie_by_id(db, movie_id)
+    if not movie:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Movie not found")
+
+    return await rating_crud_service.upsert_rating(
         db,
         rating=rating,
         user_id=current_user.id,
         movie_id=movie_id
     )
-    return new_rating
 
 
 @rating_router.put("/{rating_id}", status_code=200, response_model=schemas.Rating)
-async def update_rating(rating_id: int, payload: schemas.RatingUpdate, current_user: schemas.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    rating = rating_crud_service.get_rating_by_id(db, rating_id)
+async def update_rating(rating_id: int, payload: schemas.RatingUpdate, current_user: schemas.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    rating = await rating_crud_service.get_rating_by_id(db, rating_id)
     if not rating:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Rating not found")
     if rating.user_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
    
-    update_rating = rating_crud_service.update_rating(db,rating_payload=payload, rating_id=rating_id)
+    update_rating = await rating_crud_service.update_rating(db,rating_payload=payload, rating_id=rating_id)
 
     return update_rating
 
 
 @rating_router.delete("/{rating_id}", status_code=200)
-async def delete_rating(rating_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    rating = rating_crud_service.get_rating_by_id(db, rating_id=rating_id)
+async def delete_rating(rating_id: int, db: AsyncSession = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    rating = await rating_crud_service.get_rating_by_id(db, rating_id=rating_id)
     if not rating:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Rating not found")
     if rating.user_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authorized")
 
-    rating_crud_service.delete_rating(db, rating_id=rating_id)
+    await rating_crud_service.delete_rating(db, rating_id=rating_id)
     return {"message": "Successful"}
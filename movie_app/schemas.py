@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 from pydantic import BaseModel, EmailStr, Field
 
@@ -56,6 +56,36 @@ class Movie(MovieBase):
         from_attributes = True
 
 
+class MovieListFilters(BaseModel):
+    genre: List[str] = []
+    owner_id: Optional[int] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    min_rating: Optional[float] = None
+
+
+MovieSort = Literal["newest", "rating", "title"]
+
+
+class MovieSearchResult(BaseModel):
+    movie: Movie
+    score: float
+
+
+class MovieSuggestion(BaseModel):
+    id: int
+    title: str
+
+
+class LeaderboardEntry(BaseModel):
+    movie_id: int
+    title: str
+    genre: str
+    score: float
+    avg_rating: float
+    rating_count: int
+
+
 class RatingBase(BaseModel):
     rating_value: int = Field(ge=1, le=10)
 
@@ -79,6 +109,12 @@ class Rating(RatingBase):
         from_attributes = True
 
 
+class RatingStats(BaseModel):
+    avg_rating: float
+    rating_count: int
+    histogram: Dict[int, int]
+
+
 class CommentBase(BaseModel):
     comment: str
 
@@ -94,7 +130,7 @@ class CommentUpdate(BaseModel):
 class Comment(CommentBase):
     id: int
     user_id: int
-    movie_id: int
+    movie_id: Optional[int]  # None once the movie is deleted
     created_at: datetime
     parent_id: Optional[int]
     author: User
@@ -115,7 +151,7 @@ class AuthorResponse(BaseModel):
 class CommentResponse(BaseModel):
     id: int
     user_id: int
-    movie_id: int
+    movie_id: Optional[int]
     comment: str
     parent_id: Optional[int]
     created_at: datetime
@@ -129,3 +165,14 @@ class CommentResponse(BaseModel):
 class CommentOut(BaseModel):
     Comment: Comment
     replies: int
+
+
+class CommentNode(BaseModel):
+    # Compact thread node, `reply_count` is the total so clients can tell when replies were cut off
+    id: int
+    user_id: Optional[int]
+    author: Optional[str]
+    comment: Optional[str]
+    created_at: datetime
+    reply_count: int
+    replies: list["CommentNode"] = []
@@ -0,0 +1,75 @@
+import re
+from bisect import bisect_left, insort
+
+
+def normalize(text: str):
+    return " ".join(re.findall(r"\w+", text.casefold()))
+
+
+class TitleSuggestions:
+    """In-process prefix index of movie titles for search-as-you-type.
+
+    Every title is stored once per word it contains, keyed on the normalized
+    title from that word on, in one sorted list. "The Dark Knight" is found by
+    "the d", "dark" and "kni". A lookup is a bisect to the first key with the
+    prefix followed by a scan of at most a few more entries than it returns.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._titles = {}
+
+    def __len__(self):
+        return len(self._titles)
+
+    @staticmethod
+    def _keys(title: str):
+        words = normalize(title).split()
+        return {" ".join(words[i:]) for i in range(len(words))}
+
+    def build(self, rows):
+        self._titles = dict(rows)
+        self._entries = sorted(
+            (key, movie_id, title)
+            for movie_id, title in self._titles.items()
+            for key in self._keys(title)
+        )
+
+    def add(self, movie_id: int, title: str):
+        self.remove(movie_id)
+        self._titles[movie_id] = title
+        for key in self._keys(title):
+            insort(self._entries, (key, movie_id, title))
+
+    def remove(self, movie_id: int):
+        title = self._titles.pop(movie_id, None)
+        if title is None:
+            return
+        for key in self._keys(title):
+            i = bisect_left(self._entries, (key, movie_id))
+            if i < len(self._entries) and self._entries[i][:2] == (key, movie_id):
+                del self._entries[i]
+
+    def clear(self):
+        self._entries = []
+        self._titles = {}
+
+    def suggest(self, prefix: str, limit: int = 10):
+        """Return up to `limit` (movie_id, title) pairs whose title has a word starting with `prefix`."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        suggestions = {}
+        i = bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and len(suggestions) < limit:
+            key, movie_id, title = self._entries[i]
+            if not key.startswith(prefix):
+                break
+            suggestions.setdefault(movie_id, title)
+            i += 1
+        return list(suggestions.items())
+
+
+# Built from the movies table on startup, see main.lifespan
+title_suggestions = TitleSuggestions()
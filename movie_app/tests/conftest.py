@@ -1,31 +1,46 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
 from movie_app.main import app
+from movie_app.cache import principal_cache, read_cache
 from movie_app.database import Base, get_db
+from movie_app.suggest import title_suggestions
+from movie_app.trigram import title_index
+from movie_app.migrations import migrate, version_table
+from movie_app.query_profile import query_profiler
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite://"
 
-engine = create_engine(
+engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
-TestingSessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = async_sessionmaker(
+    autoflush=False, bind=engine, expire_on_commit=False)
+# Requests run their queries here, profile them like main does database.engine
+query_profiler.instrument(engine)
 
 
-Base.metadata.create_all(bind=engine)
+async def create_tables():
+    await migrate(engine)
 
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def drop_tables():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(version_table.drop)
+
+
+asyncio.run(create_tables())
+
+
+async def override_get_db():
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -39,6 +54,25 @@ def client():
 
 @pytest.fixture(scope="module")
 def setup_database():
-    Base.metadata.create_all(bind=engine)
+    asyncio.run(create_tables())
     yield
-    Base.metadata.drop_all(bind=engine)
+    asyncio.run(drop_tables())
+    asyncio.run(principal_cache.clear("principal"))
+    principal_cache.reset_stats()
+    asyncio.run(read_cache.clear())
+    read_cache.reset_stats()
+    title_index.clear()
+    title_suggestions.clear()
+
+
+@pytest.fixture
+def count_queries():
+    # Records (statement, parameters) sent to the test database while the fixture is active
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
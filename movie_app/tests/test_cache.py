@@ -0,0 +1,182 @@
+import asyncio
+import pytest
+from movie_app.cache import MISSING, MemoryBackend, ReadThroughCache, RedisBackend
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(maxsize=2)
+
+    async def run():
+        await backend.set("a", 1, ttl=60)
+        await backend.set("b", 2, ttl=60)
+        await backend.get("a")
+        await backend.set("c", 3, ttl=60)
+        return [await backend.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [1, MISSING, 3]
+    assert backend.size() == 2
+
+
+class FakeRedis:
+    """Enough of redis.asyncio.Redis for RedisBackend, expiry is not simulated."""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, px=None):
+        self.data[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def scan_iter(self, match):
+        for key in list(self.data):
+            if key.startswith(match.rstrip("*")):
+                yield key
+
+
+def counting_loader(results, delay: float = 0):
+    calls = []
+
+    async def load(db, movie_id: int):
+        calls.append(movie_id)
+        result = results.get(movie_id)
+        await asyncio.sleep(delay)
+        return result
+
+    return load, calls
+
+
+@pytest.mark.parametrize("backend", [MemoryBackend(), RedisBackend(FakeRedis())], ids=["memory", "redis"])
+def test_read_through(backend):
+    cache = ReadThroughCache(backend)
+    load, calls = counting_loader({1: {"title": "Alien", "histogram": {1: 0}}})
+    get = cache.cached("movie", ttl=60)(load)
+
+    async def run():
+        first = await get(None, 1)
+        second = await get("another session", movie_id=1)
+        missing = [await get(None, 2), await get(None, 2)]
+        await cache.invalidate("movie", 1)
+        third = await get(None, 1)
+        await cache.clear("movie")
+        await get(None, 1)
+        return first, second, missing, third
+
+    first, second, missing, third = asyncio.run(run())
+    assert first["title"] == second["title"] == third["title"] == "Alien"
+    # Absent rows are cached too
+    assert missing == [None, None]
+    assert calls == [1, 2, 1, 1]
+
+    stats = cache.stats()["namespaces"]["movie"]
+    assert (stats["hits"], stats["misses"]) == (2, 4)
+    assert stats["hit_ratio"] == 2 / 6
+
+
+def test_entries_expire_per_key():
+    cache = ReadThroughCache(MemoryBackend())
+    load, calls = counting_loader({1: "short", 2: "long"})
+    short = cache.cached("short", ttl=0.01)(load)
+    long = cache.cached("long", ttl=60)(load)
+
+    async def run():
+        await short(None, 1)
+        await long(None, 2)
+        await asyncio.sleep(0.02)
+        await short(None, 1)
+        await long(None, 2)
+
+    asyncio.run(run())
+    assert calls == [1, 2, 1]
+
+
+def test_concurrent_misses_load_once():
+    cache = ReadThroughCache(MemoryBackend())
+    load, calls = counting_loader({1: "Alien"}, delay=0.01)
+    get = cache.cached("movie", ttl=60)(load)
+
+    async def run():
+        return await asyncio.gather(*(get(None, 1) for _ in range(20)))
+
+    assert asyncio.run(run()) == ["Alien"] * 20
+    assert calls == [1]
+    stats = cache.stats()["namespaces"]["movie"]
+    assert (stats["misses"], stats["coalesced"]) == (1, 19)
+
+
+def test_load_invalidated_midway_is_not_stored():
+    cache = ReadThroughCache(MemoryBackend())
+    results = {1: "old"}
+    load, calls = counting_loader(results, delay=0.01)
+    get = cache.cached("movie", ttl=60)(load)
+
+    async def write():
+        await asyncio.sleep(0.005)
+        results[1] = "new"
+        await cache.invalidate("movie", 1)
+
+    async def run():
+        stale, _ = await asyncio.gather(get(None, 1), write())
+        return stale, await get(None, 1)
+
+    assert asyncio.run(run()) == ("old", "new")
+    assert calls == [1, 1]
+
+
+def test_failed_load_reaches_every_waiter():
+    cache = ReadThroughCache(MemoryBackend())
+
+    async def load(db, movie_id: int):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("database is down")
+
+    get = cache.cached("movie", ttl=60)(load)
+
+    async def run():
+        return await asyncio.gather(get(None, 1), get(None, 1), return_exceptions=True)
+
+    assert [str(error) for error in asyncio.run(run())] == ["database is down"] * 2
+    assert cache._inflight == {}
+
+
+def test_versioned_reads_reload_entries_of_other_versions():
+    cache = ReadThroughCache(MemoryBackend())
+    results = {1: "old"}
+    load, calls = counting_loader(results)
+    get = cache.cached("movie", ttl=60)(load)
+
+    async def run():
+        seen = [await get(None, 1, version=("v1",)), await get(None, 1, version=("v1",))]
+        # Written by another process, nothing invalidated here
+        results[1] = "new"
+        seen += [await get(None, 1, version=("v2",)), await get(None, 1), await get(None, 1, version=("v2",))]
+        return seen
+
+    assert asyncio.run(run()) == ["old", "old", "new", "new", "new"]
+    assert calls == [1, 1]
+    stats = cache.stats()["namespaces"]["movie"]
+    assert (stats["hits"], stats["misses"], stats["stale"]) == (3, 2, 1)
+
+
+def test_loads_of_different_versions_are_not_shared():
+    cache = ReadThroughCache(MemoryBackend())
+    results = {1: "old"}
+    load, calls = counting_loader(results, delay=0.01)
+    get = cache.cached("movie", ttl=60)(load)
+
+    async def write():
+        await asyncio.sleep(0.005)
+        results[1] = "new"
+        # The version this request looked up after the write
+        return await get(None, 1, version=("v2",))
+
+    async def run():
+        return await asyncio.gather(get(None, 1, version=("v1",)), write())
+
+    assert asyncio.run(run()) == ["old", "new"]
+    assert calls == [1, 1]
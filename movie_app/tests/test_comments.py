@@ -1,4 +1,10 @@
+import asyncio
 import pytest
+from sqlalchemy import update
+import movie_app.models as models
+from movie_app.cache import read_cache
+from movie_app.crud import comment_crud_service
+from movie_app.tests.conftest import TestingSessionLocal
 
 
 
@@ -282,3 +288,136 @@ def test_delete_comment(client, setup_database, username, password, comment_id,
     assert response.status_code == 200
     data = response.json()
     assert data == {"message": "Successful"}
+
+
+@pytest.mark.parametrize("comment_id", [1])
+def test_reply_count(client, setup_database, comment_id):
+    response = client.post(
+        "/login/", data={"username": "testuser",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    # The replies endpoint answers 404 when there are none
+    response = client.get(f"/movies/comments/replies/{comment_id}")
+    replies = response.json() if response.status_code == 200 else []
+    response = client.get(f"/movies/comments/{comment_id}")
+    assert response.status_code == 200
+    assert response.json()["replies"] == len(replies)
+
+    response = client.post(
+        f"/movies/comments/reply_comment/{comment_id}", json={"comment": "Another reply"}, headers=headers)
+    assert response.status_code == 200
+    reply_id = response.json()["id"]
+    assert client.get(f"/movies/comments/{comment_id}").json()["replies"] == len(replies) + 1
+
+    listed = {comment["id"]: comment["replies"] for comment in client.get("/movies/comments/").json()}
+    assert listed[comment_id] == len(replies) + 1
+    assert listed[reply_id] == 0
+
+    response = client.delete(f"/movies/comments/{reply_id}", headers=headers)
+    assert response.status_code == 200
+    assert client.get(f"/movies/comments/{comment_id}").json()["replies"] == len(replies)
+
+    async def check(rebuild=False):
+        async with TestingSessionLocal() as db:
+            return await comment_crud_service.check_reply_counts(db, rebuild=rebuild)
+
+    async def corrupt():
+        async with TestingSessionLocal() as db:
+            await db.execute(update(models.Comment).where(models.Comment.id == comment_id).values(reply_count=42))
+            await db.commit()
+
+    assert asyncio.run(check()) == []
+    asyncio.run(corrupt())
+    assert asyncio.run(check()) == [{"comment_id": comment_id, "expected": len(replies), "stored": 42}]
+    # Cache the drifted count
+    asyncio.run(read_cache.clear("comment"))
+    assert client.get(f"/movies/comments/{comment_id}").json()["replies"] == 42
+    asyncio.run(check(rebuild=True))
+    assert asyncio.run(check()) == []
+    # The rebuilt count is served, not the cached one
+    assert client.get(f"/movies/comments/{comment_id}").json()["replies"] == len(replies)
+
+
+def test_comment_threads(client, setup_database, count_queries):
+    response = client.post(
+        "/login/", data={"username": "testuser",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = client.post("/movies", json={"title": "Thread Movie", "genre": "Drama"}, headers=headers)
+    movie_id = response.json()["id"]
+
+    def post(text, parent_id=None):
+        url = f"/movies/comments/reply_comment/{parent_id}" if parent_id else f"/movies/comments/{movie_id}"
+        return client.post(url, json={"comment": text}, headers=headers).json()["id"]
+
+    # a -> a1 -> a1x -> a1xx, a -> a2, a -> a3, b
+    a = post("a")
+    b = post("b")
+    a1 = post("a1", a)
+    post("a2", a)
+    post("a3", a)
+    a1x = post("a1x", a1)
+    post("a1xx", a1x)
+
+    response = client.get(f"/movies/comments/movie/{movie_id}/threads")
+    assert response.status_code == 200
+    threads = response.json()
+    assert [thread["id"] for thread in threads] == [a, b]
+    assert [reply["comment"] for reply in threads[0]["replies"]] == ["a1", "a2", "a3"]
+    assert threads[0]["replies"][0]["replies"][0]["replies"][0]["comment"] == "a1xx"
+    assert threads[0]["author"] == "testuser"
+    assert threads[1]["replies"] == []
+
+    # Siblings past the per-level limit and levels past max_depth are cut off
+    response = client.get(
+        f"/movies/comments/movie/{movie_id}/threads", params={"max_depth": 1, "per_level_limit": 2})
+    threads = response.json()
+    assert [thread["id"] for thread in threads] == [a, b]
+    assert [reply["comment"] for reply in threads[0]["replies"]] == ["a1", "a2"]
+    assert threads[0]["reply_count"] == 3
+    assert threads[0]["replies"][0]["replies"] == []
+    assert threads[0]["replies"][0]["reply_count"] == 1
+
+    # A single thread is one query
+    count_queries.clear()
+    response = client.get(f"/movies/comments/thread/{a1}")
+    assert response.status_code == 200
+    assert len(count_queries) == 1
+    thread = response.json()
+    assert thread["comment"] == "a1"
+    assert thread["replies"][0]["replies"][0]["comment"] == "a1xx"
+
+    response = client.get("/movies/comments/thread/999")
+    assert response.status_code == 404
+    response = client.get("/movies/comments/movie/999/threads")
+    assert response.status_code == 404
+
+    # Threads outlive their movie, detached from it
+    response = client.delete(f"/movies/{movie_id}", headers=headers)
+    assert response.status_code == 200
+    response = client.get(f"/movies/comments/thread/{a}")
+    assert response.status_code == 200
+    thread = response.json()
+    assert [reply["comment"] for reply in thread["replies"]] == ["a1", "a2", "a3"]
+    assert client.get(f"/movies/comments/thread/{b}").json()["replies"] == []
+
+
+def test_get_comments_skips_deleted_authors(client, setup_database):
+    client.post(
+        "/signup/", json={"username": "leaver", "email": "leaver@example.com", "full_name": "Leaver", "password": "testpassword123"})
+    response = client.post(
+        "/login/", data={"username": "leaver",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    user_id = client.get("/users/name/leaver").json()["id"]
+
+    # On a movie of its own, other tests list the comments of movie 1
+    response = client.post("/movies", json={"title": "Farewell", "genre": "Drama"}, headers=headers)
+    movie_id = response.json()["id"]
+    response = client.post(f"/movies/comments/{movie_id}", json={"comment": "Leaving soon"}, headers=headers)
+    assert response.status_code == 201
+    comment_id = response.json()["id"]
+    assert client.delete(f"/users/{user_id}", headers=headers).status_code == 200
+
+    response = client.get("/movies/comments/", params={"limit": 100})
+    assert response.status_code == 200
+    assert comment_id not in [comment["id"] for comment in response.json()]
@@ -0,0 +1,40 @@
+import asyncio
+from fastapi import HTTPException
+from movie_app.hashing import HashingPool
+
+
+def test_hash_and_verify():
+    pool = HashingPool(workers=2, max_pending=4)
+
+    async def run():
+        hashed = await pool.hash("testpassword123")
+        return hashed, await pool.verify("testpassword123", hashed), await pool.verify("wrong", hashed)
+
+    hashed, valid, invalid = asyncio.run(run())
+    pool.shutdown()
+
+    assert hashed != "testpassword123"
+    assert valid is True
+    assert invalid is False
+
+    stats = pool.stats()
+    assert stats["completed"] == 3
+    assert stats["in_flight"] == 0
+    assert stats["rejected"] == 0
+
+
+def test_rejects_when_saturated():
+    pool = HashingPool(workers=1, max_pending=2)
+
+    async def run():
+        return await asyncio.gather(
+            *(pool.hash("testpassword123") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    pool.shutdown()
+
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["peak_in_flight"] == 2
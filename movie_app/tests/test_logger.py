@@ -0,0 +1,58 @@
+import logging
+import queue
+import threading
+from movie_app.logger import BatchingQueueListener, DroppingQueueHandler
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self, gate: threading.Event = None):
+        super().__init__()
+        self.gate = gate
+        self.received = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.received.set()
+        if self.gate:
+            self.gate.wait()
+        self.messages.append(record.getMessage())
+
+
+def pipeline(size: int, batch_size: int, gate: threading.Event = None):
+    log_queue = queue.Queue(maxsize=size)
+    sink = CollectingHandler(gate)
+    test_logger = logging.getLogger(f"test_logger.{size}.{batch_size}")
+    test_logger.propagate = False
+    handler = DroppingQueueHandler(log_queue)
+    test_logger.handlers = [handler]
+    return test_logger, handler, BatchingQueueListener(log_queue, sink, batch_size=batch_size), sink
+
+
+def test_stop_flushes_queued_records_in_batches():
+    test_logger, handler, listener, sink = pipeline(size=100, batch_size=10)
+    for i in range(50):
+        test_logger.warning("record %d", i)
+
+    listener.start()
+    listener.stop()
+    listener.stop()
+
+    assert sink.messages == [f"record {i}" for i in range(50)]
+    assert (handler.enqueued, handler.dropped, listener.processed) == (50, 0, 50)
+    assert listener.batches == 6
+
+
+def test_full_queue_drops_without_blocking():
+    gate = threading.Event()
+    test_logger, handler, listener, sink = pipeline(size=5, batch_size=1, gate=gate)
+    listener.start()
+    # The sink is stuck on the first record, five more fit in the queue
+    test_logger.warning("first")
+    assert sink.received.wait(timeout=5)
+    for i in range(20):
+        test_logger.warning("record %d", i)
+
+    assert (handler.enqueued, handler.dropped) == (6, 15)
+    gate.set()
+    listener.stop()
+    assert sink.messages == ["first"] + [f"record {i}" for i in range(5)]
@@ -0,0 +1,112 @@
+import asyncio
+import re
+import pytest
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from movie_app.database import TimedQueuePool, engine_options
+from movie_app.metrics import Histogram, Metrics, operation
+
+
+def sample(body: str, name: str):
+    match = re.search(rf"^{re.escape(name)} (\S+)$", body, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    samples = list(histogram.samples({"route": "/"}))
+    assert [(labels["le"], count) for suffix, labels, count in samples if suffix == "_bucket"] == [
+        (0.1, 2), (1.0, 3), ("+Inf", 4)]
+    assert samples[-1] == ("_count", {"route": "/"}, 4)
+
+
+def test_operation():
+    assert operation("  select 1") == "SELECT"
+    assert operation("WITH RECURSIVE tree AS (SELECT 1) SELECT * FROM tree") == "WITH"
+    assert operation("PRAGMA foreign_keys") == "OTHER"
+    assert operation("") == "OTHER"
+
+
+def test_engine_queries_and_pool():
+    metrics = Metrics()
+    engine = create_async_engine("sqlite+aiosqlite://")
+    metrics.instrument(engine)
+
+    async def run():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await conn.execute(text("SELECT 2"))
+            assert metrics.pool_checked_out == 1
+            try:
+                await conn.execute(text("SELECT * FROM missing"))
+            except Exception:
+                pass
+        await engine.dispose()
+
+    asyncio.run(run())
+    body = metrics.render()
+    assert sample(body, 'db_queries_total{operation="SELECT"}') == 2
+    assert sample(body, 'db_query_errors_total{operation="SELECT"}') == 1
+    assert sample(body, 'db_query_duration_seconds_count{operation="SELECT"}') == 2
+    assert sample(body, "db_pool_checked_out") == 0
+    assert sample(body, "db_pool_checkouts_total") == 1
+
+
+def test_engine_options():
+    assert engine_options("sqlite+aiosqlite:///./test.db", statement_timeout_ms=5000) == {
+        "pool_pre_ping": True, "pool_recycle": 1800}
+
+    options = engine_options("postgresql+asyncpg://app@db/movies", pool_size=20, max_overflow=0, pool_timeout=2,
+                             statement_timeout_ms=5000)
+    assert options["poolclass"] is TimedQueuePool
+    assert (options["pool_size"], options["max_overflow"], options["pool_timeout"]) == (20, 0, 2)
+    assert options["connect_args"] == {"server_settings": {"statement_timeout": "5000"}}
+    assert "connect_args" not in engine_options("postgresql+asyncpg://app@db/movies", statement_timeout_ms=0)
+
+
+def test_pool_checkout_wait(tmp_path):
+    metrics = Metrics()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/pool.db", poolclass=TimedQueuePool,
+                                 pool_size=1, max_overflow=0, pool_timeout=0.05)
+    metrics.instrument(engine)
+
+    async def hold(seconds: float):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await asyncio.sleep(seconds)
+
+    async def run():
+        await hold(0)
+        # The second checkout waits for the first to be returned
+        await asyncio.gather(hold(0.02), hold(0))
+        with pytest.raises(exc.TimeoutError):
+            await asyncio.gather(hold(0.2), hold(0))
+        await engine.dispose()
+
+    asyncio.run(run())
+    body = metrics.render()
+    assert sample(body, "db_pool_checkout_wait_seconds_count") == 4
+    assert sample(body, "db_pool_checkout_wait_seconds_sum") >= 0.015
+    assert sample(body, 'db_pool_checkout_wait_seconds_bucket{le="0.01"}') < 4
+    assert sample(body, "db_pool_checkout_timeouts_total") == 1
+    assert sample(body, "db_pool_size") == 1
+
+
+def test_metrics_endpoint(client):
+    client.get("/")
+    client.get("/movies/suggest", params={"q": "a"})
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert sample(body, 'http_requests_total{method="GET",route="/movies/suggest",status="200"}') >= 1
+    assert sample(body, 'http_requests_total{method="GET",route="unmatched",status="404"}') >= 1
+    assert sample(body, 'http_request_duration_seconds_bucket{method="GET",route="/",le="+Inf"}') >= 1
+    # This request is still in flight while it renders
+    assert sample(body, "http_requests_in_flight") == 1
+    assert "# TYPE log_records_dropped_total counter" in body
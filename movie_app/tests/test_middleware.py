@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import re
+import orjson
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from movie_app.logger import StructuredFormatter
+from movie_app.middleware import LogMiddleware
+
+app = FastAPI()
+app.add_middleware(LogMiddleware)
+
+
+@app.get("/stream")
+async def stream():
+    async def chunks():
+        for i in range(3):
+            yield f"chunk {i}\n"
+    return StreamingResponse(chunks())
+
+
+@app.get("/fail")
+async def fail():
+    raise RuntimeError("boom")
+
+
+def logged(caplog):
+    return [record.__dict__ for record in caplog.records if hasattr(record, "process_time")]
+
+
+def test_logs_streamed_response(caplog):
+    caplog.set_level(logging.INFO)
+    response = TestClient(app).get("/stream?x=1")
+
+    assert response.text == "chunk 0\nchunk 1\nchunk 2\n"
+    [entry] = logged(caplog)
+    assert (entry["url"], entry["method"], entry["status_code"]) == ("/stream", "GET", 200)
+    assert 0 < entry["process_time"] < 1
+
+
+@pytest.mark.parametrize("path, status_code", [("/missing", 404), ("/fail", 500)])
+def test_logs_status_code(caplog, path, status_code):
+    caplog.set_level(logging.INFO)
+    response = TestClient(app, raise_server_exceptions=False).get(path)
+
+    assert response.status_code == status_code
+    assert [entry["status_code"] for entry in logged(caplog)] == [status_code]
+
+
+@app.get("/movies/{movie_id}")
+async def movie(movie_id: int):
+    return {"id": movie_id}
+
+
+@app.get("/slow")
+async def slow():
+    await asyncio.sleep(0.02)
+    return {}
+
+
+def structured_app(sample_rate: float):
+    wrapped = LogMiddleware(app.router, format="json", sample_rate=sample_rate, slow_ms=10)
+    return TestClient(wrapped, raise_server_exceptions=False)
+
+
+def test_structured_access_log(caplog):
+    caplog.set_level(logging.INFO)
+    response = structured_app(sample_rate=1).get("/movies/42", headers={"X-Request-ID": "abc-123"})
+
+    assert response.headers["X-Request-ID"] == "abc-123"
+    [record] = [record for record in caplog.records if hasattr(record, "access")]
+    entry = orjson.loads(StructuredFormatter().format(record))
+    assert entry["request_id"] == "abc-123"
+    assert (entry["method"], entry["route"], entry["status"]) == ("GET", "/movies/{movie_id}", 200)
+    assert "sample_rate" not in entry
+
+
+def test_unusable_request_id_is_replaced(caplog):
+    response = structured_app(sample_rate=1).get("/movies/42", headers={"X-Request-ID": "a b\\nc"})
+    assert re.fullmatch(r"[0-9a-f]{32}", response.headers["X-Request-ID"])
+
+
+def test_sampling_keeps_errors_and_slow_requests(caplog):
+    caplog.set_level(logging.INFO)
+    client = structured_app(sample_rate=0)
+    for path in ["/movies/1", "/movies/2", "/missing", "/fail", "/slow"]:
+        client.get(path)
+
+    entries = [record.access for record in caplog.records if hasattr(record, "access")]
+    assert [(entry["route"], entry["status"]) for entry in entries] == [(None, 404), ("/fail", 500), ("/slow", 200)]
+    assert entries[2]["slow"] is True
+    assert [record.levelname for record in caplog.records if hasattr(record, "access")] == ["INFO", "ERROR", "WARNING"]
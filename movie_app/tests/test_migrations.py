@@ -0,0 +1,116 @@
+import asyncio
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import movie_app.crud as crud
+from movie_app.crud import user_crud_service
+from movie_app.database import Base
+from movie_app.migrations import MIGRATIONS, migrate, parse_version, v0008_unique_lower_user_indexes, version_table
+
+
+def describe_schema(conn):
+    inspector = inspect(conn)
+    tables = {
+        table: {
+            "columns": sorted((column["name"], str(column["type"]), column["nullable"]) for column in inspector.get_columns(table)),
+            "foreign_keys": sorted((tuple(fk["constrained_columns"]), fk["referred_table"]) for fk in inspector.get_foreign_keys(table)),
+        }
+        for table in inspector.get_table_names()
+        # The FTS5 search tables exist only in migrated databases
+        if table != version_table.name and not table.startswith("movies_fts")
+    }
+    # The inspector skips SQLite expression indexes, so compare their DDL
+    indexes = conn.execute(text(
+        "SELECT tbl_name, name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name != :table AND tbl_name NOT LIKE 'movies_fts%' ORDER BY name"),
+        {"table": version_table.name}).all()
+    return tables, indexes
+
+
+def test_migrations_match_models():
+    async def run():
+        migrated = create_async_engine("sqlite+aiosqlite://")
+        applied = await migrate(migrated)
+        rerun = await migrate(migrated)
+        async with migrated.connect() as conn:
+            migrated_schema = await conn.run_sync(describe_schema)
+
+        created = create_async_engine("sqlite+aiosqlite://")
+        async with created.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            created_schema = await conn.run_sync(describe_schema)
+
+        await migrated.dispose()
+        await created.dispose()
+        return applied, rerun, migrated_schema, created_schema
+
+    applied, rerun, migrated_schema, created_schema = asyncio.run(run())
+
+    assert applied == [parse_version(module) for module in MIGRATIONS]
+    assert rerun == []
+    assert migrated_schema == created_schema
+
+
+def test_upgrades_create_all_database():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            # A database created before migrations, without the newer indexes
+            await conn.run_sync(MIGRATIONS[0].metadata.create_all)
+            await conn.execute(text("INSERT INTO movies (id, title, genre) VALUES (1, 'Movie', 'Drama')"))
+            await conn.execute(text("INSERT INTO ratings (user_id, movie_id, rating_value) VALUES (1, 1, 8), (1, 1, 2), (2, 1, 6)"))
+            await conn.execute(text("INSERT INTO movie_rating_stats (movie_id, rating_sum, rating_count, count_2, count_6, count_8) VALUES (1, 16, 3, 1, 1, 1)"))
+            await conn.execute(text("INSERT INTO comments (id, comment, parent_id) VALUES (1, 'a', NULL), (2, 'b', 1), (3, 'c', 1), (4, 'd', 2)"))
+
+        await migrate(engine)
+
+        async with engine.connect() as conn:
+            ratings = (await conn.execute(text("SELECT user_id, rating_value FROM ratings ORDER BY id"))).all()
+            stats = (await conn.execute(text("SELECT rating_sum, rating_count, count_2 FROM movie_rating_stats"))).one()
+            reply_counts = (await conn.execute(text("SELECT id, reply_count FROM comments ORDER BY id"))).all()
+        await engine.dispose()
+        return ratings, stats, reply_counts
+
+    ratings, stats, reply_counts = asyncio.run(run())
+
+    assert ratings == [(1, 8), (2, 6)]
+    assert tuple(stats) == (14, 2, 0)
+    assert reply_counts == [(1, 2), (2, 1), (3, 0), (4, 0)]
+
+
+def test_case_duplicates_keep_lower_indexes_non_unique(monkeypatch):
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(MIGRATIONS[0].metadata.create_all)
+            await conn.execute(text(
+                "INSERT INTO users (email, username, full_name, hashed_password) "
+                "VALUES ('bob@example.com', 'Bob', 'Bob', 'x'), ('Bob@Example.com', 'bob', 'Bob', 'x')"))
+        await migrate(engine)
+
+        monkeypatch.setattr(crud, "USER_LOOKUP_CASE_INSENSITIVE", True)
+        async with AsyncSession(engine) as db:
+            duplicates = await user_crud_service.check_case_insensitive_lookup(db)
+        enabled = crud.USER_LOOKUP_CASE_INSENSITIVE
+
+        async with engine.begin() as conn:
+            await conn.execute(text("DELETE FROM users WHERE username = 'bob'"))
+            await conn.run_sync(v0008_unique_lower_user_indexes.make_unique)
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(
+                    "INSERT INTO users (email, username, full_name, hashed_password) "
+                    "VALUES ('BOB@example.com', 'robert', 'Bob', 'x')"))
+        except IntegrityError:
+            unique = True
+        else:
+            unique = False
+        await engine.dispose()
+        return duplicates, enabled, unique
+
+    duplicates, enabled, unique = asyncio.run(run())
+
+    assert duplicates == [{"column": "email", "value": "bob@example.com", "count": 2},
+                          {"column": "username", "value": "bob", "count": 2}]
+    # Lookups stay exact while either account could match a login
+    assert not enabled
+    assert unique
@@ -1,4 +1,9 @@
+import asyncio
 import pytest
+from fastapi.testclient import TestClient
+import movie_app.main as main
+from movie_app.leaderboard import leaderboards
+from movie_app.tests.conftest import TestingSessionLocal
 
 
 
@@ -210,3 +215,222 @@ def test_delete_movie(client, setup_database, username, password, movie_id, wron
     data = response.json()
     assert data == {"message": "Successful"}
     
+
+
+def test_search_movies(client, setup_database):
+    response = client.post(
+        "/login/", data={"username": "testuser",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    ids = {}
+    for title, description in [
+        ("The Dark Knight", "Batman fights crime in Gotham."),
+        ("Knight and Day", "An action comedy."),
+        ("Gotham Stories", "A knight walks the streets."),
+    ]:
+        response = client.post(
+            "/movies", json={"title": title, "genre": "Action", "description": description}, headers=headers)
+        ids[title] = response.json()["id"]
+
+    def search(q, **params):
+        response = client.get("/movies/search", params={"q": q, **params})
+        assert response.status_code == 200
+        return [result["movie"]["title"] for result in response.json()]
+
+    # Title matches outrank description matches, stemming applies
+    results = search("knights")
+    assert set(results[:2]) == {"The Dark Knight", "Knight and Day"}
+    assert results[2] == "Gotham Stories"
+
+    # Every term has to match
+    assert search("batman gotham") == ["The Dark Knight"]
+
+    # Prefix matching
+    assert len(search("knig")) == 3
+    assert search("knig", prefix=False) == []
+
+    assert search("knight", limit=1, offset=2) == ["Gotham Stories"]
+    assert search("!!") == []
+    assert client.get("/movies/search").status_code == 422
+
+    # The index follows updates and deletes
+    client.put(f"/movies/{ids['Knight and Day']}", json={"title": "Night and Day"}, headers=headers)
+    client.delete(f"/movies/{ids['The Dark Knight']}", headers=headers)
+    assert search("knight") == ["Gotham Stories"]
+    assert search("night") == ["Night and Day"]
+
+
+def test_similar_titles(client, setup_database):
+    response = client.post(
+        "/login/", data={"username": "testuser",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    ids = {}
+    for title in ["The Shawshank Redemption", "The Godfather"]:
+        response = client.post(
+            "/movies", json={"title": title, "genre": "Drama"}, headers=headers)
+        ids[title] = response.json()["id"]
+
+    def similar(title, **params):
+        response = client.get(f"/movies/title/{title}/similar", params=params)
+        if response.status_code == 404:
+            return []
+        assert response.status_code == 200
+        return response.json()
+
+    results = similar("shawshenk redemtion")
+    assert results[0]["movie"]["title"] == "The Shawshank Redemption"
+    assert 0 < results[0]["score"] < 1
+    assert [result["movie"]["title"] for result in similar("godfater", limit=1)] == ["The Godfather"]
+    assert similar("zzzz") == []
+    assert client.get("/movies/title/godfater/similar", params={"limit": 0}).status_code == 422
+
+    # The index follows updates and deletes
+    client.put(f"/movies/{ids['The Godfather']}", json={"title": "Casablanca"}, headers=headers)
+    client.delete(f"/movies/{ids['The Shawshank Redemption']}", headers=headers)
+    assert similar("casablanka")[0]["movie"]["title"] == "Casablanca"
+    assert similar("godfater") == []
+    assert similar("shawshenk redemtion") == []
+
+
+def test_suggest_titles(client, setup_database):
+    response = client.post(
+        "/login/", data={"username": "testuser",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    ids = {}
+    for title in ["The Dark Knight", "Dark City", "Darkman"]:
+        response = client.post(
+            "/movies", json={"title": title, "genre": "Action"}, headers=headers)
+        ids[title] = response.json()["id"]
+
+    def suggest(q, **params):
+        response = client.get("/movies/suggest", params={"q": q, **params})
+        assert response.status_code == 200
+        return [suggestion["title"] for suggestion in response.json()]
+
+    # Any word of the title can start the match, case and punctuation don't matter
+    assert suggest("dark") == ["Dark City", "The Dark Knight", "Darkman"]
+    assert suggest("DARK k") == ["The Dark Knight"]
+    assert suggest("the dark") == ["The Dark Knight"]
+    assert suggest("kni") == ["The Dark Knight"]
+    assert suggest("dark", limit=1) == ["Dark City"]
+    assert suggest("!!") == []
+    assert client.get("/movies/suggest").status_code == 422
+
+    # The index follows creates, updates and deletes
+    client.put(f"/movies/{ids['Dark City']}", json={"title": "Bright City"}, headers=headers)
+    client.delete(f"/movies/{ids['Darkman']}", headers=headers)
+    assert suggest("dark") == ["The Dark Knight"]
+    assert suggest("bri") == ["Bright City"]
+
+
+def test_filter_movies(client, setup_database):
+    response = client.post(
+        "/login/", data={"username": "testuser",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    ids = {}
+    for title, genre, year in [
+        ("Alpha", "Western", 1970),
+        ("Bravo", "Western", 1990),
+        ("Charlie", "Noir", 1950),
+        ("Delta", "Noir", 1995),
+    ]:
+        response = client.post(
+            "/movies", json={"title": title, "genre": genre, "release_year": year}, headers=headers)
+        ids[title] = response.json()["id"]
+    owner_id = response.json()["user_id"]
+
+    for title, value in [("Alpha", 9), ("Bravo", 4), ("Delta", 7)]:
+        client.put(f"/movies/ratings/movie_id/{ids[title]}", json={"rating_value": value}, headers=headers)
+
+    def titles(**params):
+        response = client.get("/movies/", params=params)
+        assert response.status_code == 200, response.json()
+        return [movie["title"] for movie in response.json()]
+
+    assert titles(genre="Western") == ["Alpha", "Bravo"]
+    assert titles(genre="Western", sort="newest") == ["Bravo", "Alpha"]
+    assert titles(genre=["Western", "Noir"], sort="title") == ["Alpha", "Bravo", "Charlie", "Delta"]
+    assert titles(genre=["Western", "Noir"], sort="rating") == ["Alpha", "Delta", "Bravo", "Charlie"]
+    assert titles(genre=["Western", "Noir"], min_rating=5, sort="title") == ["Alpha", "Delta"]
+    assert titles(year_from=1960, year_to=1992, sort="title") == ["Alpha", "Bravo"]
+    assert titles(owner_id=owner_id, year_to=1960) == ["Charlie"]
+    assert titles(genre="Noir", sort="title", limit=1, offset=1) == ["Delta"]
+
+    # Combinations no index can serve are rejected
+    for params in [{"sort": "rating"}, {"min_rating": 5},
+                   {"year_from": 2000, "year_to": 1990}, {"sort": "title", "cursor": "x"}]:
+        assert client.get("/movies/", params=params).status_code == 400
+    # Other parameters are ignored, like everywhere else
+    assert titles(genre="Western", page=1, _=123) == ["Alpha", "Bravo"]
+    assert client.get("/movies/", params={"sort": "budget"}).status_code == 422
+
+
+def test_leaderboards(client, setup_database):
+    headers = []
+    for i in range(3):
+        username = f"critic{i}"
+        client.post(
+            "/signup/", json={"username": username, "email": f"{username}@example.com", "full_name": "Critic", "password": "testpassword123"})
+        response = client.post(
+            "/login/", data={"username": username,  "password": "testpassword123"})
+        headers.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+
+    ids = {}
+    for title, genre in [("One Hit", "Musical"), ("Crowd Pleaser", "Musical"), ("Solid", "Opera")]:
+        response = client.post("/movies", json={"title": title, "genre": genre}, headers=headers[0])
+        ids[title] = response.json()["id"]
+
+    # A single 10 should not beat three 9s
+    client.put(f"/movies/ratings/movie_id/{ids['One Hit']}", json={"rating_value": 10}, headers=headers[0])
+    for critic in headers:
+        client.put(f"/movies/ratings/movie_id/{ids['Crowd Pleaser']}", json={"rating_value": 9}, headers=critic)
+    client.put(f"/movies/ratings/movie_id/{ids['Solid']}", json={"rating_value": 6}, headers=headers[1])
+    assert leaderboards.dirty
+
+    async def refresh():
+        async with TestingSessionLocal() as db:
+            await leaderboards.refresh(db)
+    asyncio.run(refresh())
+    assert not leaderboards.dirty
+
+    top = client.get("/movies/top").json()
+    titles = [movie["title"] for movie in top]
+    assert titles.index("Crowd Pleaser") < titles.index("One Hit") < titles.index("Solid")
+    crowd_pleaser = top[titles.index("Crowd Pleaser")]
+    assert crowd_pleaser["avg_rating"] == 9
+    assert crowd_pleaser["rating_count"] == 3
+    assert crowd_pleaser["score"] < 9
+
+    genre = client.get("/movies/top/genre/Musical").json()
+    assert [movie["title"] for movie in genre] == ["Crowd Pleaser", "One Hit"]
+    assert client.get("/movies/top/genre/Documentary").json() == []
+    assert len(client.get("/movies/top", params={"limit": 1}).json()) == 1
+    assert client.get("/movies/top", params={"limit": 0}).status_code == 422
+
+    # Everything was rated just now, the most rated movie trends first
+    assert client.get("/movies/top/trending").json()[0]["title"] == "Crowd Pleaser"
+
+
+def test_shutdown_waits_for_leaderboard_refresh(monkeypatch):
+    events = []
+
+    async def run(session_factory):
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            # Still returning its connection when cancelled
+            await asyncio.sleep(0.01)
+            events.append("refresh stopped")
+
+    class Pool:
+        def shutdown(self):
+            events.append("pool shut down")
+
+    monkeypatch.setattr(leaderboards, "run", run)
+    monkeypatch.setattr(main, "hashing_pool", Pool())
+    with TestClient(main.app):
+        pass
+    assert events == ["refresh stopped", "pool shut down"]
@@ -0,0 +1,236 @@
+import asyncio
+import pytest
+from sqlalchemy import update
+import movie_app.models as models
+from movie_app.crud import rating_crud_service
+from movie_app.tests.conftest import TestingSessionLocal, engine
+
+
+def test_seed_data(client, setup_database):
+    tokens = []
+    for i in range(3):
+        username = f"queryuser{i}"
+        response = client.post(
+            "/signup/", json={"username": username, "email": f"{username}@example.com", "full_name": "Query User", "password": "testpassword123"})
+        assert response.status_code == 201
+        response = client.post(
+            "/login/", data={"username": username,  "password": "testpassword123"})
+        tokens.append(response.json()["access_token"])
+
+    # Every row below is owned by a different user so nothing is shared in the identity map
+    for i, token in enumerate(tokens):
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.post(
+            "/movies", json={"title": f"Movie {i}", "genre": "Drama"}, headers=headers)
+        assert response.status_code == 201
+
+    for token in tokens:
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.post("/movies/ratings/1", json={"rating_value": 7}, headers=headers)
+        assert response.status_code == 201
+        response = client.post("/movies/comments/1", json={"comment": "Great movie"}, headers=headers)
+        assert response.status_code == 201
+
+
+@pytest.mark.parametrize("url", [
+    "/movies/",
+    "/movies/genre/Drama",
+    "/movies/ratings/",
+    "/movies/ratings/movie_id/1",
+    "/movies/comments/",
+    "/movies/comments/movie/1",
+])
+def test_list_query_count_is_constant(client, setup_database, count_queries, url):
+    counts = []
+    for limit in (1, 3):
+        count_queries.clear()
+        response = client.get(url, params={"limit": limit})
+        assert response.status_code == 200
+        assert len(response.json()) == limit
+        counts.append(len(count_queries))
+
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.parametrize("url", ["/movies/", "/movies/ratings/", "/movies/comments/", "/users/"])
+def test_cursor_pagination(client, setup_database, url):
+    expected = [item["id"] for item in client.get(url, params={"limit": 100}).json()]
+
+    seen, params = [], {"limit": 1}
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        seen.extend(item["id"] for item in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+    # Rows created within the same second are still ordered by id
+    assert seen == expected
+    assert len(seen) >= 3
+
+
+def test_invalid_cursor(client, setup_database):
+    response = client.get("/movies/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.parametrize("url", ["/movies/1", "/movies/ratings/average_rating/1", "/movies/comments/1"])
+def test_conditional_get(client, setup_database, count_queries, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-cache"
+    etag = response.headers["ETag"]
+
+    # Revalidation is answered from the version lookup alone
+    count_queries.clear()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    assert len(count_queries) == 1
+
+    assert client.get(url, headers={"If-None-Match": f'"stale", W/{etag}'}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": '"stale"'}).status_code == 200
+    assert "ETag" not in client.get(url.replace("1", "999")).headers
+
+
+def test_etag_changes_on_write(client, setup_database):
+    def etags():
+        return {url: client.get(url).headers["ETag"]
+                for url in ["/movies/1", "/movies/ratings/average_rating/1", "/movies/comments/1"]}
+
+    def login(username):
+        response = client.post(
+            "/login/", data={"username": username,  "password": "testpassword123"})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    owner, other = login("queryuser0"), login("queryuser1")
+    owner_id = client.get("/users/name/queryuser0").json()["id"]
+    writes = [
+        # The average rating's version includes the movie's, owner and all
+        (lambda: client.put(f"/users/{owner_id}", json={"full_name": "Renamed"}, headers=owner),
+         {"/movies/1", "/movies/ratings/average_rating/1", "/movies/comments/1"}),
+        (lambda: client.put("/movies/ratings/movie_id/1", json={"rating_value": 3}, headers=other),
+         {"/movies/ratings/average_rating/1"}),
+        (lambda: client.post("/movies/comments/reply_comment/1", json={"comment": "Agreed"}, headers=other),
+         {"/movies/comments/1"}),
+        (lambda: client.put("/movies/1", json={"description": "Edited"}, headers=owner),
+         {"/movies/1", "/movies/ratings/average_rating/1"}),
+    ]
+    for write, changed in writes:
+        before = etags()
+        assert write().status_code in (200, 201)
+        after = etags()
+        assert {url for url in before if before[url] != after[url]} == changed
+
+
+@pytest.mark.parametrize("url", ["/movies/1", "/movies/ratings/average_rating/1", "/movies/comments/1"])
+def test_repeated_reads_come_from_cache(client, setup_database, count_queries, url):
+    first = client.get(url).json()
+    count_queries.clear()
+    assert client.get(url).json() == first
+    # Only the ETag version lookup reaches the database
+    assert len(count_queries) == 1
+
+
+def test_cached_reads_follow_writes(client, setup_database):
+    def login(username):
+        response = client.post(
+            "/login/", data={"username": username,  "password": "testpassword123"})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    owner, other = login("queryuser0"), login("queryuser1")
+    owner_id = client.get("/users/name/queryuser0").json()["id"]
+    replies = client.get("/movies/comments/1").json()["replies"]
+
+    client.put(f"/users/{owner_id}", json={"full_name": "Cached Owner"}, headers=owner)
+    assert client.get("/movies/1").json()["owner"]["full_name"] == "Cached Owner"
+    assert client.get("/movies/comments/1").json()["Comment"]["author"]["full_name"] == "Cached Owner"
+
+    client.put("/movies/1", json={"description": "Cached edit"}, headers=owner)
+    assert client.get("/movies/1").json()["description"] == "Cached edit"
+
+    client.put("/movies/ratings/movie_id/1", json={"rating_value": 9}, headers=other)
+    assert client.get("/movies/ratings/average_rating/1").json()["data"]["histogram"]["9"] == 1
+
+    client.post("/movies/comments/reply_comment/1", json={"comment": "Cached reply"}, headers=other)
+    assert client.get("/movies/comments/1").json()["replies"] == replies + 1
+
+    stats = client.get("/cache/stats").json()["read"]["namespaces"]
+    assert {"movie", "rating_stats", "comment"} <= set(stats)
+    assert stats["movie"]["hits"] > 0
+
+
+@pytest.mark.parametrize("url, model, values, read", [
+    ("/movies/1", models.Movie, {"description": "Edited elsewhere"}, lambda body: body["description"]),
+    ("/movies/ratings/average_rating/1", models.Movie, {"title": "Retitled elsewhere"},
+     lambda body: body["data"]["movie_title"]),
+    ("/movies/comments/1", models.Comment, {"comment": "Edited elsewhere"}, lambda body: body["Comment"]["comment"]),
+])
+def test_cached_reads_follow_writes_from_other_workers(client, setup_database, url, model, values, read):
+    etag = client.get(url).headers["ETag"]
+
+    # Committed without invalidating this process' cache, like another worker would
+    async def write():
+        async with TestingSessionLocal() as db:
+            await db.execute(update(model).where(model.id == 1).values(**values))
+            await db.commit()
+    asyncio.run(write())
+
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert read(response.json()) == next(iter(values.values()))
+    assert client.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def query_plan(statements):
+    # Copy first, the EXPLAINs below are recorded by count_queries too
+    selects = [(statement, parameters) for statement, parameters in statements if statement.startswith("SELECT")]
+
+    async def explain():
+        async with engine.connect() as conn:
+            plans = []
+            for statement, parameters in selects:
+                result = await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+                plans.extend(row[-1] for row in result)
+            return "\n".join(plans)
+    return asyncio.run(explain())
+
+
+@pytest.mark.parametrize("url, index", [
+    ("/movies/genre/Drama", "ix_movies_genre_created_at_id"),
+    ("/movies/ratings/movie_id/1", "ix_ratings_movie_id_created_at_id"),
+    ("/movies/comments/movie/1", "ix_comments_movie_id_created_at_id"),
+    ("/movies/comments/user/1", "ix_comments_user_id_created_at_id"),
+    ("/movies/comments/replies/1", "ix_comments_parent_id_created_at_id"),
+])
+def test_filtered_lists_use_index(client, setup_database, count_queries, url, index):
+    client.get(url)
+    assert index in query_plan(count_queries)
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"sort": "newest"},
+    {"sort": "title"},
+    {"genre": "Drama", "sort": "newest"},
+    {"genre": ["Drama", "Comedy"], "sort": "rating"},
+    {"owner_id": 1},
+    {"year_from": 1990, "year_to": 2000, "min_rating": 5},
+])
+def test_movie_list_follows_query_plan(client, setup_database, count_queries, params):
+    response = client.get("/movies/", params=params)
+    assert response.status_code == 200
+    assert response.headers["X-Query-Plan"] in query_plan(count_queries)
+
+
+def test_rating_lookup_uses_unique_index(setup_database, count_queries):
+    async def lookup():
+        async with TestingSessionLocal() as db:
+            return await rating_crud_service.get_rating(db, user_id=1, movie_id=1)
+
+    assert asyncio.run(lookup()) is not None
+    assert "uq_ratings_user_id_movie_id" in query_plan(count_queries)
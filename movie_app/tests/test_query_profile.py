@@ -0,0 +1,106 @@
+import logging
+import time
+import orjson
+import pytest
+import movie_app.query_profile as query_profile
+from movie_app.query_profile import QueryProfile, fingerprint, query_profiler
+
+
+def test_fingerprint():
+    assert fingerprint("SELECT * FROM movies WHERE id = 42 AND title = 'It''s'") == \
+        "SELECT * FROM movies WHERE id = ? AND title = ?"
+    assert fingerprint("SELECT * FROM movies\n WHERE id IN ($1, $2, $3)") == \
+        fingerprint("SELECT * FROM movies WHERE id IN (?, ?)") == "SELECT * FROM movies WHERE id IN (...)"
+    assert fingerprint("SELECT count_1, movies.id FROM movies") == "SELECT count_1, movies.id FROM movies"
+
+
+def test_summary_flags_duplicates():
+    profile = QueryProfile()
+    profile.record("SELECT * FROM movies LIMIT ?", "MovieCRUDService.get_movies", 2.0, None)
+    for user_id in range(3):
+        profile.record(f"SELECT * FROM users WHERE id = {user_id}", "load_owner", 1.0, None)
+
+    summary = profile.summary()
+    assert (summary["count"], summary["total_ms"]) == (4, 5.0)
+    [users, movies] = summary["statements"]
+    assert (users["count"], users["callers"]) == (3, ["load_owner"])
+    assert summary["duplicates"] == [users["id"]]
+
+
+def test_header_fits_proxy_limits():
+    profile = QueryProfile()
+    for table in range(50):
+        profile.record(f"SELECT {', '.join(f'column_{i}' for i in range(40))} FROM table_{table}",
+                       "MovieCRUDService.get_movies", 1.0 + table, None)
+
+    header = profile.header(max_bytes=2048)
+    assert len(header) <= 2048
+    summary = orjson.loads(header)
+    assert summary["count"] == 50
+    assert summary["omitted"] == 50 - len(summary["statements"])
+    # The slowest statements are the ones kept
+    assert [statement["total_ms"] for statement in summary["statements"]][:2] == [50.0, 49.0]
+
+
+def test_unrequested_profiles_only_count(client, setup_database, monkeypatch):
+    calls = []
+    monkeypatch.setattr(query_profile, "caller", lambda: calls.append(1))
+    profiles = []
+    monkeypatch.setattr(query_profile, "QueryProfile", lambda detailed: profiles.append(QueryProfile(detailed)) or profiles[-1])
+
+    response = client.get("/movies/", params={"genre": "Drama"})
+    assert response.status_code == 200
+    assert "X-SQL-Profile" not in response.headers
+    [profile] = profiles
+    assert profile.count == 1 and profile.total_ms > 0
+    assert profile.queries == []
+    # No frame walk for statements nobody asked about
+    assert calls == []
+
+
+def test_seed_data(client, setup_database):
+    client.post(
+        "/signup/", json={"username": "profiler", "email": "profiler@example.com", "full_name": "Profiler", "password": "testpassword123"})
+    response = client.post("/login/", data={"username": "profiler",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.post("/movies", json={"title": "Profiled", "genre": "Drama"}, headers=headers)
+    assert response.status_code == 201
+
+
+@pytest.mark.parametrize("request_options", [
+    {"params": {"sql_profile": "1", "genre": "Drama"}},
+    {"params": {"genre": "Drama"}, "headers": {"X-SQL-Profile": "1"}},
+])
+def test_sql_profile(client, setup_database, monkeypatch, request_options):
+    monkeypatch.setattr(query_profile, "SQL_PROFILE_ENABLED", True)
+    response = client.get("/movies/", **request_options)
+
+    assert response.status_code == 200
+    profile = orjson.loads(response.headers["X-SQL-Profile"])
+    assert profile["count"] == 1
+    [statement] = profile["statements"]
+    assert statement["callers"] == ["MovieCRUDService.get_movies"]
+    assert statement["sql"].startswith("SELECT movies.id")
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+
+
+def test_sql_profile_is_off_by_default(client, setup_database):
+    response = client.get("/movies/", params={"genre": "Drama"}, headers={"X-SQL-Profile": "1"})
+    assert "X-SQL-Profile" not in response.headers
+
+
+def test_slow_queries_are_logged_and_explained(client, setup_database, monkeypatch, caplog):
+    caplog.set_level(logging.WARNING)
+    monkeypatch.setattr(query_profiler, "slow_ms", 0)
+    monkeypatch.setattr(query_profiler, "_explained", {})
+
+    client.get("/movies/genre/Drama")
+    deadline = time.monotonic() + 5
+    while query_profiler.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    slow = [record for record in caplog.records if hasattr(record, "slow_query")]
+    callers = {record.caller for record in slow if hasattr(record, "caller")}
+    assert "MovieCRUDService.get_movie_by_genre" in callers
+    plans = [record.plan for record in slow if hasattr(record, "plan")]
+    assert any("ix_movies_genre_created_at_id" in line for plan in plans for line in plan)
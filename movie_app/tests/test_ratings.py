@@ -1,4 +1,9 @@
+import asyncio
 import pytest
+from sqlalchemy import delete, select
+import movie_app.models as models
+from movie_app.crud import rating_crud_service
+from movie_app.tests.conftest import TestingSessionLocal
 
 
 @pytest.mark.parametrize("payload, expected_rating", [
@@ -236,3 +241,117 @@ def test_delete_rating(client, setup_database, rating_id, wrong_id):
     assert response.status_code == 200
     data = response.json()
     assert data == {"message": "Successful"}
+
+
+@pytest.mark.parametrize("movie_id, ratings, expected_avg_rating", [(2, [6, 9], 7.5)])
+def test_get_movie_rating_stats(client, setup_database, movie_id, ratings, expected_avg_rating):
+    for i, rating_value in enumerate(ratings):
+        username = f"rater{i}"
+        client.post(
+            "/signup/", json={"username": username, "email": f"{username}@example.com", "full_name": "Rater", "password": "testpassword123"})
+        response = client.post(
+            "/login/", data={"username": username,  "password": "testpassword123"})
+        token = response.json()["access_token"]
+
+        response = client.post(
+            f"/movies/ratings/{movie_id}", json={"rating_value": rating_value}, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 201
+        rated = (response.json()["id"], token)
+
+    response = client.get(f"/movies/ratings/average_rating/{movie_id}")
+
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["avg_rating"] == expected_avg_rating
+    assert data["rating_count"] == len(ratings)
+    assert data["histogram"]["6"] == 1
+    assert data["histogram"]["9"] == 1
+    assert data["histogram"]["1"] == 0
+
+    # Changing a rating moves it between histogram buckets
+    rating_id, token = rated
+    response = client.put(
+        f"/movies/ratings/{rating_id}", json={"rating_value": 3}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+    data = client.get(f"/movies/ratings/average_rating/{movie_id}").json()["data"]
+    assert data["avg_rating"] == 4.5
+    assert data["rating_count"] == len(ratings)
+    assert data["histogram"]["9"] == 0
+    assert data["histogram"]["3"] == 1
+
+
+@pytest.mark.parametrize("movie_id, expected_avg_rating", [(2, 4.5)])
+def test_rating_stats_drift(client, setup_database, movie_id, expected_avg_rating):
+    async def check(rebuild=False):
+        async with TestingSessionLocal() as db:
+            return await rating_crud_service.check_rating_stats(db, rebuild=rebuild)
+
+    async def wipe_stats():
+        async with TestingSessionLocal() as db:
+            await db.execute(delete(models.MovieRatingStats))
+            await db.commit()
+
+    assert asyncio.run(check()) == []
+
+    asyncio.run(wipe_stats())
+    drift = asyncio.run(check())
+    assert [item["movie_id"] for item in drift] == [movie_id]
+
+    asyncio.run(check(rebuild=True))
+    assert asyncio.run(check()) == []
+
+    data = client.get(f"/movies/ratings/average_rating/{movie_id}").json()["data"]
+    assert data["avg_rating"] == expected_avg_rating
+
+
+@pytest.mark.parametrize("movie_id, other_rating", [(2, 3)])
+def test_upsert_rating(client, setup_database, movie_id, other_rating):
+    def login(username):
+        client.post(
+            "/signup/", json={"username": username, "email": f"{username}@example.com", "full_name": "Rater", "password": "testpassword123"})
+        response = client.post(
+            "/login/", data={"username": username,  "password": "testpassword123"})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def updated_at(rating_id):
+        async with TestingSessionLocal() as db:
+            return await db.scalar(select(models.Rating.updated_at).where(models.Rating.id == rating_id))
+
+    # Replacing an existing rating keeps the same row
+    headers = login("rater0")
+    first = client.put(f"/movies/ratings/movie_id/{movie_id}", json={"rating_value": 10}, headers=headers)
+    assert first.status_code == 200
+    first_updated_at = asyncio.run(updated_at(first.json()["id"]))
+    again = client.put(f"/movies/ratings/movie_id/{movie_id}", json={"rating_value": 10}, headers=headers)
+    assert again.status_code == 200
+    assert again.json()["id"] == first.json()["id"]
+    assert asyncio.run(updated_at(first.json()["id"])) > first_updated_at
+    assert again.json()["rating_value"] == 10
+    assert again.json()["user"]["username"] == "rater0"
+
+    data = client.get(f"/movies/ratings/average_rating/{movie_id}").json()["data"]
+    assert data["rating_count"] == 2
+    assert data["avg_rating"] == (10 + other_rating) / 2
+
+    # A first rating is inserted
+    headers = login("rater2")
+    response = client.put(f"/movies/ratings/movie_id/{movie_id}", json={"rating_value": 5}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["user_id"] != first.json()["user_id"]
+
+    data = client.get(f"/movies/ratings/average_rating/{movie_id}").json()["data"]
+    assert data["rating_count"] == 3
+    assert data["histogram"]["5"] == 1
+
+    response = client.post(f"/movies/ratings/{movie_id}", json={"rating_value": 7}, headers=headers)
+    assert response.status_code == 409
+
+    response = client.put("/movies/ratings/movie_id/99", json={"rating_value": 5}, headers=headers)
+    assert response.status_code == 404
+
+    async def check():
+        async with TestingSessionLocal() as db:
+            return await rating_crud_service.check_rating_stats(db)
+
+    assert asyncio.run(check()) == []
@@ -0,0 +1,30 @@
+from movie_app.suggest import TitleSuggestions
+
+
+def test_suggest_matches_word_prefixes():
+    index = TitleSuggestions()
+    index.build([(1, "Star Wars"), (2, "A Star Is Born"), (3, "Stardust")])
+
+    assert index.suggest("star") == [(2, "A Star Is Born"), (1, "Star Wars"), (3, "Stardust")]
+    assert index.suggest("star w") == [(1, "Star Wars")]
+    assert index.suggest("  STAR   is") == [(2, "A Star Is Born")]
+    assert index.suggest("star", limit=2) == [(2, "A Star Is Born"), (1, "Star Wars")]
+    assert index.suggest("wars star") == []
+    assert index.suggest("") == []
+
+
+def test_add_and_remove():
+    index = TitleSuggestions()
+    index.build([(1, "Star Star")])
+    # A title matching at several words is suggested once
+    assert index.suggest("star") == [(1, "Star Star")]
+
+    index.add(2, "Starship Troopers")
+    index.add(1, "Alien")
+    assert index.suggest("star") == [(2, "Starship Troopers")]
+    assert index.suggest("ali") == [(1, "Alien")]
+
+    index.remove(2)
+    index.remove(3)
+    assert index.suggest("star") == []
+    assert len(index) == 1
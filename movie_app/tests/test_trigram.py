@@ -0,0 +1,43 @@
+import random
+import pytest
+from movie_app.trigram import TrigramIndex, similarity, trigrams
+
+
+def test_trigrams_match_pg_trgm():
+    assert trigrams("Up") == {"  u", " up", "up "}
+    assert trigrams("") == set()
+    # Example from the pg_trgm docs
+    assert similarity(trigrams("word"), trigrams("two words")) == pytest.approx(0.363636, abs=1e-6)
+
+
+def test_search_ranks_and_follows_changes():
+    index = TrigramIndex()
+    index.build([(1, "The Godfather"), (2, "The Godfather Part II"), (3, "Casablanca")])
+
+    results = index.search("godfater")
+    assert [movie_id for movie_id, _ in results] == [1, 2]
+    assert 0 < results[1][1] < results[0][1] < 1
+    assert index.search("godfater", limit=1) == results[:1]
+    assert index.search("zzzz") == []
+
+    index.add(3, "Goodfellas")
+    index.remove(1)
+    assert [movie_id for movie_id, _ in index.search("goodfelas")] == [3]
+    assert [movie_id for movie_id, _ in index.search("godfater")] == [2]
+
+
+def test_search_finds_every_match():
+    # Only the rarest query trigrams are walked, check nothing is missed
+    rng = random.Random(1)
+    titles = {movie_id: " ".join("".join(rng.choices("abcde", k=rng.randint(3, 6))) for _ in range(2))
+              for movie_id in range(500)}
+    index = TrigramIndex()
+    index.build(titles.items())
+
+    for query in ["abc dea", "bad", "eeca bbd", "cab"]:
+        expected = sorted(
+            ((movie_id, similarity(trigrams(query), trigrams(title))) for movie_id, title in titles.items()),
+            key=lambda match: (-match[1], match[0]),
+        )
+        expected = [match for match in expected if match[1] >= index.threshold]
+        assert index.search(query, limit=len(titles)) == expected
@@ -1,4 +1,11 @@
+import asyncio
 import pytest
+from sqlalchemy import delete
+import movie_app.models as models
+from movie_app.cache import RedisBackend, ReadThroughCache, principal_cache
+from movie_app.crud import user_crud_service
+from movie_app.tests.conftest import TestingSessionLocal
+from movie_app.tests.test_cache import FakeRedis
 
 
 @pytest.mark.parametrize("username, email, full_name, password", [("testuser", "testuser@example.com", "Test User", "testpassword123")])
@@ -26,6 +33,19 @@ def test_signup_existing_user(client, setup_database, username, email, full_name
     assert response.json() == {"detail": "User already registered"}
 
 
+@pytest.mark.parametrize("username, email", [
+    ("TestUser", "someone@example.com"),
+    ("someone", "TESTUSER@example.com"),
+    ("testuser@example.com", "someone@example.com"),
+])
+def test_signup_taken_ignoring_case(client, setup_database, username, email):
+    response = client.post(
+        "/signup/", json={"username": username, "email": email, "full_name": "Someone", "password": "testpassword123"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "User already registered"}
+
+
 @pytest.mark.parametrize("username, password", [("testuser", "testpassword123")])
 def test_login(client, setup_database, username, password):
 
@@ -56,6 +76,22 @@ def test_login(client, setup_database, username, password):
     data = response.json()
     assert data == {"detail": "Incorrect username or password"}
 
+@pytest.mark.parametrize("email, username", [("testuser@example.com", "testuser")])
+def test_lookup_by_email_or_username(client, setup_database, email, username):
+    async def lookup(credentials, **kwargs):
+        async with TestingSessionLocal() as db:
+            return await user_crud_service.get_user_by_email_or_username(db, credentials, **kwargs)
+
+    assert asyncio.run(lookup(email)).username == username
+    assert asyncio.run(lookup(username)).email == email
+    assert asyncio.run(lookup("wrong_username")) is None
+
+    # Exact match by default, case-insensitive when asked
+    assert asyncio.run(lookup(username.upper())) is None
+    assert asyncio.run(lookup(username.upper(), case_insensitive=True)).email == email
+    assert asyncio.run(lookup(email.upper(), case_insensitive=True)).username == username
+
+
 def test_get_users(client, setup_database):
 
     response = client.get("/users")
@@ -190,3 +226,59 @@ def test_delete_user(client, setup_database, username, password, user_id, wrong_
     assert response.status_code == 200
     data = response.json()
     assert data == {"message": "Successful"}
+
+    # Test the deleted user's token is no longer accepted
+    response = client.delete(
+        f"/users/{user_id}", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+
+
+def test_update_user_to_taken_name(client, setup_database):
+    def signup(username):
+        client.post(
+            "/signup/", json={"username": username, "email": f"{username}@example.com", "full_name": "Renamer", "password": "testpassword123"})
+        response = client.post(
+            "/login/", data={"username": username,  "password": "testpassword123"})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}, client.get(f"/users/name/{username}").json()["id"]
+
+    headers, user_id = signup("renamer")
+    signup("taken")
+
+    for payload in ({"username": "Taken"}, {"email": "TAKEN@example.com"}):
+        response = client.put(f"/users/{user_id}", json=payload, headers=headers)
+        assert response.status_code == 400
+        assert response.json() == {"detail": "User already registered"}
+
+    # Changing the case of one's own username is fine
+    response = client.put(f"/users/{user_id}", json={"username": "Renamer"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["username"] == "Renamer"
+
+
+def test_deleted_principal_is_dropped_on_every_worker(client, setup_database, monkeypatch):
+    # Both workers on one shared store, as with PRINCIPAL_CACHE_BACKEND=redis
+    redis = FakeRedis()
+    monkeypatch.setattr(principal_cache, "backend", RedisBackend(redis))
+    other_worker_cache = ReadThroughCache(RedisBackend(redis))
+
+    client.post(
+        "/signup/", json={"username": "leaver", "email": "leaver@example.com", "full_name": "Leaver", "password": "testpassword123"})
+    response = client.post(
+        "/login/", data={"username": "leaver",  "password": "testpassword123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    # Authenticated, then no such movie. The principal is cached now
+    assert client.delete("/movies/0", headers=headers).status_code == 404
+    assert "movie_app:principal:leaver" in redis.data
+
+    # Deleted by another worker, which invalidates the shared entries after committing
+    async def delete_elsewhere():
+        async with TestingSessionLocal() as db:
+            await db.execute(delete(models.User).where(models.User.username == "leaver"))
+            await db.commit()
+        await other_worker_cache.invalidate("principal", "leaver")
+        await other_worker_cache.invalidate("principal", "leaver@example.com")
+    asyncio.run(delete_elsewhere())
+
+    assert client.delete("/movies/0", headers=headers).status_code == 401
@@ -0,0 +1,108 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# Same default as pg_trgm.similarity_threshold, used by the `%` operator
+SIMILARITY_THRESHOLD = 0.3
+
+
+def trigrams(text: str):
+    """Trigrams the way pg_trgm's show_trgm() builds them.
+
+    Each alphanumeric word is lowercased and padded with two spaces in front
+    and one behind, so "Up" gives {"  u", " up", "up "}.
+    """
+    grams = set()
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a: set, b: set):
+    # pg_trgm similarity(): shared trigrams over all distinct trigrams
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+
+class TrigramIndex:
+    """In-process trigram index over movie titles, used where pg_trgm is not available.
+
+    Scores match pg_trgm similarity(), so SQLite and Postgres rank the same
+    candidates the same way.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.loaded = False
+        self._titles = {}
+        self._sizes = {}
+        self._postings = defaultdict(set)
+
+    def __len__(self):
+        return len(self._titles)
+
+    def build(self, rows):
+        for movie_id, title in rows:
+            self.add(movie_id, title)
+        self.loaded = True
+
+    def add(self, movie_id: int, title: str):
+        self.remove(movie_id)
+        grams = trigrams(title)
+        self._titles[movie_id] = title
+        self._sizes[movie_id] = len(grams)
+        for gram in grams:
+            self._postings[gram].add(movie_id)
+
+    def remove(self, movie_id: int):
+        title = self._titles.pop(movie_id, None)
+        if title is None:
+            return
+        del self._sizes[movie_id]
+        for gram in trigrams(title):
+            ids = self._postings[gram]
+            ids.discard(movie_id)
+            if not ids:
+                del self._postings[gram]
+
+    def clear(self):
+        self._titles.clear()
+        self._sizes.clear()
+        self._postings.clear()
+        self.loaded = False
+
+    def search(self, text: str, limit: int = 10):
+        """Return up to `limit` (movie_id, score) pairs, best first."""
+        query = trigrams(text)
+        if not query:
+            return []
+
+        # similarity >= threshold needs at least ceil(threshold * |query|)
+        # shared trigrams, so every match holds one of the |query| - needed + 1
+        # rarest query trigrams. Only those posting lists are walked, the
+        # remaining common ones are intersected with the candidates found.
+        needed = max(1, math.ceil(self.threshold * len(query) - 1e-9))
+        rarest = sorted(query, key=lambda gram: len(self._postings.get(gram, ())))
+        shared = Counter()
+        for gram in rarest[:len(query) - needed + 1]:
+            shared.update(self._postings.get(gram, ()))
+        candidates = set(shared)
+        for gram in rarest[len(query) - needed + 1:]:
+            shared.update(candidates & self._postings.get(gram, set()))
+
+        scored = []
+        for movie_id, count in shared.items():
+            if count < needed:
+                continue
+            score = count / (len(query) + self._sizes[movie_id] - count)
+            if score >= self.threshold:
+                scored.append((score, -movie_id))
+        return [(-movie_id, score) for score, movie_id in heapq.nlargest(limit, scored)]
+
+
+# Titles of the movies table, loaded on first use on databases without pg_trgm
+title_index = TrigramIndex()